@@ -8,6 +8,8 @@ if [ ! -f .initialized ]; then
 	python manage.py makemigrations quicksell_app
 	python manage.py migrate quicksell_app
 	python manage.py migrate
+	echo "Partitioning messages..."
+	python manage.py make_message_partitions --convert
 	echo "Collecting static files..."
 	python manage.py collectstatic --no-input
 	echo "Performing tests..."
@@ -15,4 +17,8 @@ if [ ! -f .initialized ]; then
     touch .initialized
 fi
 
+python manage.py make_message_partitions
+python manage.py import_tokens
+python manage.py clean_tokens
+
 exec "$@"
@@ -1,11 +1,22 @@
 """Gunicorn configuration file."""
 
 import multiprocessing
+import os
 
 bind = '0.0.0.0:8000'
 backlog = 2048
 worker_class = 'gthread'
-workers = multiprocessing.cpu_count() * 2 + 1
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# app splits password hashing processes between workers by it
+raw_env = [f'WEB_CONCURRENCY={workers}']
+threads = 8  # long-polling requests take LONG_POLLING['MAX_WAITING'] of them at most
 worker_connections = 1000
 timeout = 30
 keepalive = 3
+
+
+def post_worker_init(_worker):
+	"""Sends emails left in outbox when previous workers stopped."""
+	# app is loaded in worker by now - pylint: disable=import-outside-toplevel
+	from quicksell_app.mail import sender
+	sender.put(None)
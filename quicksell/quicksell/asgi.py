@@ -13,4 +13,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'quicksell.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# importing after Django is set up
+from quicksell_app.realtime import websocket_application  # noqa: E402 pylint: disable=wrong-import-position
+
+
+async def application(scope, receive, send):
+	"""Routes WebSocket connections to realtime events, the rest to Django."""
+	if scope['type'] == 'websocket':
+		await websocket_application(scope, receive, send)
+	else:
+		await django_application(scope, receive, send)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import multiprocessing
 import os
 from pathlib import Path
 
@@ -48,9 +49,9 @@ INSTALLED_APPS = [
 	'django.contrib.messages',
 	'django.contrib.staticfiles',
 	'django.contrib.gis',
+	'django.contrib.postgres',
 
 	'rest_framework',
-	'rest_framework.authtoken',
 	'mptt',
 	'drf_yasg',
 	'silk',
@@ -69,6 +70,7 @@ MIDDLEWARE = [
 	'django.contrib.auth.middleware.AuthenticationMiddleware',
 	'django.contrib.messages.middleware.MessageMiddleware',
 	'django.middleware.clickjacking.XFrameOptionsMiddleware',
+	'quicksell_app.hashers.OverloadedMiddleware',
 ]
 
 TEMPLATES = [
@@ -103,9 +105,48 @@ DATABASES = {
 }
 
 
+# Cache
+# Values of TwoTierCache are kept in each process and in the SHARED_CACHE['ALIAS']
+# cache shared by all processes, its `add` must be atomic, as it's used as a lock.
+# Computation of a missing value waits for LOCK_TIMEOUT seconds at most
+# for another process computing it, values are recomputed early
+# with probability scaled by BETA.
+
+CACHES = {
+	'default': {
+		'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+	},
+	'shared': {
+		'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+		'LOCATION': os.environ.get('MEMCACHED_LOCATION', 'quicksell_cache:11211'),
+	},
+}
+
+SHARED_CACHE = {'ALIAS': 'shared', 'BETA': 1.0, 'LOCK_TIMEOUT': 5}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
+# PBKDF2 is computed in pools of WORKERS processes per host, split between
+# APP_PROCESSES (gunicorn workers, WEB_CONCURRENCY), one at least in each.
+# At most MAX_PENDING hashings are running or queued in each app process,
+# others wait up to QUEUE_TIMEOUT seconds and get 503 response.
+
+PASSWORD_HASHERS = [
+	'quicksell_app.hashers.PooledPBKDF2PasswordHasher',
+	'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+	'django.contrib.auth.hashers.Argon2PasswordHasher',
+	'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
+PASSWORD_HASHING = {
+	'WORKERS': multiprocessing.cpu_count(),
+	'APP_PROCESSES': int(os.environ.get('WEB_CONCURRENCY', 1)),
+	'MAX_PENDING': 8,
+	'QUEUE_TIMEOUT': 5,
+}
+
 AUTH_PASSWORD_VALIDATORS = [
 	{'NAME': 'django.contrib.auth.password_validation.' + validator_name}
 	for validator_name in (
@@ -134,6 +175,16 @@ STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'static'
 
 
+# Media files (listings' photos, avatars)
+# Access is checked by the app, bytes are sent by the front proxy
+# if MEDIA_SENDFILE_HEADER is 'X-Accel-Redirect' (nginx) or 'X-Sendfile'.
+
+MEDIA_URL = '/api/media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+MEDIA_SENDFILE_HEADER = os.environ.get('MEDIA_SENDFILE_HEADER')
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
+
 # Django Rest Framework
 
 REST_FRAMEWORK = {
@@ -145,20 +196,89 @@ REST_FRAMEWORK = {
 		'rest_framework.parsers.JSONParser',
 	),
 	'DEFAULT_AUTHENTICATION_CLASSES': (
-		'rest_framework.authentication.TokenAuthentication',
+		'quicksell_app.authentication.CachedTokenAuthentication',
 	),
 	'DEFAULT_VERSIONING_CLASS':
 		'rest_framework.versioning.AcceptHeaderVersioning',
 	'TEST_REQUEST_DEFAULT_FORMAT': 'json',
 	'DEFAULT_THROTTLE_RATES': {
 		'password_reset.day': '50/day',
-		'password_reset.hour': '15/hour'
+		'password_reset.hour': '15/hour',
+		'login': '10/min',
+		'login.ip': '30/min',
+		'signup': '100/hour',
 	},
 	'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
 	'PAGE_SIZE': 10
 }
 
 
+# Throttling counters are kept in THROTTLE_STORE, DatabaseStore shares them
+# between all processes and nodes.
+
+THROTTLE_STORE = 'quicksell_app.throttling.DatabaseStore'
+
+
+# Locations
+# Coordinates are rounded to this number of decimal places (None to keep as is),
+# so nearby points share one Location.
+
+LOCATION_PRECISION = None
+
+# Users authenticated by token are cached for TTL seconds at most, in each process
+# for LOCAL_TTL seconds. Entries are invalidated when User or Profile is saved
+# or token is deleted, other processes see it after LOCAL_TTL.
+
+AUTH_TOKEN_CACHE = {'MAXSIZE': 10000, 'TTL': 300, 'LOCAL_TTL': 5}
+
+# Tokens expire LIFETIME seconds after they were last seen in use.
+# Use is recorded once in LAST_SEEN_INTERVAL seconds for each token,
+# in background unless EAGER.
+
+AUTH_TOKENS = {'LIFETIME': 30 * 24 * 3600, 'LAST_SEEN_INTERVAL': 300, 'EAGER': False}
+
+# Vector tiles of Listings are cached for TTL seconds at most, in each process
+# for LOCAL_TTL seconds. Tiles with changed Listings are invalidated earlier,
+# other processes see it after LOCAL_TTL.
+MAP_TILE_CACHE = {'MAXSIZE': 4096, 'TTL': 60, 'LOCAL_TTL': 5}
+
+
+# Chat search results are cached for TTL seconds at most,
+# until Chats of User or their unread counters change.
+
+CHAT_SEARCH_CACHE = {'MAXSIZE': 1000, 'TTL': 30, 'LOCAL_TTL': 5}
+
+
+# Realtime
+# Chat events are delivered over WebSockets at `api/chats/ws/` of ASGI app.
+# PostgresBackend fans events out between processes with LISTEN/NOTIFY,
+# InProcessBackend serves a single process only (tests, runserver).
+
+REALTIME_BACKEND = os.environ.get(
+	'REALTIME_BACKEND', 'quicksell_app.realtime.PostgresBackend')
+
+# Long-polling request holds a thread of WSGI worker while it waits,
+# so at most MAX_WAITING requests of a worker wait (below gunicorn's `threads`),
+# others are answered at once. WebSockets don't have this limit.
+
+LONG_POLLING = {'MAX_WAITING': 4}
+
+
+# Push notifications
+# Notifications queued for a device within WINDOW seconds are coalesced
+# into the latest one, failed FCM requests are retried RETRIES times
+# after BACKOFF, 2 * BACKOFF, ... seconds. EAGER sends them in place.
+
+PUSH_NOTIFICATIONS = {
+	'CLIENT': 'pyfcm.FCMNotification',
+	'WINDOW': 1,
+	'TIMEOUT': 5,
+	'RETRIES': 3,
+	'BACKOFF': 0.5,
+	'EAGER': False,
+}
+
+
 # Emails
 
 DEFAULT_FROM_EMAIL = 'Quicksell Mailer <noreply@quicksell.ru>'
@@ -166,6 +286,18 @@ EMAIL_HOST = 'localhost'
 EMAIL_PORT = 25
 EMAIL_USE_TLS = False
 
+# Emails are saved to outbox and sent in background after commit, due ones
+# are sent by BATCH_SIZE over one connection. Failed ones are retried RETRIES
+# times after BACKOFF, 2 * BACKOFF, ... seconds. EAGER sends them in place.
+
+OUTGOING_EMAIL = {
+	'WINDOW': 1,
+	'BATCH_SIZE': 50,
+	'RETRIES': 5,
+	'BACKOFF': 60,
+	'EAGER': False,
+}
+
 
 # Swagger
 
@@ -5,3 +5,8 @@ from django.apps import AppConfig
 
 class QuicksellAppConfig(AppConfig):
     name = 'quicksell_app'
+
+    def ready(self):
+        # connecting signals
+        # pylint: disable=import-outside-toplevel,unused-import
+        from quicksell_app import authentication, categories, realtime, tiles
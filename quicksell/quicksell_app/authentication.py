@@ -0,0 +1,98 @@
+"""Token authentication with cached Users."""
+
+import copy
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from quicksell_app.cache import TwoTierCache
+from quicksell_app.misc import BackgroundWorker
+from quicksell_app.models import AuthToken, Profile, User
+
+tokens = TwoTierCache(
+	'tokens', settings.AUTH_TOKEN_CACHE['MAXSIZE'],
+	settings.AUTH_TOKEN_CACHE['LOCAL_TTL'])
+
+
+def expiration(last_seen):
+	return last_seen + timedelta(seconds=settings.AUTH_TOKENS['LIFETIME'])
+
+
+class LastSeenRecorder(BackgroundWorker):
+	"""Saves time of tokens' last use in batches, postponing their expiration."""
+
+	window = 1  # seconds
+
+	def put(self, item):
+		if settings.AUTH_TOKENS['EAGER']:
+			self.handle([item])
+		else:
+			super().put(item)
+
+	def handle(self, batch):
+		last_seen = max(timestamp for _, timestamp in batch)
+		AuthToken.objects.filter(key__in={key for key, _ in batch}).update(
+			last_seen=last_seen, expires=expiration(last_seen))
+
+
+recorder = LastSeenRecorder()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+	"""Token authentication keeping User with Profile of recent keys in cache.
+
+	Each request gets its own copy of cached User. Use of a token is recorded
+	once in `LAST_SEEN_INTERVAL` seconds.
+	"""
+
+	model = AuthToken
+
+	@staticmethod
+	def load(key):
+		try:
+			token = AuthToken.objects.select_related(
+				'user___profile__location').get(key=key)
+		except AuthToken.DoesNotExist as err:
+			raise AuthenticationFailed(_('Invalid token.')) from err
+		if not token.user.is_active:
+			raise AuthenticationFailed(_('User inactive or deleted.'))
+		return token.user, token
+
+	def authenticate_credentials(self, key):
+		cached = tokens.get_or_set(
+			key, lambda: self.load(key), settings.AUTH_TOKEN_CACHE['TTL'])
+		token = cached[1]
+		now = datetime.now()
+		if token.expires <= now:
+			tokens.delete(key)
+			raise AuthenticationFailed(_('Token has expired.'))
+		if token.last_seen is None or (now - token.last_seen).total_seconds() >= (
+			settings.AUTH_TOKENS['LAST_SEEN_INTERVAL']
+		):
+			token.last_seen, token.expires = now, expiration(now)
+			tokens.set(key, cached, settings.AUTH_TOKEN_CACHE['TTL'])
+			recorder.put((key, now))
+		return copy.deepcopy(cached)
+
+
+def invalidate_user(user_id):
+	tokens.delete_many(list(
+		AuthToken.objects.filter(user_id=user_id).values_list('key', flat=True)))
+
+
+@receiver(post_delete, sender=AuthToken)
+def invalidate_token(instance, **_kwargs):
+	tokens.delete(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Profile)
+def invalidate_user_tokens(instance, created=False, **_kwargs):
+	# tokens may be cached by other processes, even if none is cached here
+	if not created:
+		invalidate_user(instance.pk)
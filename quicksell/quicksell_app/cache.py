@@ -0,0 +1,197 @@
+"""Caching utilities."""
+
+import hashlib
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class LRUCache:
+	"""Thread-safe bounded mapping, least recently used keys are evicted first.
+
+	If `ttl` is set, entries older than `ttl` seconds are treated as missing.
+	`evictions` is a number of entries evicted to keep the size.
+	"""
+
+	def __init__(self, maxsize, ttl=None):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.data = OrderedDict()
+		self.lock = threading.Lock()
+		self.evictions = 0
+
+	def __len__(self):
+		return len(self.data)
+
+	def get(self, key, default=None):
+		with self.lock:
+			try:
+				value, expires = self.data[key]
+			except KeyError:
+				return default
+			if expires is not None and expires < time.monotonic():
+				del self.data[key]
+				return default
+			self.data.move_to_end(key)
+			return value
+
+	def set(self, key, value):
+		expires = time.monotonic() + self.ttl if self.ttl else None
+		with self.lock:
+			self.data[key] = value, expires
+			self.data.move_to_end(key)
+			while len(self.data) > self.maxsize:
+				self.data.popitem(last=False)
+				self.evictions += 1
+
+	def delete(self, key):
+		with self.lock:
+			self.data.pop(key, None)
+
+	def clear(self):
+		with self.lock:
+			self.data.clear()
+
+
+class TwoTierCache:
+	"""Values in local LRUCache in front of cache shared by processes.
+
+	Shared cache is `SHARED_CACHE['ALIAS']` of CACHES, local entries live
+	for `local_ttl` seconds at most, so changes made by other processes
+	are seen after that. Missing value is computed once: other threads
+	of the process wait for it, other processes wait while the lock
+	in shared cache is held. Values are recomputed before they expire
+	with probability growing as expiration comes closer and proportional
+	to time of computation (XFetch), stale value is returned meanwhile.
+	"""
+
+	def __init__(self, prefix, maxsize, local_ttl):
+		self.prefix = prefix
+		self.local = LRUCache(maxsize, local_ttl)
+		self.lock = threading.Lock()
+		self.flights = {}
+		self.local_hits = 0
+		self.shared_hits = 0
+		self.misses = 0
+		self.early = 0
+
+	@property
+	def config(self):
+		return settings.SHARED_CACHE
+
+	@property
+	def shared(self):
+		return caches[self.config['ALIAS']]
+
+	def __len__(self):
+		return len(self.local)
+
+	@property
+	def evictions(self):
+		return self.local.evictions
+
+	def metrics(self):
+		return {
+			'local_hits': self.local_hits,
+			'shared_hits': self.shared_hits,
+			'misses': self.misses,
+			'early': self.early,
+			'evictions': self.evictions,
+			'size': len(self),
+		}
+
+	def shared_key(self, key):
+		return f'{self.prefix}:{hashlib.md5(repr(key).encode()).hexdigest()}'
+
+	def count(self, metric):
+		with self.lock:
+			setattr(self, metric, getattr(self, metric) + 1)
+
+	def expiring(self, entry):
+		"""Whether to recompute value before `expires` (XFetch)."""
+		_, delta, expires = entry
+		if expires is None:
+			return False
+		jitter = -delta * self.config['BETA'] * math.log(1 - random.random())
+		return time.time() + jitter >= expires
+
+	def get_or_set(self, key, compute, ttl=None):
+		"""Cached value of `key` or result of `compute()` cached for `ttl` seconds."""
+		entry, metric = self.local.get(key), 'local_hits'
+		if entry is None:
+			entry, metric = self.shared.get(self.shared_key(key)), 'shared_hits'
+		if entry is not None:
+			if not self.expiring(entry):
+				if metric == 'shared_hits':
+					self.local.set(key, entry)
+				self.count(metric)
+				return entry[0]
+			self.count('early')
+		else:
+			self.count('misses')
+		return self.recompute(key, compute, ttl, entry)
+
+	def recompute(self, key, compute, ttl, stale):
+		with self.lock:
+			flight = self.flights.get(key)
+			if leader := flight is None:
+				flight = self.flights[key] = threading.Event()
+		if not leader:
+			if stale is not None:
+				return stale[0]
+			flight.wait(self.config['LOCK_TIMEOUT'])
+			if (entry := self.local.get(key)) is not None:
+				return entry[0]
+			return self.fill(key, compute, ttl)
+		try:
+			return self.fill(key, compute, ttl, stale)
+		finally:
+			with self.lock:
+				del self.flights[key]
+			flight.set()
+
+	def fill(self, key, compute, ttl, stale=None):
+		shared_key = self.shared_key(key)
+		lock_key = f'{shared_key}:lock'
+		timeout = self.config['LOCK_TIMEOUT']
+		if not (locked := self.shared.add(lock_key, True, timeout)):
+			if stale is not None:
+				return stale[0]
+			deadline = time.monotonic() + timeout
+			while time.monotonic() < deadline:
+				time.sleep(0.05)
+				if (entry := self.shared.get(shared_key)) is not None:
+					self.local.set(key, entry)
+					return entry[0]
+		try:
+			start = time.monotonic()
+			value = compute()
+			delta = time.monotonic() - start
+			self.set(key, value, ttl, delta)
+			return value
+		finally:
+			if locked:
+				self.shared.delete(lock_key)
+
+	def set(self, key, value, ttl=None, delta=0):
+		entry = value, delta, time.time() + ttl if ttl else None
+		self.shared.set(self.shared_key(key), entry, ttl)
+		self.local.set(key, entry)
+
+	def delete(self, key):
+		self.local.delete(key)
+		self.shared.delete(self.shared_key(key))
+
+	def delete_many(self, keys):
+		for key in keys:
+			self.local.delete(key)
+		self.shared.delete_many([self.shared_key(key) for key in keys])
+
+	def clear(self):
+		"""Clears local entries, shared ones are left to expire."""
+		self.local.clear()
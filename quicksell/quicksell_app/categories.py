@@ -0,0 +1,124 @@
+"""Categories snapshot cached in process memory."""
+
+import hashlib
+import json
+import threading
+import uuid
+from typing import NamedTuple
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from quicksell_app.cache import TwoTierCache
+from quicksell_app.models import Category
+
+UNCATEGORIZED = '__uncategorized__'
+
+
+class CategoryEntry(NamedTuple):
+	"""Indexed Category."""
+
+	id: int
+	parent_id: int
+	tree_id: int
+	lft: int
+	rght: int
+	level: int
+	subtree: tuple
+
+	@property
+	def is_leaf(self):
+		return self.rght - self.lft == 1
+
+
+def build_index(rows):
+	"""Name to CategoryEntry from (id, parent_id, name, ...) rows in MPTT order.
+
+	Descendants of a node are the next (rght - lft - 1) / 2 rows.
+	"""
+	ids = [row[0] for row in rows]
+	return {
+		name: CategoryEntry(
+			pk, parent_id, tree_id, lft, rght, level,
+			tuple(ids[i:i + 1 + (rght - lft - 1) // 2])
+		)
+		for i, (pk, parent_id, name, tree_id, lft, rght, level) in enumerate(rows)
+	}
+
+
+def build_tree(rows):
+	"""Nested dict of names from (id, parent_id, name, ...) rows in MPTT order."""
+	tree = {}
+	nodes = {None: tree}
+	for pk, parent_id, name, *_ in rows:
+		if name != UNCATEGORIZED and (parent := nodes.get(parent_id)) is not None:
+			nodes[pk] = parent[name] = {}
+	return tree
+
+
+class CategoriesCache:
+	"""Categories loaded once and reloaded when shared version changes.
+
+	Rows of a version are loaded from database by one process,
+	others take them from shared cache.
+	"""
+
+	local_ttl = 1  # seconds before other processes see a new version
+	rows_ttl = 24 * 3600
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.shared = TwoTierCache('categories', 2, self.local_ttl)
+		self.version = None
+		self.tree_json = None
+		self.etag = None
+		self.index = {}
+
+	def current_version(self):
+		return self.shared.get_or_set('version', lambda: uuid.uuid4().hex)
+
+	def invalidate(self):
+		self.shared.set('version', uuid.uuid4().hex)
+		self.version = None
+
+	def invalidate_on_commit(self):
+		"""Invalidates for the current transaction and again after its commit,
+		as other processes may cache rows from before it under the new version.
+		"""
+		self.invalidate()
+		transaction.on_commit(self.invalidate)
+
+	def load(self):
+		version = self.current_version()
+		if version != self.version:
+			with self.lock:
+				if version != self.version:
+					self.build(version)
+					self.version = version
+		return self
+
+	def get(self, name):
+		return self.load().index.get(name)
+
+	@staticmethod
+	def load_rows():
+		return list(Category.objects.order_by('tree_id', 'lft').values_list(
+			'id', 'parent_id', 'name', 'tree_id', 'lft', 'rght', 'level'))
+
+	def build(self, version):
+		rows = self.shared.get_or_set(('rows', version), self.load_rows, self.rows_ttl)
+		self.index = build_index(rows)
+		self.tree_json = json.dumps(
+			{'categories': build_tree(rows)},
+			ensure_ascii=False, separators=(',', ':')
+		).encode()
+		self.etag = hashlib.md5(self.tree_json).hexdigest()
+
+
+categories = CategoriesCache()
+
+
+@receiver((post_save, post_delete), sender=Category)
+def invalidate(**_kwargs):
+	categories.invalidate_on_commit()
@@ -0,0 +1,134 @@
+"""Password hashing in a pool of processes."""
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException
+from rest_framework.status import HTTP_503_SERVICE_UNAVAILABLE
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(APIException):
+	"""Too many requests are waiting for password hashing."""
+
+	status_code = HTTP_503_SERVICE_UNAVAILABLE
+	default_detail = "Server is busy, try again later."
+	default_code = 'overloaded'
+
+	def __init__(self, wait):
+		super().__init__()
+		self.wait = wait  # sent as Retry-After header
+
+
+class OverloadedMiddleware:
+	"""Responds 503 to Overloaded raised outside of API views (admin login)."""
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+
+	def __call__(self, request):
+		return self.get_response(request)
+
+	def process_exception(self, _request, exception):
+		if not isinstance(exception, Overloaded):
+			return None
+		response = HttpResponse(
+			exception.detail, status=exception.status_code, content_type='text/plain')
+		response['Retry-After'] = str(exception.wait)
+		return response
+
+
+def pool_size(config):
+	"""Share of host's hashing WORKERS for one of its app processes."""
+	return max(config['WORKERS'] // config['APP_PROCESSES'], 1)
+
+
+class HashingPool:
+	"""Runs functions in processes of a pool, created lazily in each process.
+
+	Pool has `pool_size` processes. At most `MAX_PENDING` calls are running
+	or queued, others wait for their turn up to `QUEUE_TIMEOUT` seconds
+	and fail with Overloaded.
+	`depth` is a number of calls running or waiting, `pending` is a number
+	of calls running or queued in the pool.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.executor = None
+		self.slots = None
+		self.config = None
+		self.pid = None
+		self.depth = 0
+		self.pending = 0
+		self.rejected = 0
+
+	def metrics(self):
+		with self.lock:
+			return {
+				'depth': self.depth,
+				'pending': self.pending,
+				'rejected': self.rejected,
+			}
+
+	def get_executor(self):
+		config = settings.PASSWORD_HASHING
+		with self.lock:
+			if self.pid != os.getpid() or self.config != config:
+				if self.executor is not None and self.pid == os.getpid():
+					self.executor.shutdown(wait=False)
+				# forking threaded process is unsafe, workers are forked from a server
+				self.executor = ProcessPoolExecutor(
+					pool_size(config), multiprocessing.get_context('forkserver'))
+				self.slots = threading.BoundedSemaphore(config['MAX_PENDING'])
+				self.config, self.pid = config, os.getpid()
+			return self.executor, self.slots, config
+
+	def run(self, function, *args):
+		executor, slots, config = self.get_executor()
+		with self.lock:
+			self.depth += 1
+		try:
+			if not slots.acquire(timeout=config['QUEUE_TIMEOUT']):
+				with self.lock:
+					self.rejected += 1
+				logger.warning(
+					"Password hashing is overloaded, %d calls pending.", self.depth)
+				raise Overloaded(wait=max(config['QUEUE_TIMEOUT'], 1))
+			with self.lock:
+				self.pending += 1
+			try:
+				return executor.submit(function, *args).result()
+			finally:
+				with self.lock:
+					self.pending -= 1
+				slots.release()
+		finally:
+			with self.lock:
+				self.depth -= 1
+
+
+pool = HashingPool()
+
+
+def pbkdf2_encode(password, salt, iterations):
+	return PBKDF2PasswordHasher().encode(password, salt, iterations)
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+	"""PBKDF2 computed in the pool, so request threads are not blocked by it.
+
+	Hashes are the same as of PBKDF2PasswordHasher.
+	"""
+
+	def encode(self, password, salt, iterations=None):
+		assert password is not None
+		assert salt and '$' not in salt
+		return pool.run(pbkdf2_encode, password, salt, iterations or self.iterations)
@@ -0,0 +1,124 @@
+"""Emails sent in background from outbox."""
+
+import logging
+import threading
+from datetime import datetime, timedelta
+from smtplib import SMTPException
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import Min
+
+from quicksell_app.misc import BackgroundWorker
+from quicksell_app.models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+
+class MailSender(BackgroundWorker):
+	"""Sends due emails from outbox in batches over one connection.
+
+	Failed emails are retried with exponential backoff, rows locked
+	by another process are skipped.
+	"""
+
+	def __init__(self):
+		super().__init__()
+		self.timer = None
+
+	@property
+	def config(self):
+		return settings.OUTGOING_EMAIL
+
+	@property
+	def window(self):
+		return self.config['WINDOW']
+
+	def put(self, item):
+		if self.config['EAGER']:
+			self.handle([item])
+		else:
+			super().put(item)
+
+	def handle(self, batch):
+		while self.send_due():
+			pass
+		if not self.config['EAGER']:
+			self.schedule_retry()
+
+	def send_due(self):
+		"""Sends a batch of due emails, returns number of sent ones."""
+		now = datetime.now()
+		with transaction.atomic():
+			emails = list(
+				OutgoingEmail.objects.select_for_update(skip_locked=True)
+				.filter(next_attempt__lte=now).order_by('next_attempt')
+				[:self.config['BATCH_SIZE']]
+			)
+			if not emails:
+				return 0
+			sent, failed = self.send(emails)
+			OutgoingEmail.objects.filter(id__in=[email.id for email in sent]).delete()
+			for email in failed:
+				email.attempts += 1
+				email.next_attempt = None
+				if email.attempts <= self.config['RETRIES']:
+					email.next_attempt = now + timedelta(
+						seconds=self.config['BACKOFF'] * 2 ** (email.attempts - 1))
+			OutgoingEmail.objects.bulk_update(failed, ('attempts', 'next_attempt'))
+		return len(sent)
+
+	@staticmethod
+	def send(emails):
+		"""Sent and failed emails."""
+		connection = get_connection()
+		try:
+			connection.open()
+		except (SMTPException, OSError):
+			logger.exception("Connection to mail server failed.")
+			return [], emails
+		sent, failed = [], []
+		try:
+			for email in emails:
+				try:
+					email.message(connection).send()
+				except (SMTPException, OSError):
+					logger.exception("Sending email %d failed.", email.id)
+					failed.append(email)
+				else:
+					sent.append(email)
+		finally:
+			connection.close()
+		return sent, failed
+
+	def schedule_retry(self):
+		"""Wakes up worker when the earliest failed email is due.
+
+		Emails due already are locked by other processes sending them,
+		they are not waited for.
+		"""
+		due = OutgoingEmail.objects.filter(
+			next_attempt__gt=datetime.now()).aggregate(due=Min('next_attempt'))['due']
+		with self.lock:
+			if self.timer is not None:
+				self.timer.cancel()
+				self.timer = None
+			if due is not None:
+				self.timer = threading.Timer(
+					max((due - datetime.now()).total_seconds(), 0), self.put, (None,))
+				self.timer.daemon = True
+				self.timer.start()
+
+
+sender = MailSender()
+
+
+def queue_mail(subject, body, recipients, from_email=''):
+	"""Saves email to outbox, it's sent after current transaction is committed."""
+	OutgoingEmail.objects.create(
+		subject=subject, body=body, recipients=recipients, from_email=from_email)
+	if settings.OUTGOING_EMAIL['EAGER']:
+		sender.put(None)
+	else:
+		transaction.on_commit(lambda: sender.put(None))
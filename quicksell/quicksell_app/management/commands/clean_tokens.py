@@ -0,0 +1,25 @@
+"""Command to delete expired auth tokens."""
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from quicksell_app.models import AuthToken
+
+
+class Command(BaseCommand):
+	"""Deletes expired auth tokens in chunks, each in its own transaction.
+
+	Meant to be run daily.
+	"""
+	help = __doc__
+
+	def add_arguments(self, parser):
+		parser.add_argument('--chunk-size', type=int, default=1000)
+
+	def handle(self, *args, chunk_size, **kwargs):
+		expired = AuthToken.objects.filter(expires__lte=datetime.now())
+		deleted = 0
+		while keys := list(expired.values_list('key', flat=True)[:chunk_size]):
+			deleted += AuthToken.objects.filter(key__in=keys).delete()[0]
+		self.stdout.write(self.style.SUCCESS(f"Expired tokens deleted: {deleted}."))
@@ -0,0 +1,42 @@
+"""Command to move DRF auth tokens to AuthTokens."""
+
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from quicksell_app.models import AuthToken, User
+
+LEGACY_TABLE = 'authtoken_token'
+
+
+class Command(BaseCommand):
+	"""Copies tokens of `rest_framework.authtoken` to AuthTokens of Users'
+	devices, so Users stay logged in, and drops their table.
+
+	A token is skipped if its device already has one. Does nothing
+	if the table doesn't exist, so it's safe to run on every start.
+	"""
+	help = __doc__
+
+	def handle(self, *args, **kwargs):
+		if LEGACY_TABLE not in connection.introspection.table_names():
+			self.stdout.write(self.style.SUCCESS("No tokens to import."))
+			return
+		qn = connection.ops.quote_name
+		expires = datetime.now() + timedelta(seconds=settings.AUTH_TOKENS['LIFETIME'])
+		with transaction.atomic(), connection.cursor() as cursor:
+			cursor.execute(
+				f'INSERT INTO {qn(AuthToken._meta.db_table)} '
+				'(key, user_id, device_id, created, expires) '
+				'SELECT DISTINCT ON (coalesce(u.device_id, -t.user_id)) '
+				't.key, t.user_id, u.device_id, t.created, %s '
+				f'FROM {qn(LEGACY_TABLE)} t '
+				f'JOIN {qn(User._meta.db_table)} u ON u.id = t.user_id '
+				'ORDER BY coalesce(u.device_id, -t.user_id), t.created DESC '
+				'ON CONFLICT DO NOTHING', [expires]
+			)
+			imported = cursor.rowcount
+			cursor.execute(f'DROP TABLE {qn(LEGACY_TABLE)}')
+		self.stdout.write(self.style.SUCCESS(f"Tokens imported: {imported}."))
@@ -4,30 +4,103 @@ import json
 from json.decoder import JSONDecodeError
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
+from quicksell_app.categories import UNCATEGORIZED, categories
 from quicksell_app.models import Category
 
+TREE_FIELDS = ('parent', 'tree_id', 'lft', 'rght', 'level')
 
-def create_category(categories, parent=None):
-	for name, branch in categories.items():
-		create_category(branch, Category.objects.create(name=name, parent=parent))
+
+def layout_branch(nodes, branch, parent, tree_id, lft, level):
+	"""Appends (node, parent name) with precomputed MPTT fields in tree order.
+
+	Siblings are ordered by name like `order_insertion_by` does.
+	Returns next free `lft` value.
+	"""
+	if not isinstance(branch, dict):
+		raise CommandError(f"Branch of '{parent}' should be an object.")
+	for name in sorted(branch):
+		node = Category(name=name, tree_id=tree_id, lft=lft, level=level)
+		nodes.append((node, parent))
+		lft = layout_branch(nodes, branch[name], name, tree_id, lft + 1, level + 1)
+		node.rght = lft
+		lft += 1
+	return lft
+
+
+def layout_tree(tree):
+	nodes = []
+	tree = {UNCATEGORIZED: {}} | tree
+	for tree_id, name in enumerate(sorted(tree), start=1):
+		layout_branch(nodes, {name: tree[name]}, None, tree_id, 1, 0)
+	names = [node.name for node, _ in nodes]
+	if len(names) != len(set(names)):
+		raise CommandError("Category names should be unique.")
+	return nodes
 
 
 class Command(BaseCommand):
-	"""Populates Categories table from provided JSON file."""
+	"""Syncs Categories table with provided JSON file.
+
+	Only added, moved and removed Categories are written,
+	Listings are touched only if their Category was removed.
+	"""
 	help = __doc__
 
 	def add_arguments(self, parser):
 		parser.add_argument('filename', type=str)
 
 	def handle(self, *args, filename, **kwargs):
-		Category.objects.all().delete()
 		try:
 			with open(filename, encoding='utf-8') as f:
-				create_category(json.load(f))
+				nodes = layout_tree(json.load(f))
 		except OSError as err:
 			raise CommandError("OSError - " + err.args[1]) from err
 		except JSONDecodeError as err:
 			raise CommandError("JSONDecodeError - " + err.args[0]) from err
-		Category.objects.rebuild()
-		self.stdout.write(self.style.SUCCESS("Categories updated!"))
+		except TypeError as err:
+			raise CommandError("Categories should be an object.") from err
+		with transaction.atomic():
+			created, updated, deleted = self.sync(nodes)
+		categories.invalidate_on_commit()
+		self.stdout.write(self.style.SUCCESS(
+			f"Categories updated! Created: {created}, "
+			f"updated: {updated}, deleted: {deleted}."
+		))
+
+	@staticmethod
+	def sync(nodes):
+		existing = {
+			category.name: category for category in
+			Category.objects.select_for_update().only('name', *TREE_FIELDS)
+		}
+		ids = {name: category.id for name, category in existing.items()}
+		new = [(node, parent) for node, parent in nodes if node.name not in ids]
+		# parents are created before their children to know their ids
+		for level in sorted({node.level for node, _ in new}):
+			batch = []
+			for node, parent in new:
+				if node.level == level:
+					node.parent_id = ids.get(parent)
+					batch.append(node)
+			ids |= {
+				category.name: category.id
+				for category in Category.objects.bulk_create(batch)
+			}
+		updated = []
+		for node, parent in nodes:
+			if category := existing.pop(node.name, None):
+				node.id = category.id
+				node.parent_id = ids.get(parent)
+				if any(
+					getattr(node, field) != getattr(category, field)
+					for field in ('parent_id', 'tree_id', 'lft', 'rght', 'level')
+				):
+					updated.append(node)
+		# moving out children of removed Categories before deleting them
+		Category.objects.bulk_update(updated, TREE_FIELDS, batch_size=1000)
+		Category.objects.filter(
+			pk__in=[category.id for category in existing.values()]
+		).delete()
+		return len(new), len(updated), len(existing)
@@ -0,0 +1,226 @@
+"""Command to keep Messages in monthly partitions."""
+
+import re
+from datetime import date, datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Exists, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from quicksell_app.models import Chat, Message, UnreadCounter, User
+
+ARCHIVE_SCHEMA = 'message_archive'
+
+bound_values = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def add_months(day, months):
+	"""First day of the month `months` after month of `day`."""
+	years, month = divmod(day.month - 1 + months, 12)
+	return date(day.year + years, month + 1, 1)
+
+
+def parse_bound(value):
+	if value == 'MINVALUE':
+		return date.min
+	if value == 'MAXVALUE':
+		return date.max
+	return datetime.fromisoformat(value.strip("'")).date()
+
+
+class Command(BaseCommand):
+	"""Creates monthly partitions of Messages table ahead, archives old ones.
+
+	With --convert turns existing plain table into partitioned by `timestamp`
+	first, keeping all its rows in one partition. Messages without partition
+	are kept in default one until their partition is created.
+	Meant to be run daily.
+	"""
+	help = __doc__
+
+	def add_arguments(self, parser):
+		parser.add_argument('--convert', action='store_true')
+		parser.add_argument(
+			'--ahead', type=int, default=3,
+			help="Number of months to create partitions for."
+		)
+		parser.add_argument(
+			'--retain', type=int, default=None,
+			help=(
+				"Number of past months to keep, older partitions are detached "
+				f"and moved to '{ARCHIVE_SCHEMA}' schema."
+			)
+		)
+
+	def handle(self, *args, convert, ahead, retain, **kwargs):
+		self.table = Message._meta.db_table
+		self.qn = connection.ops.quote_name
+		this_month = date.today().replace(day=1)
+		with transaction.atomic(), connection.cursor() as cursor:
+			if convert and not self.is_partitioned(cursor):
+				self.convert(cursor, add_months(this_month, 1))
+			elif not self.is_partitioned(cursor):
+				raise CommandError("Messages table is not partitioned, use --convert.")
+			created = self.create_partitions(cursor, this_month, ahead)
+			archived = []
+			if retain is not None:
+				archived = self.archive(cursor, add_months(this_month, -retain))
+		self.stdout.write(self.style.SUCCESS(
+			f"Message partitions updated! Created: {created or 'none'}, "
+			f"archived: {archived or 'none'}."
+		))
+
+	def is_partitioned(self, cursor):
+		cursor.execute(
+			"SELECT EXISTS (SELECT FROM pg_partitioned_table "
+			"WHERE partrelid = %s::regclass)", [self.table]
+		)
+		return cursor.fetchone()[0]
+
+	def partitions(self, cursor):
+		"""(name, lower, upper) of partitions, bounds are None for default one."""
+		cursor.execute(
+			"SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+			"FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+			"WHERE i.inhparent = %s::regclass", [self.table]
+		)
+		partitions = []
+		for name, bound in cursor.fetchall():
+			if match := bound_values.search(bound):
+				partitions.append((name, *map(parse_bound, match.groups())))
+			else:
+				partitions.append((name, None, None))
+		return partitions
+
+	def convert(self, cursor, upper):
+		"""Replaces table with partitioned one, attaching old table as partition.
+
+		Indexes and constraints of old table are renamed, so the same ones
+		created on partitioned table by Django schema editor are attached
+		to them instead of being built again.
+		"""
+		qn, table, legacy = self.qn, self.table, f'{self.table}_legacy'
+		cursor.execute(f'LOCK TABLE {qn(table)} IN ACCESS EXCLUSIVE MODE')
+		constraints = connection.introspection.get_constraints(cursor, table)
+		cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(legacy)}')
+		for name, constraint in constraints.items():
+			new_name = qn(f'{name[:55]}_legacy')
+			if constraint['index'] and not (
+				constraint['primary_key'] or constraint['unique']
+			):
+				cursor.execute(f'ALTER INDEX {qn(name)} RENAME TO {new_name}')
+			else:
+				cursor.execute(
+					f'ALTER TABLE {qn(legacy)} RENAME CONSTRAINT {qn(name)} TO {new_name}')
+		timestamp = qn(Message._meta.get_field('timestamp').column)
+		pk = qn(Message._meta.pk.column)
+		cursor.execute(
+			f'CREATE TABLE {qn(table)} '
+			f'(LIKE {qn(legacy)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+			f'PARTITION BY RANGE ({timestamp})'
+		)
+		# primary key of partitioned table has to include partition key
+		cursor.execute(
+			f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(table + "_pkey")} '
+			f'PRIMARY KEY ({pk}, {timestamp})'
+		)
+		cursor.execute(
+			'SELECT pg_get_serial_sequence(%s, %s)', [legacy, Message._meta.pk.column])
+		if sequence := cursor.fetchone()[0]:
+			cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {qn(table)}.{pk}')
+		# pylint: disable=protected-access
+		with connection.schema_editor() as editor:
+			for field in Message._meta.local_fields:
+				for sql in editor._field_indexes_sql(Message, field):
+					editor.execute(sql)
+				if field.remote_field and field.db_constraint:
+					editor.execute(editor._create_fk_sql(
+						Message, field, '_fk_%(to_table)s_%(to_column)s'))
+			for index in Message._meta.indexes:
+				editor.add_index(Message, index)
+		cursor.execute(f'SELECT max({timestamp}) FROM {qn(legacy)}')
+		if (latest := cursor.fetchone()[0]) and latest.date() >= upper:
+			upper = add_months(latest.date(), 1)
+		cursor.execute(
+			f'ALTER TABLE {qn(table)} ATTACH PARTITION {qn(legacy)} '
+			'FOR VALUES FROM (MINVALUE) TO (%s)', [upper]
+		)
+		cursor.execute(
+			f'CREATE TABLE {qn(table + "_default")} PARTITION OF {qn(table)} DEFAULT')
+
+	def create_partitions(self, cursor, this_month, ahead):
+		qn, table = self.qn, self.table
+		partitions = self.partitions(cursor)
+		default = next((name for name, lower, _ in partitions if lower is None), None)
+		timestamp = qn(Message._meta.get_field('timestamp').column)
+		created = []
+		for month in range(ahead + 1):
+			lower, upper = add_months(this_month, month), add_months(this_month, month + 1)
+			if any(
+				p_lower is not None and p_lower < upper and p_upper > lower
+				for _, p_lower, p_upper in partitions
+			):
+				continue
+			name = f'{table}_y{lower:%Y}m{lower:%m}'
+			cursor.execute(
+				f'CREATE TABLE {qn(name)} '
+				f'(LIKE {qn(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+			)
+			if default:
+				# Messages which got to default partition are moved to the new one
+				cursor.execute(
+					f'WITH moved AS (DELETE FROM {qn(default)} '
+					f'WHERE {timestamp} >= %s AND {timestamp} < %s RETURNING *) '
+					f'INSERT INTO {qn(name)} SELECT * FROM moved', [lower, upper]
+				)
+			cursor.execute(
+				f'ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} '
+				'FOR VALUES FROM (%s) TO (%s)', [lower, upper]
+			)
+			created.append(name)
+		return created
+
+	def discount_unread(self, lower, upper):
+		"""Subtracts unread Messages from `lower` to `upper` from counters
+		of Chats and their participants."""
+		unread = Message.objects.filter(
+			chat=OuterRef('pk'), read=False, timestamp__gte=lower, timestamp__lt=upper
+		).order_by()
+		chats = Chat.objects.filter(Exists(unread))
+		users = set()
+		for creator, interlocutor in chats.values_list('creator', 'interlocutor'):
+			users.update((creator, interlocutor))
+		chats.update(**{
+			f'{participant}_unread': Greatest(F(f'{participant}_unread') - Coalesce(
+				Subquery(
+					unread.exclude(author=OuterRef(participant)).values('chat')
+					.annotate(count=Count('id')).values('count')
+				), 0
+			), 0)
+			for participant in ('creator', 'interlocutor')
+		})
+		UnreadCounter.objects.recount(User.objects.filter(pk__in=users))
+
+	def archive(self, cursor, cutoff):
+		"""Detaches partitions older than `cutoff` without their foreign keys.
+
+		Their unread Messages are not counted as unread anymore.
+		"""
+		qn = self.qn
+		cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {qn(ARCHIVE_SCHEMA)}')
+		archived = []
+		for name, lower, upper in self.partitions(cursor):
+			if upper is None or upper > cutoff:
+				continue
+			self.discount_unread(lower, upper)
+			cursor.execute(f'ALTER TABLE {qn(self.table)} DETACH PARTITION {qn(name)}')
+			cursor.execute(
+				"SELECT conname FROM pg_constraint "
+				"WHERE conrelid = %s::regclass AND contype = 'f'", [name]
+			)
+			for (constraint,) in cursor.fetchall():
+				cursor.execute(f'ALTER TABLE {qn(name)} DROP CONSTRAINT {qn(constraint)}')
+			cursor.execute(f'ALTER TABLE {qn(name)} SET SCHEMA {qn(ARCHIVE_SCHEMA)}')
+			archived.append(name)
+		return archived
@@ -0,0 +1,32 @@
+"""Command to precompute similar Listings."""
+
+from django.core.management.base import BaseCommand
+
+from quicksell_app.models import Listing
+from quicksell_app.similar import Pools, outdated, refresh
+
+
+class Command(BaseCommand):
+	"""Recomputes similar Listings of changed Listings and Listings near them.
+
+	With --full recomputes them for all Listings. Meant to be run periodically.
+	"""
+	help = __doc__
+
+	def add_arguments(self, parser):
+		parser.add_argument('--full', action='store_true')
+		parser.add_argument('--chunk-size', type=int, default=500)
+
+	def handle(self, *args, full, chunk_size, **kwargs):
+		if full:
+			ids = Listing.objects.values_list('id', flat=True)
+		else:
+			ids = outdated()
+		ids = sorted(ids)
+		pools = Pools()
+		refreshed = 0
+		for start in range(0, len(ids), chunk_size):
+			refreshed += refresh(ids[start:start + chunk_size], pools)
+		self.stdout.write(self.style.SUCCESS(
+			f"Similar Listings updated! Checked: {len(ids)}, active: {refreshed}."
+		))
@@ -0,0 +1,46 @@
+"""Command to fill Chats' denormalized latest Message, creation time
+and Users' counters."""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Exists, F, Func, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from quicksell_app.models import Chat, Message, UnreadCounter, User
+
+
+class Command(BaseCommand):
+	"""Fills Chats' `last_message_*` fields, unread counters and missing
+	`created_at` from Messages, and Users' Chats counters.
+
+	Needed once for Chats created before the fields were added.
+	"""
+	help = __doc__
+
+	def handle(self, *args, **kwargs):
+		latest = Message.objects.filter(chat=OuterRef('pk')).order_by('-timestamp')
+		unread = Message.objects.filter(chat=OuterRef('pk'), read=False).order_by()
+		with transaction.atomic():
+			updated = Chat.objects.filter(Exists(latest)).update(**{
+				f'last_message_{field}': Subquery(latest.values(field)[:1])
+				for field in ('text', 'author', 'timestamp', 'read')
+			} | {
+				f'{participant}_unread': Coalesce(Subquery(
+					unread.exclude(author=OuterRef(participant)).values('chat')
+					.annotate(count=Count('id')).values('count')
+				), 0)
+				for participant in ('creator', 'interlocutor')
+			})
+			# the first Message is the earliest known time of old Chats
+			Chat.objects.filter(created_at=None).update(created_at=Coalesce(
+				Subquery(latest.reverse().values('timestamp')[:1]), F('updated_at')))
+			UnreadCounter.objects.recount(User.objects.all())
+			User.objects.update(
+				chats_count=Coalesce(Subquery(
+					Chat.objects.filter(
+						Q(creator=OuterRef('pk')) | Q(interlocutor=OuterRef('pk'))
+					).order_by().annotate(total=Func(F('id'), function='COUNT'))
+					.values('total')
+				), 0),
+			)
+		self.stdout.write(self.style.SUCCESS(f"Chats updated: {updated}."))
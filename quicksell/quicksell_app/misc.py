@@ -1,7 +1,12 @@
 """Miscellaneous useful stuff."""
 
+import logging
+import queue
+import threading
+import time
+
+from django.db import close_old_connections
 from rest_framework.metadata import BaseMetadata
-from rest_framework.throttling import UserRateThrottle
 
 
 class NoMetadata(BaseMetadata):
@@ -14,11 +19,51 @@ class NoMetadata(BaseMetadata):
 		)
 
 
-class PasswordResetDaily(UserRateThrottle):
-	"""Rate limit on password reset endpoint per day."""
-	scope = 'password_reset.day'
+class BackgroundWorker:
+	"""Daemon thread handling queued items in batches.
+
+	Items queued within `window` seconds after the first one
+	are passed to `handle()` together. Thread is started on first item,
+	so each forked process gets its own.
+	"""
+
+	window = 0  # seconds
+
+	def __init__(self):
+		self.items = queue.Queue()
+		self.lock = threading.Lock()
+		self.thread = None
+
+	def put(self, item):
+		with self.lock:
+			if self.thread is None or not self.thread.is_alive():
+				self.thread = threading.Thread(
+					target=self.run, name=type(self).__name__, daemon=True)
+				self.thread.start()
+		self.items.put(item)
+
+	def collect(self):
+		batch = [self.items.get()]
+		deadline = time.monotonic() + self.window
+		while (remaining := deadline - time.monotonic()) > 0:
+			try:
+				batch.append(self.items.get(timeout=remaining))
+			except queue.Empty:
+				break
+		return batch
 
+	def run(self):
+		while True:
+			batch = self.collect()
+			try:
+				self.handle(batch)
+			except Exception:  # pylint: disable=broad-except
+				logging.getLogger(__name__).exception(
+					"%s failed to handle %d items.", type(self).__name__, len(batch))
+			finally:
+				close_old_connections()
+				for _ in batch:
+					self.items.task_done()
 
-class PasswordResetHourly(UserRateThrottle):
-	"""Rate limit on password reset endpoint per hour."""
-	scope = 'password_reset.hour'
+	def handle(self, batch):
+		raise NotImplementedError
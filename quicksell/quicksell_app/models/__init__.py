@@ -1,6 +1,8 @@
 """Models."""
 
-from .chat import Chat, Message
+from .chat import Chat, Message, UnreadCounter
 from .geography import Location
-from .listing import Category, Listing
-from .user import BusinessAccount, Device, Profile, User
+from .listing import Category, Listing, SimilarListing
+from .mail import OutgoingEmail
+from .throttle import ThrottleCounter
+from .user import AuthToken, BusinessAccount, Device, Profile, User
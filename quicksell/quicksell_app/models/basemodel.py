@@ -1,6 +1,10 @@
 """Base models and models' common things."""
 
+import time
+
+from django.db import transaction
 from django.db.models import Manager, Model
+from django.db.models.signals import post_delete
 
 
 class QuicksellManager(Manager):
@@ -34,3 +38,44 @@ class QuicksellModel(Model, SerializationMixin):
 
 	class Meta:
 		abstract = True
+
+
+class SentinelRow:
+	"""Id of a constant row (e.g. column default), resolved once per process.
+
+	Id is remembered only after commit, so rolled back rows are not cached,
+	and forgotten when the row is deleted, so it will be resolved again.
+	Rows deleted by other processes are noticed when remembered id
+	is rechecked, once in `recheck_interval` seconds.
+	"""
+
+	recheck_interval = 60  # seconds
+
+	def __init__(self, model, **lookup):
+		self.model = model
+		self.lookup = lookup
+		self.pk = None
+		self.checked = None
+		post_delete.connect(self.forget, sender=model, weak=False)
+
+	def get_pk(self):
+		if (pk := self.pk) is not None and (
+			time.monotonic() - self.checked > self.recheck_interval
+		):
+			if self.model.objects.filter(pk=pk).exists():
+				self.checked = time.monotonic()
+			else:
+				self.forget()
+				pk = None
+		if pk is None:
+			pk = self.model.objects.get_or_create(**self.lookup)[0].pk
+			transaction.on_commit(lambda: self.remember(pk))
+		return pk
+
+	def remember(self, pk):
+		self.checked = time.monotonic()
+		self.pk = pk
+
+	def forget(self, instance=None, **_kwargs):
+		if instance is None or instance.pk == self.pk:
+			self.pk = None
@@ -1,13 +1,28 @@
 """Chat and Message models."""
 
 import uuid
+from datetime import datetime
 
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.db import connection, transaction
 from django.db.models import (
-	CASCADE, BooleanField, CharField, DateTimeField, ForeignKey, TextField,
-	UUIDField
+	CASCADE, SET_NULL, BooleanField, Case, CharField, DateTimeField, F,
+	ForeignKey, Index, OneToOneField, OuterRef, PositiveIntegerField, Q,
+	Subquery, Sum, TextField, UUIDField, Value, When
 )
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
 
-from .basemodel import QuicksellModel
+from .basemodel import QuicksellManager, QuicksellModel
+from .user import User
+
+# sent with `chat`, `reader` and `until` when Messages were marked as read
+messages_read = Signal()
+
+# 'simple' configuration does not stem words, Messages may be in any language
+text_search = SearchVector('text', config='simple')
 
 
 class Chat(QuicksellModel):
@@ -25,8 +40,89 @@ class Chat(QuicksellModel):
 		editable=False, null=True
 	)
 	subject = CharField(max_length=200)
+	# Messages are not older than it, it bounds their partitions;
+	# null for Chats created before it was added, until `sync_chats`
+	created_at = DateTimeField(auto_now_add=True, null=True, editable=False)
 	updated_at = DateTimeField(auto_now=True)
 
+	# denormalized latest Message, maintained by Message.save()
+	last_message_text = TextField(max_length=2000, blank=True, default='')
+	last_message_author = ForeignKey(
+		'User', related_name='+', on_delete=SET_NULL, null=True, editable=False
+	)
+	last_message_timestamp = DateTimeField(null=True, editable=False)
+	last_message_read = BooleanField(default=False)
+
+	# unread Messages of each participant, maintained by Message.save()
+	creator_unread = PositiveIntegerField(default=0, editable=False)
+	interlocutor_unread = PositiveIntegerField(default=0, editable=False)
+
+	class Meta:
+		indexes = [
+			Index(fields=['creator', '-updated_at', '-id']),
+			Index(fields=['interlocutor', '-updated_at', '-id']),
+			Index(fields=['listing', '-updated_at']),
+		]
+
+	def unread_field(self, user_id):
+		if user_id == self.creator_id:
+			return 'creator_unread'
+		return 'interlocutor_unread'
+
+	def unread_by(self, user):
+		return getattr(self, self.unread_field(user.id))
+
+	def mark_read(self, reader, until, ids=None, since=None):
+		"""Marks Messages of `reader`'s interlocutor as read, updates counters.
+
+		Only unread Messages up to `until` timestamp are updated,
+		and only those with `ids` if they are given.
+		`since` bounds the update to recent Messages partitions.
+		"""
+		messages = self.messages.filter(read=False, timestamp__lte=until)
+		if ids is not None:
+			messages = messages.filter(id__in=ids)
+		if since is not None:
+			messages = messages.filter(timestamp__gte=since)
+		unread = self.unread_field(reader.id)
+		with transaction.atomic():
+			count = messages.exclude(author=reader).update(read=True)
+			if not count:
+				return 0
+			Chat.objects.filter(pk=self.pk).update(**{
+				unread: Greatest(F(unread) - count, 0),
+				'last_message_read': Case(
+					When(
+						~Q(last_message_author=reader),
+						last_message_timestamp__lte=until, then=Value(True)
+					),
+					default=F('last_message_read')
+				),
+			})
+			UnreadCounter.objects.add(reader.id, -count)
+			messages_read.send(Chat, chat=self, reader=reader, until=until)
+		return count
+
+	@property
+	def dated_messages(self):
+		"""Messages bounded by Chat's creation and latest Message timestamps,
+		so only partitions of Chat's lifetime are scanned."""
+		messages = self.messages.filter(
+			timestamp__lte=self.last_message_timestamp or datetime.now())
+		if self.created_at is not None:
+			messages = messages.filter(timestamp__gte=self.created_at)
+		return messages
+
+	@property
+	def last_message(self):
+		if self.last_message_timestamp is None:
+			return None
+		return Message(
+			chat=self, author_id=self.last_message_author_id,
+			text=self.last_message_text, timestamp=self.last_message_timestamp,
+			read=self.last_message_read
+		)
+
 
 class Message(QuicksellModel):
 	"""Message in Chat."""
@@ -40,3 +136,127 @@ class Message(QuicksellModel):
 	text = TextField(max_length=2000)
 	timestamp = DateTimeField(auto_now_add=True)
 	read = BooleanField(default=False)
+
+	class Meta:
+		indexes = [
+			Index(
+				fields=['chat', 'timestamp'], condition=Q(read=False),
+				name='message_unread_idx'
+			),
+			Index(fields=['chat', 'timestamp', 'id']),
+			GinIndex(text_search, name='message_text_search_idx'),
+		]
+
+	def save(self, *args, **kwargs):
+		if not self._state.adding:
+			return super().save(*args, **kwargs)
+		chat = self.chat
+		recipient_id = (
+			chat.interlocutor_id if self.author_id == chat.creator_id
+			else chat.creator_id
+		)
+		unread = chat.unread_field(recipient_id)
+		chat_row = Chat.objects.filter(pk=chat.pk)
+		with transaction.atomic():
+			super().save(*args, **kwargs)
+			if not chat_row.filter(
+				Q(last_message_timestamp=None)
+				| Q(last_message_timestamp__lte=self.timestamp)
+			).update(**{
+				'last_message_text': self.text,
+				'last_message_author': self.author_id,
+				'last_message_timestamp': self.timestamp,
+				'last_message_read': self.read,
+				'updated_at': self.timestamp,
+				unread: F(unread) + 1,
+			}):
+				chat_row.update(**{unread: F(unread) + 1})
+			UnreadCounter.objects.add(recipient_id, 1)
+		return None
+
+
+def unread_total(participant):
+	"""Sum of User's unread counters in Chats where User is `participant`."""
+	return Coalesce(Subquery(
+		Chat.objects.filter(**{participant: OuterRef('pk')}).order_by()
+		.values(participant).annotate(total=Sum(f'{participant}_unread'))
+		.values('total')
+	), 0)
+
+
+class UnreadCounterManager(QuicksellManager):
+	"""Unread Messages counters manager."""
+
+	def get_count(self, user_id):
+		return self.filter(user_id=user_id).values_list(
+			'messages', flat=True).first() or 0
+
+	def add(self, user_id, delta):
+		"""Adds `delta` to User's counter, it doesn't go below zero.
+
+		Counter is created by the first increment.
+		"""
+		if delta < 0:
+			self.filter(user_id=user_id).update(
+				messages=Greatest(F('messages') + delta, 0))
+			return
+		table = connection.ops.quote_name(self.model._meta.db_table)
+		with connection.cursor() as cursor:
+			cursor.execute(
+				f'INSERT INTO {table} (user_id, messages) VALUES (%s, %s) '
+				f'ON CONFLICT (user_id) DO UPDATE SET messages = {table}.messages + %s',
+				[user_id, delta, delta]
+			)
+
+	def recount(self, users):
+		"""Sets counters of `users` to sums of their Chats' counters."""
+		totals = users.annotate(
+			total=unread_total('creator') + unread_total('interlocutor')
+		).values_list('pk', 'total')
+		with transaction.atomic():
+			self.filter(user__in=users.values('pk')).delete()
+			self.bulk_create(
+				(self.model(user_id=pk, messages=total) for pk, total in totals if total),
+				ignore_conflicts=True
+			)
+
+
+class UnreadCounter(QuicksellModel):
+	"""Number of User's unread Messages in all Chats.
+
+	Kept apart from User, so new Messages don't lock User rows.
+	"""
+
+	objects = UnreadCounterManager()
+
+	user = OneToOneField(
+		User, related_name='+', primary_key=True, on_delete=CASCADE, editable=False
+	)
+	messages = PositiveIntegerField(default=0)
+
+
+@receiver(post_save, sender=Chat)
+def count_chat(instance, created, **_kwargs):
+	if created:
+		User.objects.filter(
+			pk__in={instance.creator_id, instance.interlocutor_id}
+		).update(chats_count=F('chats_count') + 1)
+
+
+@receiver(post_delete, sender=Chat)
+def discount_chat(instance, **_kwargs):
+	User.objects.filter(
+		pk__in={instance.creator_id, instance.interlocutor_id}
+	).update(chats_count=Greatest(F('chats_count') - 1, 0))
+
+
+@receiver(pre_delete, sender=Chat)
+def discount_unread(instance, **_kwargs):
+	# counters of the instance may be outdated, the row is locked till deleted
+	counters = Chat.objects.select_for_update().filter(pk=instance.pk).values_list(
+		'creator_unread', 'interlocutor_unread').first()
+	for user_id, unread in zip(
+		(instance.creator_id, instance.interlocutor_id), counters or ()
+	):
+		if unread:
+			UnreadCounter.objects.add(user_id, -unread)
@@ -1,25 +1,89 @@
 """Geography-related models."""
 
+from django.conf import settings
 from django.contrib.gis.db.models.fields import PointField
 from django.contrib.gis.geos import Point
+from django.db import connections
 from django.db.models.deletion import SET_DEFAULT
 from django.db.models.fields import TextField
 
-from .basemodel import QuicksellModel
+from .basemodel import QuicksellManager, QuicksellModel, SentinelRow
+
+
+class LocationManager(QuicksellManager):
+	"""Location manager."""
+
+	@staticmethod
+	def snap(point):
+		x, y = point.x, point.y
+		if (precision := settings.LOCATION_PRECISION) is not None:
+			x, y = round(x, precision), round(y, precision)
+		return x, y
+
+	def resolve(self, coordinates, address=''):
+		return self.resolve_many([(coordinates, address)])[0]
+
+	def resolve_many(self, locations):
+		"""Locations for (point, address) pairs in one INSERT ... ON CONFLICT.
+
+		Points are snapped to LOCATION_PRECISION decimal places.
+		Existing Locations are shared, so their address is set only if empty,
+		the first address of repeated points is used.
+		"""
+		if not locations:
+			return []
+		keys = [self.snap(coordinates) for coordinates, _ in locations]
+		points = {}
+		for key, (_, address) in zip(keys, locations):
+			points.setdefault(key, address)
+		table = connections[self.db].ops.quote_name(self.model._meta.db_table)
+		srid = self.model._meta.get_field('coordinates').srid
+		point_sql = f'ST_SetSRID(ST_MakePoint(%s, %s), {srid:d})'
+		returning = 'id, ST_X(coordinates), ST_Y(coordinates), address'
+		with connections[self.db].cursor() as cursor:
+			cursor.execute(
+				f"INSERT INTO {table} AS location (coordinates, address) "
+				f"VALUES {', '.join([f'({point_sql}, %s)'] * len(points))} "
+				"ON CONFLICT (coordinates) DO UPDATE SET address = EXCLUDED.address "
+				"WHERE location.address = '' AND EXCLUDED.address != '' "
+				f"RETURNING {returning}",
+				[param for (x, y), address in points.items() for param in (x, y, address)]
+			)
+			rows = cursor.fetchall()
+			# conflicting rows which were not updated are not returned
+			if missing := points.keys() - {(x, y) for _, x, y, _ in rows}:
+				cursor.execute(
+					f"SELECT {returning} FROM {table} WHERE coordinates IN "
+					f"({', '.join([point_sql] * len(missing))})",
+					[coord for point in missing for coord in point]
+				)
+				rows += cursor.fetchall()
+		found = {
+			(x, y): self.model.from_db(
+				self.db, ('id', 'coordinates', 'address'),
+				(pk, Point(x, y, srid=srid), address)
+			)
+			for pk, x, y, address in rows
+		}
+		return [found[key] for key in keys]
 
 
 class Location(QuicksellModel):
 	"""Object's physical location."""
 
+	objects = LocationManager()
+
 	coordinates = PointField(unique=True)
 	address = TextField(max_length=1024)
 
 	@classmethod
 	def default_pk(cls):
-		return cls.objects.get_or_create(
-			coordinates=Point(x=55.751426, y=37.618879),
-			address="The Kremlin"
-		)[0].id
+		return default_location.get_pk()
+
+
+default_location = SentinelRow(
+	Location, coordinates=Point(x=55.751426, y=37.618879), address="The Kremlin"
+)
 
 
 location_fk_kwargs = {
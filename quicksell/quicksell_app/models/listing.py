@@ -4,17 +4,19 @@ import uuid
 from datetime import datetime, timedelta
 
 from django.db.models.deletion import CASCADE, SET
+from django.db.models.constraints import UniqueConstraint
 from django.db.models.enums import IntegerChoices
 from django.db.models.fields import (
-	BooleanField, CharField, DateTimeField, PositiveIntegerField,
+	BooleanField, CharField, DateTimeField, FloatField, PositiveIntegerField,
 	PositiveSmallIntegerField, SmallIntegerField, TextField, UUIDField
 )
 from django.db.models.fields.files import ImageField
 from django.db.models.fields.json import JSONField
 from django.db.models.fields.related import ForeignKey
+from django.db.models.indexes import Index
 from mptt.models import MPTTModel, TreeForeignKey
 
-from .basemodel import QuicksellModel, SerializationMixin
+from .basemodel import QuicksellModel, SentinelRow, SerializationMixin
 from .geography import location_fk_kwargs
 
 
@@ -37,8 +39,11 @@ class Category(MPTTModel, SerializationMixin):
 		return self.name
 
 
+uncategorized_category = SentinelRow(Category, name='__uncategorized__')
+
+
 def uncategorized():
-	return Category.objects.get_or_create(name='__uncategorized__')[0].id
+	return uncategorized_category.get_pk()
 
 
 def default_expiration_date():
@@ -68,6 +73,8 @@ class Listing(QuicksellModel):
 	views = PositiveIntegerField(default=0)
 	date_created = DateTimeField(default=datetime.now, editable=False)
 	date_expires = DateTimeField(default=default_expiration_date)
+	date_updated = DateTimeField(auto_now=True)
+	date_similar = DateTimeField(null=True, editable=False)
 	condition_new = BooleanField(default=False)
 	properties = JSONField(null=True, blank=True)
 	seller = ForeignKey('Profile', related_name='listings', on_delete=CASCADE)
@@ -83,3 +90,17 @@ class Photo(QuicksellModel):
 	listing = ForeignKey('Listing', related_name='photos', on_delete=CASCADE)
 	image = ImageField(upload_to='images/listings/')
 	order = SmallIntegerField(default=0)
+
+
+class SimilarListing(QuicksellModel):
+	"""Precomputed neighbor of active Listing."""
+
+	listing = ForeignKey('Listing', related_name='+', on_delete=CASCADE)
+	similar = ForeignKey('Listing', related_name='similar_to', on_delete=CASCADE)
+	score = FloatField()
+
+	class Meta:
+		indexes = [Index(fields=['listing', '-score'])]
+		constraints = [
+			UniqueConstraint(fields=['listing', 'similar'], name='unique_similar')
+		]
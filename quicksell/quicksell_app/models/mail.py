@@ -0,0 +1,33 @@
+"""Email outbox model."""
+
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.core.mail import EmailMessage
+from django.db.models.fields import (
+	CharField, DateTimeField, PositiveSmallIntegerField, TextField
+)
+
+from .basemodel import QuicksellModel
+
+
+class OutgoingEmail(QuicksellModel):
+	"""Email queued for sending, deleted once sent.
+
+	`next_attempt` is None when sending was given up.
+	"""
+
+	subject = CharField(max_length=200)
+	body = TextField()
+	from_email = CharField(max_length=254, blank=True)
+	recipients = ArrayField(CharField(max_length=254))
+	created = DateTimeField(auto_now_add=True)
+	attempts = PositiveSmallIntegerField(default=0)
+	next_attempt = DateTimeField(null=True, default=datetime.now, db_index=True)
+
+	def message(self, connection=None):
+		return EmailMessage(
+			self.subject, self.body, self.from_email or settings.DEFAULT_FROM_EMAIL,
+			self.recipients, connection=connection
+		)
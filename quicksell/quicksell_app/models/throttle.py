@@ -0,0 +1,22 @@
+"""Throttling counters model."""
+
+from django.db.models import UniqueConstraint
+from django.db.models.fields import (
+	BigIntegerField, CharField, PositiveIntegerField
+)
+
+from .basemodel import QuicksellModel
+
+
+class ThrottleCounter(QuicksellModel):
+	"""Number of requests with `key` in fixed time window number `window`."""
+
+	key = CharField(max_length=200)
+	window = BigIntegerField()
+	count = PositiveIntegerField(default=0)
+	expires = BigIntegerField(db_index=True)  # Unix time
+
+	class Meta:
+		constraints = [
+			UniqueConstraint(fields=['key', 'window'], name='unique_throttle_window')
+		]
@@ -1,19 +1,21 @@
 """Account-related models."""
 
+import secrets
 import uuid
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
+from django.db import transaction
+from django.db.models import Q, UniqueConstraint
 from django.db.models.deletion import CASCADE
 from django.db.models.enums import IntegerChoices
 from django.db.models.fields import (
 	BooleanField, CharField, DateField, DateTimeField, EmailField, IntegerField,
-	PositiveSmallIntegerField, TextField, UUIDField
+	PositiveIntegerField, PositiveSmallIntegerField, TextField, UUIDField
 )
 from django.db.models.fields.files import ImageField
 from django.db.models.fields.related import ForeignKey, OneToOneField
-from pyfcm import FCMNotification
 
 from .basemodel import QuicksellManager, QuicksellModel, SerializationMixin
 from .geography import location_fk_kwargs
@@ -58,7 +60,15 @@ class DeviceManager(QuicksellManager):
 
 	MAX_FAILS = 10
 
-	client = FCMNotification(settings.FCM_TOKEN)
+	def register(self, fcm_id):
+		"""Device with `fcm_id`, new or reactivated."""
+		if device := self.filter(fcm_id=fcm_id).order_by('id').first():
+			if not device.is_active or device.fails_count:
+				device.is_active = True
+				device.fails_count = 0
+				device.save()
+			return device
+		return self.create(fcm_id=fcm_id)
 
 
 class Device(QuicksellModel):
@@ -78,19 +88,11 @@ class Device(QuicksellModel):
 	fails_count = PositiveSmallIntegerField(default=0)
 	platform = PositiveSmallIntegerField(choices=Platform.choices, default=0)
 
-	def send_push_notification(self, **kwargs):
-		response = self.objects.client.notify_single_device(
-			registartion_token=self.fcm_id,
-			timeout=kwargs.pop('timeout', 1),
-			**kwargs
-		)
-		if 'error' in response['results'][0]:
-			if self.fails_count >= DeviceManager.MAX_FAILS:
-				self.update(active=False)
-			else:
-				self.update(fails_count=self.fails_count + 1)
-		elif self.fails_count:
-			self.update(fails_count=0)
+	def send_push_notification(self, title, body):
+		"""Queues notification, failures are counted by dispatcher."""
+		# breaking circular import - pylint: disable=import-outside-toplevel
+		from quicksell_app.push import dispatcher
+		dispatcher.notify(self, title, body)
 
 
 class User(AbstractBaseUser, PermissionsMixin, SerializationMixin):
@@ -113,6 +115,7 @@ class User(AbstractBaseUser, PermissionsMixin, SerializationMixin):
 	device = ForeignKey(
 		Device, related_name='owner', null=True, on_delete=CASCADE
 	)
+	chats_count = PositiveIntegerField(default=0, editable=False)
 
 	@property
 	def profile(self):
@@ -137,7 +140,7 @@ class User(AbstractBaseUser, PermissionsMixin, SerializationMixin):
 		self.email = User.objects.normalize_email(self.email)
 
 	def notify(self, **kwargs):
-		if self.device.is_active:
+		if self.device_id and self.device.is_active:
 			self.device.send_push_notification(**kwargs)
 
 
@@ -167,3 +170,53 @@ class BusinessAccount(QuicksellModel):
 	user = OneToOneField(User, related_name='business_account', on_delete=CASCADE)
 	is_active = BooleanField(default=False)
 	expires = DateTimeField(null=True, blank=True)
+
+
+def generate_key():
+	return secrets.token_hex(20)
+
+
+class AuthTokenManager(QuicksellManager):
+	"""Auth tokens manager."""
+
+	def issue(self, user, device=None):
+		"""New token for `device` (User's one by default),
+		replacing the previous one of the device."""
+		device_id = device.id if device else user.device_id
+		if device_id is None:
+			previous = Q(user=user, device=None)
+		else:
+			previous = Q(device_id=device_id)
+		with transaction.atomic():
+			self.filter(previous).delete()
+			return self.create(
+				user=user, device_id=device_id,
+				expires=datetime.now() + timedelta(
+					seconds=settings.AUTH_TOKENS['LIFETIME'])
+			)
+
+
+class AuthToken(QuicksellModel):
+	"""Expiring API token, one per User's device.
+
+	Expiration is postponed while the token is used.
+	"""
+
+	objects = AuthTokenManager()
+
+	key = CharField(max_length=40, primary_key=True, default=generate_key, editable=False)
+	user = ForeignKey(User, related_name='auth_tokens', on_delete=CASCADE)
+	device = OneToOneField(
+		Device, related_name='auth_token', null=True, on_delete=CASCADE
+	)
+	created = DateTimeField(auto_now_add=True)
+	expires = DateTimeField(db_index=True)
+	last_seen = DateTimeField(null=True)
+
+	class Meta:
+		constraints = [UniqueConstraint(
+			fields=['user'], condition=Q(device=None), name='unique_deviceless_token'
+		)]
+
+	def __str__(self):
+		return self.key
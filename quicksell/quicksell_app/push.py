@@ -0,0 +1,125 @@
+"""Push notifications dispatched in background."""
+
+import logging
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import F
+from django.utils.module_loading import import_string
+from pyfcm.errors import FCMServerError
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+
+from quicksell_app.misc import BackgroundWorker
+from quicksell_app.models import Device
+from quicksell_app.models.user import DeviceManager
+
+logger = logging.getLogger(__name__)
+
+
+class FakeFCM:
+	"""FCM client stand-in, remembers sent notifications.
+
+	Devices with `fcm_id` in `failing` get an error in response.
+	"""
+
+	def __init__(self, api_key, **_kwargs):
+		self.api_key = api_key
+		self.sent = []
+		self.failing = set()
+
+	def notify_multiple_devices(
+		self, registration_ids, message_title=None, message_body=None, **_kwargs
+	):
+		self.sent.append((list(registration_ids), message_title, message_body))
+		return {'results': [
+			{'error': 'NotRegistered'} if fcm_id in self.failing
+			else {'message_id': uuid.uuid4().hex}
+			for fcm_id in registration_ids
+		]}
+
+
+class PushDispatcher(BackgroundWorker):
+	"""Sends queued notifications, only the latest one for each Device in a batch.
+
+	Devices with the same notification are sent to with one request.
+	"""
+
+	def __init__(self):
+		super().__init__()
+		self.client_path = None
+		self.client = None
+
+	@property
+	def config(self):
+		return settings.PUSH_NOTIFICATIONS
+
+	@property
+	def window(self):
+		return self.config['WINDOW']
+
+	def get_client(self):
+		if self.client_path != self.config['CLIENT']:
+			self.client_path = self.config['CLIENT']
+			# retries are done by dispatcher, connections are kept in session
+			self.client = import_string(self.client_path)(
+				settings.FCM_TOKEN, adapter=HTTPAdapter(max_retries=0))
+		return self.client
+
+	def put(self, item):
+		if self.config['EAGER']:
+			self.handle([item])
+		else:
+			super().put(item)
+
+	def notify(self, device, title, body):
+		self.put((device.id, device.fcm_id, title, body))
+
+	def handle(self, batch):
+		latest = {}
+		for device_id, fcm_id, title, body in batch:
+			latest[device_id] = fcm_id, title, body
+		groups = defaultdict(list)
+		for device_id, (fcm_id, title, body) in latest.items():
+			groups[title, body].append((device_id, fcm_id))
+		failed, succeeded = [], []
+		for (title, body), devices in groups.items():
+			results = self.send([fcm_id for _, fcm_id in devices], title, body)
+			if results is None:
+				continue
+			for (device_id, _), result in zip(devices, results):
+				(failed if 'error' in result else succeeded).append(device_id)
+		self.count_fails(failed, succeeded)
+
+	def send(self, fcm_ids, title, body):
+		"""FCM results for each device, retried with exponential backoff.
+
+		Returns None if all attempts failed.
+		"""
+		for attempt in range(self.config['RETRIES'] + 1):
+			try:
+				return self.get_client().notify_multiple_devices(
+					registration_ids=fcm_ids, message_title=title, message_body=body,
+					timeout=self.config['TIMEOUT']
+				)['results']
+			except (FCMServerError, RequestException):
+				if attempt == self.config['RETRIES']:
+					logger.exception("Push notifications to %d devices failed.", len(fcm_ids))
+					return None
+				time.sleep(self.config['BACKOFF'] * 2 ** attempt)
+		return None
+
+	@staticmethod
+	def count_fails(failed, succeeded):
+		if failed:
+			Device.objects.filter(id__in=failed).update(fails_count=F('fails_count') + 1)
+			Device.objects.filter(
+				id__in=failed, fails_count__gte=DeviceManager.MAX_FAILS
+			).update(is_active=False)
+		if succeeded:
+			Device.objects.filter(id__in=succeeded, fails_count__gt=0).update(fails_count=0)
+
+
+dispatcher = PushDispatcher()
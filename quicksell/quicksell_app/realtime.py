@@ -0,0 +1,258 @@
+"""Realtime Chat events over WebSockets."""
+
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+import psycopg2
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.fields import DateTimeField
+
+from quicksell_app.authentication import CachedTokenAuthentication
+from quicksell_app.models import Message
+from quicksell_app.models.chat import messages_read
+from quicksell_app.serializers import Base64UUIDField, CursorField
+
+logger = logging.getLogger(__name__)
+
+WEBSOCKET_PATH = '/api/chats/ws/'
+CLOSE_UNAUTHORIZED = 4001
+
+
+class InProcessBackend:
+	"""Fan-out of events to subscribers connected to this process."""
+
+	queue_size = 100
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.subscribers = defaultdict(dict)  # user id -> {queue: loop}
+
+	def subscribe(self, user_id):
+		queue = asyncio.Queue(self.queue_size)
+		with self.lock:
+			self.subscribers[user_id][queue] = asyncio.get_running_loop()
+		return queue
+
+	def unsubscribe(self, user_id, queue):
+		with self.lock:
+			self.subscribers[user_id].pop(queue, None)
+			if not self.subscribers[user_id]:
+				del self.subscribers[user_id]
+
+	def deliver(self, user_id, event):
+		"""Puts event to queues of User's subscribers, may be called from any thread."""
+		with self.lock:
+			queues = list(self.subscribers.get(user_id, {}).items())
+		for queue, loop in queues:
+			try:
+				loop.call_soon_threadsafe(self.put, queue, event)
+			except RuntimeError:
+				# loop is closed, its subscriber is gone
+				self.unsubscribe(user_id, queue)
+
+	@staticmethod
+	def put(queue, event):
+		try:
+			queue.put_nowait(event)
+		except asyncio.QueueFull:
+			# slow client will resync with regular endpoints
+			logger.warning("Realtime queue is full, event dropped.")
+
+	def publish(self, user_id, event):
+		self.deliver(user_id, event)
+
+
+class PostgresBackend(InProcessBackend):
+	"""Fan-out of events between processes with Postgres LISTEN/NOTIFY.
+
+	Notifications are received by a listener thread started on first subscription.
+	Events too big for a notification are sent with `truncated` flag
+	and only `type` and `chat`, so clients refetch the Chat.
+	"""
+
+	channel = 'quicksell_realtime'
+	max_payload = 7999  # bytes
+	poll_interval = 5  # seconds
+	reconnect_delay = 1  # seconds
+
+	def __init__(self):
+		super().__init__()
+		self.listener = None
+
+	def publish(self, user_id, event):
+		payload = json.dumps({'user': user_id, 'event': event}, ensure_ascii=False)
+		if len(payload.encode()) > self.max_payload:
+			payload = json.dumps({'user': user_id, 'event': {
+				'type': event['type'], 'chat': event['chat'], 'truncated': True
+			}})
+		with connection.cursor() as cursor:
+			cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, payload])
+
+	def subscribe(self, user_id):
+		queue = super().subscribe(user_id)
+		with self.lock:
+			if self.listener is None:
+				self.listener = threading.Thread(
+					target=self.listen, name='realtime-listener', daemon=True)
+				self.listener.start()
+		return queue
+
+	def listen(self):
+		while True:
+			listener = None
+			try:
+				listener = psycopg2.connect(**connection.get_connection_params())
+				listener.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+				with listener.cursor() as cursor:
+					cursor.execute(f'LISTEN {self.channel}')
+				while True:
+					if select.select([listener], [], [], self.poll_interval)[0]:
+						listener.poll()
+					while listener.notifies:
+						data = json.loads(listener.notifies.pop(0).payload)
+						self.deliver(data['user'], data['event'])
+			except psycopg2.Error:
+				logger.exception("Realtime listener lost connection.")
+				time.sleep(self.reconnect_delay)
+			finally:
+				if listener is not None:
+					listener.close()
+
+
+backends = {}
+
+
+def get_backend():
+	path = settings.REALTIME_BACKEND
+	if path not in backends:
+		backends[path] = import_string(path)()
+	return backends[path]
+
+
+def publish(user_id, event):
+	"""Publishes event, failures are logged, as data is already committed."""
+	try:
+		get_backend().publish(user_id, event)
+	except (DatabaseError, RuntimeError):
+		logger.exception("Realtime event for User %s was not published.", user_id)
+
+
+def publish_on_commit(user_id, event):
+	transaction.on_commit(lambda: publish(user_id, event))
+
+
+@receiver(post_save, sender=Message)
+def message_posted(instance, created, **_kwargs):
+	if not created:
+		return
+	chat = instance.chat
+	for user_id in (chat.creator_id, chat.interlocutor_id):
+		publish_on_commit(user_id, {
+			'type': 'message',
+			'chat': Base64UUIDField().to_representation(chat.uuid),
+			'message': {
+				'is_yours': user_id == instance.author_id,
+				'text': instance.text,
+				'timestamp': DateTimeField().to_representation(instance.timestamp),
+				'read': instance.read,
+				'cursor': CursorField().to_representation(instance),
+			},
+		})
+
+
+@receiver(messages_read)
+def messages_read_by(chat, reader, until, **_kwargs):
+	author_id = (
+		chat.interlocutor_id if reader.id == chat.creator_id else chat.creator_id
+	)
+	publish_on_commit(author_id, {
+		'type': 'read',
+		'chat': Base64UUIDField().to_representation(chat.uuid),
+		'until': DateTimeField().to_representation(until),
+	})
+
+
+async def wait_for(user_id, timeout, fetch):
+	"""Result of `fetch()` refetched on User's events until it's not empty.
+
+	After `timeout` seconds returns result fetched once more, possibly empty,
+	in case an event was not delivered.
+	"""
+	backend = get_backend()
+	loop = asyncio.get_running_loop()
+	deadline = loop.time() + timeout
+	queue = backend.subscribe(user_id)
+	try:
+		while not (result := await sync_to_async(fetch)()):
+			if (remaining := deadline - loop.time()) <= 0:
+				break
+			try:
+				await asyncio.wait_for(queue.get(), remaining)
+			except asyncio.TimeoutError:
+				return await sync_to_async(fetch)()
+		return result
+	finally:
+		backend.unsubscribe(user_id, queue)
+
+
+@sync_to_async
+def authenticate(scope):
+	"""User id by token from `Authorization` header or `token` query param."""
+	headers = dict(scope.get('headers', ()))
+	key = None
+	if authorization := headers.get(b'authorization', b'').split():
+		if len(authorization) == 2 and authorization[0].lower() == b'token':
+			key = authorization[1].decode('latin-1')
+	elif tokens := parse_qs(scope.get('query_string', b'').decode()).get('token'):
+		key = tokens[0]
+	if not key:
+		return None
+	try:
+		user, _ = CachedTokenAuthentication().authenticate_credentials(key)
+	except AuthenticationFailed:
+		return None
+	return user.id
+
+
+async def websocket_application(scope, receive, send):
+	"""Sends events of authenticated User as JSON text frames.
+
+	Frames sent by client are ignored.
+	"""
+	if (await receive())['type'] != 'websocket.connect':
+		return
+	if scope['path'] != WEBSOCKET_PATH or (user_id := await authenticate(scope)) is None:
+		await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+		return
+	await send({'type': 'websocket.accept'})
+	backend = get_backend()
+	queue = backend.subscribe(user_id)
+	receiving = asyncio.ensure_future(receive())
+	getting = asyncio.ensure_future(queue.get())
+	try:
+		while True:
+			await asyncio.wait({receiving, getting}, return_when=asyncio.FIRST_COMPLETED)
+			if getting.done():
+				await send({'type': 'websocket.send', 'text': json.dumps(getting.result())})
+				getting = asyncio.ensure_future(queue.get())
+			if receiving.done():
+				if receiving.result()['type'] == 'websocket.disconnect':
+					break
+				receiving = asyncio.ensure_future(receive())
+	finally:
+		receiving.cancel()
+		getting.cancel()
+		backend.unsubscribe(user_id, queue)
@@ -1,5 +1,6 @@
 """User serilaizers."""
 
+from datetime import datetime
 from uuid import UUID
 
 from django.contrib.auth import password_validation
@@ -8,11 +9,15 @@ from django.db import transaction
 from django.shortcuts import get_object_or_404
 from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from drf_yasg.utils import swagger_serializer_method
+from rest_framework.authtoken.serializers import AuthTokenSerializer
 from rest_framework.exceptions import NotFound, ValidationError
-from rest_framework.fields import CharField, Field, IntegerField
-from rest_framework.serializers import ModelSerializer, SerializerMethodField
+from rest_framework.fields import CharField, DateTimeField, Field, IntegerField
+from rest_framework.serializers import (
+	ModelSerializer, Serializer, SerializerMethodField
+)
 
 from quicksell_app import models
+from quicksell_app.categories import categories
 
 
 class Base64UUIDField(Field):
@@ -53,16 +58,24 @@ class Location(ModelSerializer):
 		model = models.Location
 		fields = 'coordinates', 'address'
 
+	@staticmethod
+	def resolve(coordinates, address):
+		"""Shared Location, its address can't be changed once set."""
+		location = models.Location.objects.resolve(coordinates, address)
+		if address and location.address != address:
+			raise ValidationError(
+				{'address': f"Address of the point is already '{location.address}'."})
+		return location
+
 	def create(self, validated_data):
-		coords = validated_data.pop('coordinates')
-		location, _ = models.Location.objects.get_or_create(coordinates=coords)
-		return super().update(location, validated_data)
+		return self.resolve(
+			validated_data['coordinates'], validated_data.get('address', ''))
 
 	def update(self, location, validated_data):
-		coords = validated_data.pop('coordinates', None)
-		if location.coordinates != coords:
-			location, _ = models.Location.objects.get_or_create(coordinates=coords)
-		return super().update(location, validated_data)
+		return self.resolve(
+			validated_data.get('coordinates', location.coordinates),
+			validated_data.get('address', '')
+		)
 
 
 class Profile(ModelSerializer):
@@ -122,6 +135,12 @@ class User(ModelSerializer):
 		return user
 
 
+class Login(AuthTokenSerializer):
+	"""Credentials with optional device."""
+
+	fcm_id = CharField(min_length=100, required=False, write_only=True)
+
+
 class CategoryField(Field):
 	"""Listing's category."""
 
@@ -129,13 +148,16 @@ class CategoryField(Field):
 		return category.name
 
 	def to_internal_value(self, category_name):
-		try:
-			category = models.Category.objects.get(name=category_name)
-		except models.Category.DoesNotExist as err:
-			raise ValidationError("Category doesn't exist.") from err
-		if not category.is_leaf_node():
+		if not isinstance(category_name, str) or not (
+			entry := categories.get(category_name)
+		):
+			raise ValidationError("Category doesn't exist.")
+		if not entry.is_leaf:
 			raise ValidationError("Category should be at lowest level.")
-		return category
+		return models.Category(
+			id=entry.id, name=category_name, parent_id=entry.parent_id,
+			tree_id=entry.tree_id, lft=entry.lft, rght=entry.rght, level=entry.level
+		)
 
 
 class Listing(ModelSerializer):
@@ -172,18 +194,99 @@ class Listing(ModelSerializer):
 		return super().update(listing, validated_data)
 
 
+class ListingChats(Serializer):
+	"""Seller's Listing with summary of its Chats."""
+
+	listing = Listing(read_only=True)
+	chats = IntegerField(read_only=True)
+	unread = IntegerField(read_only=True)
+	updated_at = DateTimeField(read_only=True)
+
+
+class CursorField(Field):
+	"""Message's (timestamp, id) position as opaque string."""
+
+	def to_representation(self, message):
+		if message.id is None:
+			return None
+		return urlsafe_base64_encode(
+			f'{message.timestamp.isoformat()} {message.id}'.encode())
+
+	def to_internal_value(self, data):
+		try:
+			timestamp, pk = urlsafe_base64_decode(data).decode().split()
+			return datetime.fromisoformat(timestamp), int(pk)
+		except (ValueError, TypeError, UnicodeDecodeError) as err:
+			raise ValidationError("Invalid cursor.") from err
+
+
 class Message(ModelSerializer):
 	"""Chat's message serializer."""
 
 	is_yours = SerializerMethodField()
+	cursor = CursorField(source='*', read_only=True)
 
 	class Meta:
 		model = models.Message
-		fields = 'is_yours', 'text', 'timestamp', 'read'
-		read_only_fields = 'is_yours', 'timestamp', 'read'
+		fields = 'is_yours', 'text', 'timestamp', 'read', 'cursor'
+		read_only_fields = 'is_yours', 'timestamp', 'read', 'cursor'
 
 	def get_is_yours(self, message_object):
-		return self.context['request'].user == message_object.author
+		return self.context['request'].user.id == message_object.author_id
+
+
+class ChatMessage(Message):
+	"""Message with its Chat."""
+
+	chat = Base64UUIDField(source='chat.uuid', read_only=True)
+
+	class Meta(Message.Meta):
+		fields = ('chat',) + Message.Meta.fields
+
+
+class SearchCursorField(Field):
+	"""Search result's (rank, id) position as opaque string."""
+
+	def to_representation(self, message):
+		return urlsafe_base64_encode(f'{message.rank!r} {message.id}'.encode())
+
+	def to_internal_value(self, data):
+		try:
+			rank, pk = urlsafe_base64_decode(data).decode().split()
+			return float(rank), int(pk)
+		except (ValueError, TypeError, UnicodeDecodeError) as err:
+			raise ValidationError("Invalid cursor.") from err
+
+
+class MessageSearchQuery(Serializer):
+	"""Search query for Messages."""
+
+	q = CharField(max_length=200)
+	after = SearchCursorField(required=False)
+
+
+class MessageSearchResult(ChatMessage):
+	"""Found Message with highlighted snippet of its text."""
+
+	snippet = CharField(read_only=True)
+
+	class Meta(ChatMessage.Meta):
+		fields = ChatMessage.Meta.fields + ('snippet',)
+
+
+class MessageRead(Serializer):
+	"""Read receipt up to Message's timestamp."""
+
+	timestamp = DateTimeField()
+
+
+class MessageSyncQuery(Serializer):
+	"""Query for Messages after cursor."""
+
+	max_wait = 25  # seconds, below workers' timeout
+
+	after = CursorField(required=False)
+	wait = IntegerField(min_value=0, max_value=max_wait, default=0)
 
 
 class Chat(ModelSerializer):
@@ -198,18 +301,19 @@ class Chat(ModelSerializer):
 	interlocutor = SerializerMethodField()
 	listing = Listing(read_only=True)
 	latest_message = SerializerMethodField()
+	unread = SerializerMethodField()
 
 	class Meta:
 		model = models.Chat
 		fields = (
-			'to_uuid', 'listing_uuid',
-			'uuid', 'subject', 'interlocutor', 'listing', 'latest_message'
+			'to_uuid', 'listing_uuid', 'uuid', 'subject',
+			'interlocutor', 'listing', 'latest_message', 'unread'
 		)
 		read_only_fields = fields
 
 	@swagger_serializer_method(Profile)
 	def get_interlocutor(self, chat_object):
-		if self.context['request'].user != chat_object.creator:
+		if self.context['request'].user.id != chat_object.creator_id:
 			interlocutor_profile = chat_object.creator.profile
 		else:
 			interlocutor_profile = chat_object.interlocutor.profile
@@ -217,11 +321,13 @@ class Chat(ModelSerializer):
 
 	@swagger_serializer_method(Message)
 	def get_latest_message(self, chat_object):
-		try:
-			latest_message = chat_object.messages.latest('timestamp')
-			return Message(latest_message, context=self.context).data
-		except models.Message.DoesNotExist:
+		if (latest_message := chat_object.last_message) is None:
 			return None
+		return Message(latest_message, context=self.context).data
+
+	@swagger_serializer_method(IntegerField())
+	def get_unread(self, chat_object):
+		return chat_object.unread_by(self.context['request'].user)
 
 	def create(self, val_data):
 		creator = self.context['request'].user
@@ -0,0 +1,201 @@
+"""Precomputed similar Listings."""
+
+import bisect
+import heapq
+import math
+import re
+from collections import defaultdict
+from datetime import datetime
+from operator import attrgetter
+from typing import NamedTuple
+
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+
+from quicksell_app.categories import categories
+from quicksell_app.models import Listing, SimilarListing
+
+NEIGHBORS = 10
+CANDIDATES = 200  # scored for each Listing
+PRICE_BAND = 2  # times, changed Listings are checked as neighbors of ones in it
+WEIGHTS = {'category': 0.4, 'title': 0.3, 'price': 0.2, 'distance': 0.1}
+DISTANCE_SCALE = 10  # km, at which distance score is halved
+EARTH_RADIUS = 6371  # km
+
+word = re.compile(r'\w{2,}')
+
+
+class Features(NamedTuple):
+	"""Listing's values used for scoring."""
+
+	id: int
+	category: object
+	price: int
+	latitude: float
+	longitude: float
+	tokens: frozenset
+
+
+def load_features(queryset, by_id):
+	features = []
+	for pk, category_id, price, point, title in queryset.values_list(
+		'id', 'category_id', 'price', 'location__coordinates', 'title'
+	):
+		if (category := by_id.get(category_id)) is not None:
+			features.append(Features(
+				pk, category, price, point.x, point.y,
+				frozenset(word.findall(title.lower()))
+			))
+	return features
+
+
+def category_score(a, b, by_id):
+	"""Depth of lowest common ancestor relative to depth of the deeper one."""
+	if a.id == b.id:
+		return 1.0
+	ancestor = a
+	while not ancestor.lft <= b.lft < b.rght <= ancestor.rght:
+		ancestor = by_id[ancestor.parent_id]
+	return (ancestor.level + 1) / (max(a.level, b.level) + 1)
+
+
+def price_score(a, b):
+	return min(a, b) / max(a, b) if max(a, b) else 1.0
+
+
+def distance(a, b):
+	"""Haversine distance in km."""
+	phi_a, phi_b = math.radians(a.latitude), math.radians(b.latitude)
+	h = (
+		math.sin((phi_b - phi_a) / 2) ** 2 + math.cos(phi_a) * math.cos(phi_b)
+		* math.sin(math.radians(b.longitude - a.longitude) / 2) ** 2
+	)
+	return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(h)))
+
+
+def title_score(a, b):
+	"""Jaccard index of title words."""
+	union = len(a | b)
+	return len(a & b) / union if union else 0.0
+
+
+def score(a, b, by_id):
+	return (
+		WEIGHTS['category'] * category_score(a.category, b.category, by_id)
+		+ WEIGHTS['title'] * title_score(a.tokens, b.tokens)
+		+ WEIGHTS['price'] * price_score(a.price, b.price)
+		+ WEIGHTS['distance'] * DISTANCE_SCALE / (DISTANCE_SCALE + distance(a, b))
+	)
+
+
+def neighbors(target, candidates, by_id):
+	scored = (
+		(score(target, candidate, by_id), candidate.id)
+		for candidate in candidates if candidate.id != target.id
+	)
+	return heapq.nlargest(NEIGHBORS, scored)
+
+
+class Pool:
+	"""Active Listings of a Category tree by Category subtrees, sorted by price."""
+
+	def __init__(self, features, by_id):
+		self.by_id = by_id
+		self.by_category = defaultdict(list)
+		for candidate in features:
+			self.by_category[candidate.category.id].append(candidate)
+		self.subtrees = {}
+
+	def subtree(self, category):
+		if category.id not in self.subtrees:
+			self.subtrees[category.id] = sorted((
+				candidate for pk in category.subtree
+				for candidate in self.by_category.get(pk, ())
+			), key=attrgetter('price'))
+		return self.subtrees[category.id]
+
+	def candidates(self, target):
+		"""Up to CANDIDATES Listings closest to `target` by price
+		from the narrowest Category subtree having that many.
+		"""
+		category = target.category
+		listings = self.subtree(category)
+		while len(listings) <= CANDIDATES and category.parent_id is not None:
+			category = self.by_id[category.parent_id]
+			listings = self.subtree(category)
+		if len(listings) <= CANDIDATES + 1:
+			return listings
+		right = bisect.bisect_left(listings, target.price, key=attrgetter('price'))
+		left = right - 1
+		candidates = []
+		while len(candidates) <= CANDIDATES:
+			if right == len(listings) or left >= 0 and (
+				price_score(listings[left].price, target.price)
+				>= price_score(listings[right].price, target.price)
+			):
+				candidates.append(listings[left])
+				left -= 1
+			else:
+				candidates.append(listings[right])
+				right += 1
+		return candidates
+
+
+class Pools:
+	"""Pools of Category trees, each loaded once."""
+
+	def __init__(self):
+		self.by_id = {entry.id: entry for entry in categories.load().index.values()}
+		self.trees = {}
+
+	def get(self, tree_id):
+		if tree_id not in self.trees:
+			self.trees[tree_id] = Pool(load_features(Listing.objects.filter(
+				status=Listing.Status.active, category__tree_id=tree_id
+			), self.by_id), self.by_id)
+		return self.trees[tree_id]
+
+
+def refresh(ids, pools=None):
+	"""Recomputes neighbors of Listings with given ids.
+
+	Candidates are active Listings from the same Category tree closest by price
+	in the closest Categories, `pools` may be reused for a number of calls.
+	Inactive Listings just lose their neighbors.
+	"""
+	pools = pools or Pools()
+	targets = load_features(Listing.objects.filter(
+		status=Listing.Status.active, id__in=ids), pools.by_id)
+	rows = [
+		SimilarListing(listing_id=target.id, similar_id=similar_id, score=value)
+		for target in targets
+		for value, similar_id in neighbors(
+			target, pools.get(target.category.tree_id).candidates(target), pools.by_id)
+	]
+	with transaction.atomic():
+		SimilarListing.objects.filter(listing_id__in=ids).delete()
+		SimilarListing.objects.bulk_create(rows, batch_size=1000)
+		# queryset update does not touch `date_updated`
+		Listing.objects.filter(id__in=ids).update(date_similar=datetime.now())
+	return len(targets)
+
+
+def outdated():
+	"""Ids of changed Listings, of Listings having them as neighbors
+	and of active Listings in their Categories within PRICE_BAND,
+	which may get them as neighbors.
+	"""
+	changed = Listing.objects.filter(
+		Q(date_similar=None) | Q(date_updated__gt=F('date_similar'))
+	).exclude(~Q(status=Listing.Status.active), date_similar=None)
+	active = Listing.objects.filter(status=Listing.Status.active)
+	nearby = active.filter(Exists(changed.filter(
+		status=Listing.Status.active, category=OuterRef('category'),
+		price__gte=OuterRef('price') / PRICE_BAND,
+		price__lte=OuterRef('price') * PRICE_BAND,
+	)))
+	return changed.values_list('id', flat=True).union(
+		SimilarListing.objects.filter(
+			similar__in=changed).values_list('listing_id', flat=True),
+		nearby.values_list('id', flat=True),
+	)
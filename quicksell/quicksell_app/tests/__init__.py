@@ -3,11 +3,18 @@
 from django.conf import settings
 from model_bakery import baker
 
-from .chat import TestChat, TestMessage
-from .listing import TestListingCreation, TestListingEdit, TestListingFull
+from .cache import TestTwoTierCache
+from .chat import TestChat, TestMessage, TestMessagePartitions, TestRealtime
+from .listing import (
+	TestInfo, TestListingCreation, TestListingEdit, TestListingFull,
+	TestListingMap, TestListingSimilar, TestMakeCategories
+)
+from .mail import TestMail
+from .media import TestMedia
+from .push import TestPush
 from .user import (
 	TestAuthentication, TestEmailConfirmation, TestPasswordActions,
-	TestProfileActions, TestUserCreation, TestUserFull
+	TestProfileActions, TestThrottling, TestUserCreation, TestUserFull
 )
 
 
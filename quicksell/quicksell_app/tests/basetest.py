@@ -1,20 +1,31 @@
 """Common testing patterns."""
 
 from django.conf import settings
+from django.core.cache import caches
 from django.test.utils import modify_settings
 from model_bakery import baker
-from rest_framework.authtoken.models import Token
 from rest_framework.settings import api_settings
 from rest_framework.status import HTTP_200_OK, HTTP_404_NOT_FOUND
 from rest_framework.test import APITestCase, override_settings
 
-from quicksell_app.models import User
+from quicksell_app.models import AuthToken, User
 from quicksell_app.serializers import Base64UUIDField
+from quicksell_app.throttling import get_store
 
 
 @override_settings(
 	PASSWORD_HASHERS=('django.contrib.auth.hashers.MD5PasswordHasher',),
 	EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+	PUSH_NOTIFICATIONS=settings.PUSH_NOTIFICATIONS | {
+		'CLIENT': 'quicksell_app.push.FakeFCM', 'EAGER': True
+	},
+	AUTH_TOKENS=settings.AUTH_TOKENS | {'EAGER': True},
+	OUTGOING_EMAIL=settings.OUTGOING_EMAIL | {'EAGER': True},
+	THROTTLE_STORE='quicksell_app.throttling.LocalStore',
+	REALTIME_BACKEND='quicksell_app.realtime.InProcessBackend',
+	CACHES=settings.CACHES | {
+		'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+	},
 )
 @modify_settings(
 	MIDDLEWARE={'remove': 'silk.middleware.SilkyMiddleware'}
@@ -28,6 +39,10 @@ class BaseTest(APITestCase):
 
 	pagination_fields = ('count', 'next', 'previous', 'results')
 
+	def setUp(self):
+		get_store().clear()
+		caches[settings.SHARED_CACHE['ALIAS']].clear()
+
 	def make_request(self, request, url, expected_status, data):
 		response = request(url, data)
 		info = (url, data, response.data)
@@ -64,8 +79,12 @@ class BaseTest(APITestCase):
 		return Base64UUIDField().to_representation(uuid_value)
 
 	def authorize(self, user=None):
-		token = Token.objects.get_or_create(user=user or self.user)
-		self.client.credentials(HTTP_AUTHORIZATION='Token ' + token[0].key)
+		user = user or self.user
+		token = (
+			AuthToken.objects.filter(user=user, device_id=user.device_id).first()
+			or AuthToken.objects.issue(user)
+		)
+		self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
 
 	def query_paginated_result(self, url, params, count):
 		if count == 0:
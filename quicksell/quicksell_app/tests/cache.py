@@ -0,0 +1,69 @@
+"""Cache tests."""
+
+import threading
+import time
+from unittest import mock
+
+from quicksell_app.cache import TwoTierCache
+from .basetest import BaseTest
+
+
+class TestTwoTierCache(BaseTest):
+	"""Local and shared cache."""
+
+	def setUp(self):
+		super().setUp()
+		self.cache = TwoTierCache('test', 2, 60)
+		self.compute = mock.Mock(return_value="value")
+
+	def get(self, key='key', ttl=60):
+		return self.cache.get_or_set(key, self.compute, ttl)
+
+	def test_tiers(self):
+		self.assertEqual(self.get(), "value")
+		self.assertEqual(self.get(), "value")
+		# other processes get value from shared cache
+		self.cache.clear()
+		self.assertEqual(self.get(), "value")
+		self.assertEqual(self.compute.call_count, 1)
+		self.cache.delete('key')
+		self.get()
+		self.assertEqual(self.compute.call_count, 2)
+		for key in ('a', 'b'):
+			self.get(key)
+		self.assertDictEqual(self.cache.metrics(), {
+			'local_hits': 1, 'shared_hits': 1, 'misses': 4,
+			'early': 0, 'evictions': 1, 'size': 2,
+		})
+
+	def test_single_flight(self):
+		def compute():
+			time.sleep(0.2)
+			return "value"
+
+		self.compute.side_effect = compute
+		threads = [threading.Thread(target=self.get) for _ in range(5)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(self.compute.call_count, 1)
+		# another process holding the lock is waited for
+		self.cache.clear()
+		self.cache.shared.add(f"{self.cache.shared_key('other')}:lock", True)
+		threading.Timer(
+			0.1, self.cache.set, ('other', "computed elsewhere", 60)).start()
+		self.assertEqual(self.get('other'), "computed elsewhere")
+		self.assertEqual(self.compute.call_count, 1)
+
+	def test_early_expiration(self):
+		self.cache.set('key', "stale", 60, delta=1)
+		with mock.patch('random.random', return_value=0.5):
+			self.assertEqual(self.get(), "stale")
+		# closer to expiration slow computation is repeated earlier
+		with mock.patch('time.time', return_value=time.time() + 59.5):
+			with mock.patch('random.random', return_value=0.5):
+				self.assertEqual(self.get(), "value")
+		self.assertEqual(self.cache.early, 1)
+		self.assertEqual(self.get(), "value")
+		self.assertEqual(self.compute.call_count, 1)
@@ -1,16 +1,27 @@
 """Chats tests."""
 
+import io
+import json
 import uuid
+from datetime import date, datetime, timedelta
 from unittest import mock
 
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from model_bakery import baker
 from rest_framework.status import (
-	HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_400_BAD_REQUEST,
+	HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_400_BAD_REQUEST,
 	HTTP_401_UNAUTHORIZED, HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND
 )
 
-from quicksell_app import models
+from quicksell_app import models, realtime, views
+from quicksell_app.management.commands import make_message_partitions
+from quicksell_app.realtime import CLOSE_UNAUTHORIZED, websocket_application
 from .basetest import BaseTest
 
 
@@ -20,6 +31,7 @@ class BaseChatTest(BaseTest):
 	chats_url = reverse('chat')
 
 	def setUp(self):
+		super().setUp()
 		self.make_user()
 		self.user.device = baker.make('Device')
 		self.interlocutor = baker.make(
@@ -80,6 +92,107 @@ class TestChat(BaseChatTest):
 		self.assertEqual(models.Chat.objects.count(), q * 2)
 		self.query_paginated_result(self.chats_url, None, q)
 
+	def test_latest_message(self):
+		def get_chats():
+			with CaptureQueriesContext(connection) as queries:
+				response = self.GET(self.chats_url, HTTP_200_OK)
+			return response.data['results'], len(queries)
+
+		def make_chats(quantity):
+			for chat in baker.make(
+				'Chat', _quantity=quantity, creator=self.user,
+				interlocutor=self.interlocutor, listing=self.listing
+			):
+				baker.make('Message', chat=chat, author=self.interlocutor, text="first")
+				baker.make('Message', chat=chat, author=self.user, text="last")
+
+		make_chats(1)
+		chats, queries = get_chats()
+		self.assertDictContainsSubset(
+			{'text': "last", 'is_yours': True, 'read': False},
+			chats[0]['latest_message']
+		)
+		self.assertEqual(
+			chats[0]['interlocutor']['uuid'], self.interlocutor_uuid)
+		make_chats(9)
+		chats, more_queries = get_chats()
+		self.assertEqual(len(chats), 10)
+		self.assertEqual(queries, more_queries)
+		# reading marks latest message as read
+		chat = models.Chat.objects.first()
+		self.authorize(self.interlocutor)
+		self.GET(reverse('message', args=(self.base64uuid(chat.uuid),)), HTTP_200_OK)
+		chat.refresh_from_db()
+		self.assertTrue(chat.last_message_read)
+		# backfill
+		models.Chat.objects.update(
+			last_message_text='', last_message_timestamp=None, created_at=None)
+		self.user_model.objects.update(chats_count=0)
+		call_command('sync_chats', stdout=io.StringIO())
+		self.assertFalse(models.Chat.objects.exclude(last_message_text="last").exists())
+		for chat in models.Chat.objects.all():
+			self.assertEqual(
+				chat.created_at, chat.messages.order_by('timestamp').first().timestamp)
+		self.assertEqual(self.user_model.objects.get(pk=self.user.pk).chats_count, 10)
+
+	def test_order(self):
+		start = datetime(2021, 1, 1)
+		for i in range(25):
+			creator, interlocutor = self.user, self.interlocutor
+			if i % 3 == 0:
+				creator, interlocutor = interlocutor, creator
+			chat = baker.make('Chat', creator=creator, interlocutor=interlocutor)
+			models.Chat.objects.filter(pk=chat.pk).update(
+				updated_at=start + timedelta(hours=i))
+		baker.make('Chat', creator=self.interlocutor)
+		expected = [
+			self.base64uuid(chat_uuid) for chat_uuid in models.Chat.objects.filter(
+				Q(creator=self.user) | Q(interlocutor=self.user)
+			).order_by('-updated_at').values_list('uuid', flat=True)
+		]
+		received, queries = [], set()
+		for page in (1, 2, 3):
+			with CaptureQueriesContext(connection) as captured:
+				response = self.GET(self.chats_url, HTTP_200_OK, {'page': page})
+			self.assertEqual(response.data['count'], 25)
+			received += [chat['uuid'] for chat in response.data['results']]
+			queries.add(len(captured))
+		self.assertListEqual(received, expected)
+		# the same number of queries for any page
+		self.assertEqual(len(queries), 1)
+		models.Chat.objects.filter(creator=self.user).first().delete()
+		response = self.GET(self.chats_url, HTTP_200_OK)
+		self.assertEqual(response.data['count'], 24)
+
+	def test_listings(self):
+		other_listing = baker.make('Listing', seller=self.interlocutor.profile)
+		for listing, buyers in ((self.listing, 3), (other_listing, 1)):
+			for buyer in baker.make(self.user_model, _quantity=buyers):
+				chat = baker.make(
+					'Chat', creator=buyer, interlocutor=self.interlocutor, listing=listing)
+				baker.make('Message', chat=chat, author=buyer, _quantity=2)
+		# seller's own purchases are not in the inbox
+		baker.make('Chat', creator=self.interlocutor, interlocutor=self.user)
+		self.authorize(self.interlocutor)
+		response = self.GET(reverse('chat-listing'), HTTP_200_OK)
+		self.assertEqual(response.data['count'], 2)
+		self.assertListEqual(
+			[
+				(row['listing']['uuid'], row['chats'], row['unread'])
+				for row in response.data['results']
+			],
+			[(self.base64uuid(other_listing.uuid), 1, 2), (self.listing_uuid, 3, 6)]
+		)
+		detail_url = reverse('chat-listing-detail', args=(self.listing_uuid,))
+		response = self.GET(detail_url, HTTP_200_OK)
+		self.assertEqual(response.data['count'], 3)
+		self.assertEqual(response.data['results'][0]['unread'], 2)
+		# not seller
+		self.authorize(self.user)
+		self.GET(detail_url, HTTP_404_NOT_FOUND)
+		response = self.GET(reverse('chat-listing'), HTTP_200_OK)
+		self.assertEqual(response.data['count'], 0)
+
 
 @mock.patch.object(BaseTest.user_model, 'notify')
 class TestMessage(BaseChatTest):
@@ -163,7 +276,306 @@ class TestMessage(BaseChatTest):
 		self.authorize(third_user)
 		self.GET(self.messages_url, HTTP_403_FORBIDDEN)
 
+	def test_unread(self, _mocked_push):
+		def assert_unread(user, expected):
+			self.authorize(user)
+			response = self.GET(reverse('chat-unread'), HTTP_200_OK)
+			self.assertEqual(response.data['unread'], expected)
+			response = self.GET(self.chats_url, HTTP_200_OK)
+			self.assertEqual(response.data['results'][0]['unread'], expected)
+
+		for text in ("one", "two", "three"):
+			self.POST(self.messages_url, HTTP_201_CREATED, {'text': text})
+		assert_unread(self.user, 0)
+		assert_unread(self.interlocutor, 3)
+		self.POST(self.messages_url, HTTP_201_CREATED, {'text': "four"})
+		assert_unread(self.user, 1)
+		self.GET(self.messages_url, HTTP_200_OK)
+		assert_unread(self.user, 0)
+		assert_unread(self.interlocutor, 3)
+		self.GET(self.messages_url, HTTP_200_OK)
+		assert_unread(self.interlocutor, 0)
+		self.POST(self.messages_url, HTTP_201_CREATED, {'text': "five"})
+		self.assertEqual(models.UnreadCounter.objects.get_count(self.user.pk), 1)
+		# counters of Chat loaded earlier are outdated
+		chat = models.Chat.objects.get(pk=self.chat.pk)
+		self.POST(self.messages_url, HTTP_201_CREATED, {'text': "six"})
+		chat.delete()
+		self.assertEqual(models.UnreadCounter.objects.get_count(self.user.pk), 0)
+
+	def test_read(self, _mocked_push):
+		messages = [
+			self.POST(self.messages_url, HTTP_201_CREATED, {'text': str(i)}).data
+			for i in range(self.page_size + 5)
+		]
+		unread = self.chat.messages.filter(read=False)
+		self.authorize(self.interlocutor)
+		# only returned page is marked
+		self.GET(self.messages_url, HTTP_200_OK)
+		self.assertListEqual(
+			list(unread.order_by('timestamp').values_list('text', flat=True)),
+			[message['text'] for message in messages[:5]]
+		)
+		read_url = reverse('message-read', args=(self.chat_uuid,))
+		response = self.POST(read_url, HTTP_200_OK, {'timestamp': messages[2]['timestamp']})
+		self.assertEqual(response.data['read'], 3)
+		self.assertEqual(unread.count(), 2)
+		self.assertEqual(
+			models.UnreadCounter.objects.get_count(self.interlocutor.pk), 2)
+		response = self.POST(read_url, HTTP_200_OK, {'timestamp': messages[2]['timestamp']})
+		self.assertEqual(response.data['read'], 0)
+		self.POST(read_url, HTTP_400_BAD_REQUEST, {'timestamp': "yesterday"})
+		# own Messages are not marked
+		self.authorize(self.user)
+		response = self.POST(read_url, HTTP_200_OK, {'timestamp': messages[-1]['timestamp']})
+		self.assertEqual(response.data['read'], 0)
+
+	def test_sync(self, _mocked_push):
+		first = self.POST(self.messages_url, HTTP_201_CREATED, {'text': "first"}).data
+		response = self.GET(self.messages_url, HTTP_200_OK, {'after': first['cursor']})
+		self.assertDictEqual(response.data, {'results': [], 'cursor': first['cursor']})
+		sent = [
+			self.POST(self.messages_url, HTTP_201_CREATED, {'text': str(i)}).data
+			for i in range(3)
+		]
+		self.authorize(self.interlocutor)
+		response = self.GET(self.messages_url, HTTP_200_OK, {'after': first['cursor']})
+		self.assertListEqual(
+			[message['text'] for message in response.data['results']], ["0", "1", "2"])
+		self.assertEqual(response.data['cursor'], sent[-1]['cursor'])
+		# only returned Messages are marked as read
+		self.assertListEqual(
+			list(self.chat.messages.filter(read=False).values_list('text', flat=True)),
+			["first"]
+		)
+		self.GET(self.messages_url, HTTP_400_BAD_REQUEST, {'after': "invalid"})
+		# all Chats of User
+		updates_url = reverse('chat-updates')
+		response = self.GET(updates_url, HTTP_200_OK)
+		self.assertDictEqual(response.data, {'results': [], 'cursor': sent[-1]['cursor']})
+		other_chat = baker.make(
+			models.Chat, creator=self.interlocutor, interlocutor=self.user)
+		self.POST(
+			reverse('message', args=(self.base64uuid(other_chat.uuid),)),
+			HTTP_201_CREATED, {'text': "other"}
+		)
+		response = self.GET(updates_url, HTTP_200_OK, {'after': sent[-1]['cursor']})
+		self.assertListEqual(
+			[(message['chat'], message['text']) for message in response.data['results']],
+			[(self.base64uuid(other_chat.uuid), "other")]
+		)
+		# nothing new until timeout
+		response = self.GET(
+			updates_url, HTTP_200_OK, {'after': response.data['cursor'], 'wait': 1})
+		self.assertListEqual(response.data['results'], [])
+
+	def test_search(self, _mocked_push):
+		for text in ("Is the bike still available?", "Any discount?", "bike, bike, bike"):
+			self.POST(self.messages_url, HTTP_201_CREATED, {'text': text})
+		baker.make(models.Message, text="bike")
+		search_url = reverse('chat-search')
+		response = self.GET(search_url, HTTP_200_OK, {'q': "bike"})
+		self.assertListEqual(
+			[message['text'] for message in response.data['results']],
+			["bike, bike, bike", "Is the bike still available?"]
+		)
+		self.assertEqual(response.data['results'][0]['chat'], self.chat_uuid)
+		self.assertIn("<b>bike</b>", response.data['results'][1]['snippet'])
+		self.assertIsNone(response.data['cursor'])
+		with mock.patch.object(views.ChatSearch, 'page_size', 1):
+			first = self.GET(search_url, HTTP_200_OK, {'q': "bike"}).data
+			self.assertEqual(len(first['results']), 1)
+			second = self.GET(
+				search_url, HTTP_200_OK, {'q': "bike", 'after': first['cursor']}).data
+		self.assertListEqual(
+			first['results'] + second['results'], response.data['results'])
+		self.assertIsNone(second['cursor'])
+		response = self.GET(search_url, HTTP_200_OK, {'q': "bike -available"})
+		self.assertEqual(len(response.data['results']), 1)
+		self.GET(search_url, HTTP_400_BAD_REQUEST)
+		self.GET(search_url, HTTP_400_BAD_REQUEST, {'q': "bike", 'after': "invalid"})
+		# cached results are not used after new Message
+		self.POST(self.messages_url, HTTP_201_CREATED, {'text': "bike!"})
+		response = self.GET(search_url, HTTP_200_OK, {'q': "bike"})
+		self.assertEqual(len(response.data['results']), 3)
+		# nor after Messages are read
+		self.authorize(self.interlocutor)
+		self.POST(
+			reverse('message-read', args=(self.chat_uuid,)), HTTP_200_OK,
+			{'timestamp': datetime.now()}
+		)
+		self.authorize(self.user)
+		response = self.GET(search_url, HTTP_200_OK, {'q': "bike"})
+		self.assertTrue(all(message['read'] for message in response.data['results']))
+
+	def test_search_equal_ranks(self, _mocked_push):
+		for i in range(5):
+			self.POST(self.messages_url, HTTP_201_CREATED, {'text': f"bike {i}"})
+		search_url = reverse('chat-search')
+		received, params = [], {'q': "bike"}
+		with mock.patch.object(views.ChatSearch, 'page_size', 1):
+			for _ in range(5):
+				page = self.GET(search_url, HTTP_200_OK, params).data
+				self.assertEqual(len(page['results']), 1)
+				received.extend(message['text'] for message in page['results'])
+				params['after'] = page['cursor']
+		self.assertIsNone(page['cursor'])
+		# same rank, newer first
+		self.assertListEqual(received, [f"bike {i}" for i in reversed(range(5))])
+
 	def test_delete_chat(self, _mocked_push):
 		self.assertEqual(models.Chat.objects.count(), 1)
 		self.DELETE(self.messages_url, HTTP_204_NO_CONTENT)
 		self.assertEqual(models.Chat.objects.count(), 0)
+
+
+@mock.patch.object(BaseTest.user_model, 'notify')
+class TestRealtime(BaseChatTest):
+	"""WebSocket api/chats/ws/"""
+
+	def setUp(self):
+		super().setUp()
+		self.chat = baker.make(
+			models.Chat, make_m2m=True,
+			creator=self.user, interlocutor=self.interlocutor
+		)
+		self.chat_uuid = self.base64uuid(self.chat.uuid)
+		self.messages_url = reverse('message', args=(self.chat_uuid,))
+
+	def connect(self, query_string):
+		return ApplicationCommunicator(websocket_application, {
+			'type': 'websocket', 'path': '/api/chats/ws/',
+			'query_string': query_string.encode(), 'headers': [],
+		})
+
+	@sync_to_async
+	def as_user(self, user, method, url, expected_status, data=None):
+		self.authorize(user)
+		with self.captureOnCommitCallbacks(execute=True):
+			return method(url, expected_status, data)
+
+	async def receive_event(self, communicator):
+		frame = await communicator.receive_output(timeout=1)
+		self.assertEqual(frame['type'], 'websocket.send')
+		return json.loads(frame['text'])
+
+	def test_events(self, _mocked_push):
+		token = models.AuthToken.objects.issue(self.interlocutor).key
+
+		async def scenario():
+			communicator = self.connect(f'token={token}')
+			await communicator.send_input({'type': 'websocket.connect'})
+			self.assertEqual(
+				(await communicator.receive_output(timeout=1))['type'], 'websocket.accept')
+			await self.as_user(
+				self.user, self.POST, self.messages_url, HTTP_201_CREATED, {'text': "Hi"})
+			event = await self.receive_event(communicator)
+			self.assertEqual(event['type'], 'message')
+			self.assertEqual(event['chat'], self.chat_uuid)
+			self.assertDictContainsSubset(
+				{'text': "Hi", 'is_yours': False, 'read': False}, event['message'])
+			# read receipt goes to the author only
+			await self.as_user(
+				self.interlocutor, self.GET, self.messages_url, HTTP_200_OK)
+			self.assertTrue(await communicator.receive_nothing())
+			await self.as_user(
+				self.interlocutor, self.POST, self.messages_url,
+				HTTP_201_CREATED, {'text': "Hello"}
+			)
+			event = await self.receive_event(communicator)
+			self.assertTrue(event['message']['is_yours'])
+			await self.as_user(self.user, self.GET, self.messages_url, HTTP_200_OK)
+			event = await self.receive_event(communicator)
+			self.assertEqual(event['type'], 'read')
+			self.assertEqual(event['chat'], self.chat_uuid)
+			await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+			await communicator.wait(timeout=1)
+
+		async_to_sync(scenario)()
+
+	def test_unauthorized(self, _mocked_push):
+		async def scenario():
+			for query_string in ('', 'token=invalid'):
+				communicator = self.connect(query_string)
+				await communicator.send_input({'type': 'websocket.connect'})
+				self.assertDictEqual(
+					await communicator.receive_output(timeout=1),
+					{'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED}
+				)
+
+		async_to_sync(scenario)()
+
+	def test_publish(self, _mocked_push):
+		backend = realtime.PostgresBackend()
+		event = {'type': 'message', 'chat': self.chat_uuid, 'message': {'text': "я" * 2000}}
+		with CaptureQueriesContext(connection) as queries:
+			backend.publish(self.user.id, event)
+			# too big for a notification
+			event['message']['text'] = "\U0001F6B2" * 2000
+			backend.publish(self.user.id, event)
+		self.assertIn("я" * 2000, queries[0]['sql'])
+		self.assertIn('"truncated": true', queries[1]['sql'])
+		# failures after commit are logged only
+		with mock.patch.object(
+			realtime.InProcessBackend, 'publish', side_effect=RuntimeError
+		), self.assertLogs(realtime.logger, 'ERROR'):
+			realtime.publish(self.user.id, event)
+
+
+class TestMessagePartitions(BaseChatTest):
+	"""manage.py make_message_partitions"""
+
+	table = models.Message._meta.db_table
+
+	def partitions(self):
+		with connection.cursor() as cursor:
+			cursor.execute(
+				"SELECT c.relname FROM pg_inherits i "
+				"JOIN pg_class c ON c.oid = i.inhrelid "
+				"WHERE i.inhparent = %s::regclass", [self.table]
+			)
+			return {name for (name,) in cursor.fetchall()}
+
+	def partition(self, month):
+		return f'{self.table}_y{month:%Y}m{month:%m}'
+
+	def test_partitions(self):
+		add_months = make_message_partitions.add_months
+		this_month = date.today().replace(day=1)
+		chat = baker.make(models.Chat, creator=self.user, interlocutor=self.interlocutor)
+		old = baker.make(models.Message, chat=chat, author=self.user)
+		call_command('make_message_partitions', '--convert', '--ahead=1', stdout=io.StringIO())
+		self.assertSetEqual(self.partitions(), {
+			f'{self.table}_legacy', f'{self.table}_default',
+			self.partition(add_months(this_month, 1))
+		})
+		# Messages without partition are moved from default one to a new one
+		future = baker.make(models.Message, chat=chat, author=self.user)
+		future_month = add_months(this_month, 2)
+		models.Message.objects.filter(pk=future.pk).update(
+			timestamp=datetime.combine(future_month, datetime.min.time()))
+		call_command('make_message_partitions', '--ahead=2', stdout=io.StringIO())
+		self.assertIn(self.partition(future_month), self.partitions())
+		with connection.cursor() as cursor:
+			cursor.execute(f'SELECT id FROM {self.partition(future_month)}')
+			self.assertListEqual(cursor.fetchall(), [(future.pk,)])
+		self.assertEqual(models.Message.objects.count(), 2)
+
+		class Later(date):
+			@classmethod
+			def today(cls):
+				return add_months(this_month, 3)
+
+		with mock.patch.object(make_message_partitions, 'date', Later):
+			call_command('make_message_partitions', '--retain=1', stdout=io.StringIO())
+		self.assertNotIn(f'{self.table}_legacy', self.partitions())
+		self.assertListEqual(
+			list(models.Message.objects.values_list('id', flat=True)), [future.pk])
+		self.assertFalse(models.Message.objects.filter(pk=old.pk).exists())
+		# archived unread Messages are not counted
+		chat.refresh_from_db()
+		self.assertEqual(chat.interlocutor_unread, 1)
+		self.assertEqual(
+			models.UnreadCounter.objects.get_count(self.interlocutor.pk), 1)
+		# archived Messages do not reference Chats anymore
+		chat.delete()
@@ -1,18 +1,28 @@
 """Listings tests."""
 
+import io
+import json
+import tempfile
 from functools import partial
+from unittest import mock
 
+from django.contrib.gis.geos import Point
+from django.core.management import call_command
 from django.urls import reverse
 from model_bakery import baker
 from rest_framework.status import (
-	HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_400_BAD_REQUEST,
-	HTTP_401_UNAUTHORIZED, HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND
+	HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT, HTTP_304_NOT_MODIFIED,
+	HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED, HTTP_403_FORBIDDEN,
+	HTTP_404_NOT_FOUND
 )
 
 
-from quicksell_app import models
+from quicksell_app import models, similar
 from quicksell_app.models.listing import Category
+from quicksell_app.serializers import Base64UUIDField
 from quicksell_app.serializers import Listing as listing_serializer
+from quicksell_app.tiles import tiles
+from quicksell_app.views import MapClusters
 from .basetest import BaseTest
 
 
@@ -28,6 +38,7 @@ class BaseListingsTest(BaseTest):
 	)
 
 	def setUp(self):
+		super().setUp()
 		self.make_user()
 
 
@@ -91,6 +102,15 @@ class TestListingCreation(BaseListingsTest):
 		self.assertEqual(first_page.data['results'][0]['price'], 10)
 		self.assertEqual(last_page.data['results'][-1]['price'], 0)
 
+	def test_query_category_subtree(self):
+		check_result = partial(self.query_paginated_result, self.url_listings)
+		child = baker.make('Category', name='child', parent=self.category)
+		Category.objects.rebuild()
+		baker.make(models.Listing, _quantity=3, make_m2m=True, category=child)
+		baker.make(models.Listing, _quantity=2, make_m2m=True, category=self.category)
+		check_result({'category': self.category.name}, 5)
+		check_result({'category': child.name}, 3)
+
 	def test_create(self):
 		# who are you?
 		self.POST(self.url_listings, HTTP_401_UNAUTHORIZED, self.listing_data)
@@ -272,3 +292,225 @@ class TestListingFull(BaseListingsTest):
 			self.GET(url, HTTP_404_NOT_FOUND)
 			how_many -= 1
 			self.assertEqual(models.Listing.objects.count(), how_many)
+
+
+class TestInfo(BaseTest):
+	"""GET /api/info/"""
+
+	url_info = reverse('info')
+
+	def get_tree(self, etag=None):
+		headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+		response = self.client.get(self.url_info, **headers)
+		if response.status_code == HTTP_304_NOT_MODIFIED:
+			return None, response['ETag']
+		self.assertEqual(response.status_code, HTTP_200_OK)
+		return json.loads(response.content)['categories'], response['ETag']
+
+	def test_categories_tree(self):
+		root = baker.make('Category', name='root', rght=None)
+		for name in ('b', 'a'):
+			baker.make('Category', name=name, parent=root)
+		baker.make('Category', name='__uncategorized__', rght=None)
+		Category.objects.rebuild()
+		tree, etag = self.get_tree()
+		self.assertDictEqual(tree, {'root': {'a': {}, 'b': {}}})
+		self.assertListEqual(list(tree['root']), ['a', 'b'])
+		# nothing changed
+		tree, same_etag = self.get_tree(etag)
+		self.assertIsNone(tree)
+		self.assertEqual(etag, same_etag)
+		# new category invalidates cached tree, again after commit
+		with self.captureOnCommitCallbacks() as callbacks:
+			baker.make('Category', name='c', parent=Category.objects.get(name='a'))
+		self.assertEqual(len(callbacks), 1)
+		Category.objects.rebuild()
+		tree, new_etag = self.get_tree(etag)
+		self.assertDictEqual(tree, {'root': {'a': {'c': {}}, 'b': {}}})
+		self.assertNotEqual(etag, new_etag)
+		Category.objects.get(name='root').delete()
+		tree, _ = self.get_tree(new_etag)
+		self.assertDictEqual(tree, {})
+
+
+class TestMakeCategories(BaseTest):
+	"""manage.py make_categories"""
+
+	def make_categories(self, tree):
+		with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+			json.dump(tree, f)
+			f.flush()
+			call_command('make_categories', f.name, stdout=io.StringIO())
+
+	@staticmethod
+	def tree_fields():
+		return {
+			category.name: (category.parent_id, category.lft, category.rght, category.level)
+			for category in Category.objects.all()
+		}
+
+	def assert_tree(self, tree):
+		# precomputed fields are the same as calculated by MPTT
+		saved = self.tree_fields()
+		Category.objects.rebuild()
+		self.assertDictEqual(saved, self.tree_fields())
+		response = self.client.get(reverse('info'))
+		self.assertDictEqual(json.loads(response.content)['categories'], tree)
+
+	def test_sync(self):
+		tree = {'b': {'b1': {}, 'b2': {'b21': {}, 'b22': {}}}, 'a': {'a1': {}}}
+		self.make_categories(tree)
+		self.assert_tree(tree)
+		ids = dict(Category.objects.values_list('name', 'id'))
+		moved = baker.make('Listing', category=Category.objects.get(name='b21'))
+		removed = baker.make('Listing', category=Category.objects.get(name='b22'))
+		# move b21, remove b2 with b22, add c with c1
+		tree = {'b': {'b1': {}}, 'a': {'a1': {}, 'b21': {}}, 'c': {'c1': {}}}
+		self.make_categories(tree)
+		self.assert_tree(tree)
+		new_ids = dict(Category.objects.values_list('name', 'id'))
+		self.assertEqual(set(new_ids), {*ids, 'c', 'c1'} - {'b2', 'b22'})
+		for name in ('a', 'a1', 'b', 'b1', 'b21', '__uncategorized__'):
+			self.assertEqual(ids[name], new_ids[name])
+		moved.refresh_from_db()
+		self.assertEqual(moved.category_id, ids['b21'])
+		removed.refresh_from_db()
+		self.assertEqual(removed.category_id, ids['__uncategorized__'])
+		# nothing to change
+		self.make_categories(tree)
+		self.assertDictEqual(new_ids, dict(Category.objects.values_list('name', 'id')))
+
+
+class TestListingMap(BaseListingsTest):
+	"""GET /api/listings/map/"""
+
+	url_map = reverse('listing-map')
+
+	def make_listings(self, x, y, quantity, **kwargs):
+		baker.make(
+			models.Listing, _quantity=quantity, make_m2m=True,
+			location=models.Location.objects.resolve(Point(x, y)),
+			status=models.Listing.Status.active, **kwargs
+		)
+
+	def test_map(self):
+		self.make_listings(10.01, 20.01, 3, price=10)
+		self.make_listings(10.02, 20.02, 2, price=20)
+		self.make_listings(11.5, 21.5, 4, price=30)
+		self.make_listings(15, 25, 5)  # outside
+		baker.make(
+			models.Listing, make_m2m=True, status=models.Listing.Status.draft,
+			location=models.Location.objects.resolve(Point(10.01, 20.01))
+		)
+		params = {'bbox': "10, 20, 12, 22", 'zoom': 8}
+		response = self.GET(self.url_map, HTTP_200_OK, params)
+		self.assertEqual(len(response.data['pins']), 9)
+		self.assertFalse(response.data['clusters'])
+		with mock.patch.object(MapClusters, 'pins_threshold', 5):
+			response = self.GET(self.url_map, HTTP_200_OK, params)
+			self.assertFalse(response.data['pins'])
+			counts = sorted(cluster['count'] for cluster in response.data['clusters'])
+			self.assertListEqual(counts, [4, 5])
+			# filters
+			response = self.GET(self.url_map, HTTP_200_OK, params | {'max_price': 20})
+			self.assertEqual(len(response.data['pins']), 5)
+		for invalid in (
+			{'bbox': "0, 0, 90, 90", 'zoom': 15},
+			{'bbox': "10, 20, 12", 'zoom': 8},
+			{'bbox': "10, 20, 12, 22"},
+		):
+			self.GET(self.url_map, HTTP_400_BAD_REQUEST, invalid)
+
+	def get_tile(self, z, x, y):
+		response = self.client.get(
+			reverse('listing-map-tile', kwargs={'z': z, 'x': x, 'y': y}))
+		self.assertEqual(response.status_code, HTTP_200_OK)
+		self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+		return response.content
+
+	def test_tile(self):
+		tiles.clear()
+		self.make_listings(55.75, 37.61, 2)
+		tile = self.get_tile(10, 618, 320)
+		self.assertTrue(tile)
+		with self.assertNumQueries(0):
+			self.assertEqual(self.get_tile(10, 618, 320), tile)
+		listing = models.Listing.objects.first()
+		listing.status = models.Listing.Status.closed
+		with self.captureOnCommitCallbacks() as callbacks:
+			listing.save()
+		self.assertNotEqual(self.get_tile(10, 618, 320), tile)
+		# tile rendered before commit is invalidated after it
+		self.assertTrue(callbacks)
+		for callback in callbacks:
+			callback()
+		with self.assertNumQueries(1):
+			self.get_tile(10, 618, 320)
+		self.assertFalse(self.get_tile(10, 0, 0))
+		# moved Listing leaves tiles of its previous Location
+		moved = models.Listing.objects.filter(status=models.Listing.Status.active).get()
+		self.assertTrue(self.get_tile(10, 618, 320))
+		moved.location = models.Location.objects.resolve(Point(0.1, 0.1))
+		moved.save()
+		self.assertFalse(self.get_tile(10, 618, 320))
+		self.GET(reverse(
+			'listing-map-tile', kwargs={'z': 1, 'x': 2, 'y': 0}
+		), HTTP_404_NOT_FOUND)
+
+
+class TestListingSimilar(BaseListingsTest):
+	"""GET /api/listings/{uuid}/similar/"""
+
+	def make_listing(self, category, title, price, x, **kwargs):
+		return baker.make(
+			models.Listing, title=title, price=price,
+			category=Category.objects.get(name=category),
+			location=models.Location.objects.resolve(Point(x, 37.6)),
+			status=kwargs.pop('status', models.Listing.Status.active), **kwargs
+		)
+
+	def assert_similar(self, listing, expected):
+		to_base64 = Base64UUIDField().to_representation
+		url = reverse('listing-similar', args=(to_base64(listing.uuid),))
+		response = self.GET(url, HTTP_200_OK)
+		self.assertListEqual(
+			[similar['uuid'] for similar in response.data],
+			[to_base64(similar.uuid) for similar in expected]
+		)
+
+	def test_similar(self):
+		for name, parent in (('a', None), ('a1', 'a'), ('a2', 'a'), ('b', None)):
+			baker.make(
+				'Category', name=name, rght=None,
+				parent=Category.objects.get(name=parent) if parent else None
+			)
+		Category.objects.rebuild()
+		listing = self.make_listing('a1', "Red bike", 100, 55.7)
+		closest = self.make_listing('a1', "Red bike", 110, 55.71)
+		far = self.make_listing('a1', "Red bike", 100, 59.9)
+		other_category = self.make_listing('a2', "Red bike", 100, 55.7)
+		other_title = self.make_listing('a1', "Blue bike", 50, 55.7)
+		self.make_listing('b', "Red bike", 100, 55.7)
+		self.make_listing('a1', "Red bike", 100, 55.7, status=models.Listing.Status.draft)
+		self.assert_similar(listing, [])
+		call_command('make_similar', stdout=io.StringIO())
+		expected = [closest, far, other_category, other_title]
+		self.assert_similar(listing, expected)
+		# neighbors of changed Listings are recomputed too
+		closest.status = models.Listing.Status.sold
+		closest.save()
+		call_command('make_similar', stdout=io.StringIO())
+		self.assertFalse(models.SimilarListing.objects.filter(listing=closest).exists())
+		self.assert_similar(listing, expected[1:])
+		# new Listings become neighbors of ones in their Category
+		newer = self.make_listing('a1', "Red bike", 100, 55.7)
+		call_command('make_similar', stdout=io.StringIO())
+		expected = [newer] + expected[1:]
+		self.assert_similar(listing, expected)
+		models.SimilarListing.objects.all().delete()
+		call_command('make_similar', '--full', '--chunk-size=2', stdout=io.StringIO())
+		self.assert_similar(listing, expected)
+		# only Listings closest by price in the closest Categories are scored
+		with mock.patch.object(similar, 'CANDIDATES', 2):
+			call_command('make_similar', '--full', stdout=io.StringIO())
+		self.assert_similar(listing, [newer, far])
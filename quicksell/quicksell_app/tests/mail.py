@@ -0,0 +1,75 @@
+"""Email outbox tests."""
+
+from datetime import datetime, timedelta
+from smtplib import SMTPException
+from unittest import mock
+
+from django.conf import settings
+from django.core import mail
+
+from quicksell_app import models
+from quicksell_app.mail import queue_mail, sender
+from .basetest import BaseTest
+
+failing_smtp = mock.patch(
+	'django.core.mail.backends.locmem.EmailBackend.send_messages',
+	side_effect=SMTPException
+)
+
+
+class TestMail(BaseTest):
+	"""Email outbox delivery."""
+
+	def test_send(self):
+		queue_mail("Subject", "Body", ["to@quicksell.test"])
+		self.assertEqual(len(mail.outbox), 1)
+		self.assertEqual(mail.outbox[0].from_email, self.emails_from)
+		self.assertListEqual(mail.outbox[0].to, ["to@quicksell.test"])
+		self.assertFalse(models.OutgoingEmail.objects.exists())
+
+	def test_after_commit(self):
+		with self.settings(OUTGOING_EMAIL=settings.OUTGOING_EMAIL | {'EAGER': False}):
+			with mock.patch.object(sender, 'put') as mocked_put:
+				with self.captureOnCommitCallbacks() as callbacks:
+					queue_mail("Subject", "Body", ["to@quicksell.test"])
+				mocked_put.assert_not_called()
+				self.assertEqual(len(callbacks), 1)
+				callbacks[0]()
+				mocked_put.assert_called_once()
+
+	def test_retry(self):
+		with failing_smtp:
+			queue_mail("Subject", "Body", ["to@quicksell.test"])
+		email = models.OutgoingEmail.objects.get()
+		self.assertEqual(email.attempts, 1)
+		self.assertGreater(email.next_attempt, datetime.now())
+		# not due yet
+		sender.put(None)
+		self.assertEqual(len(mail.outbox), 0)
+		models.OutgoingEmail.objects.update(next_attempt=datetime.now())
+		sender.put(None)
+		self.assertEqual(len(mail.outbox), 1)
+		self.assertFalse(models.OutgoingEmail.objects.exists())
+
+	def test_give_up(self):
+		config = settings.OUTGOING_EMAIL | {'RETRIES': 0}
+		with self.settings(OUTGOING_EMAIL=config), failing_smtp:
+			queue_mail("Subject", "Body", ["to@quicksell.test"])
+		email = models.OutgoingEmail.objects.get()
+		self.assertEqual(email.attempts, 1)
+		self.assertIsNone(email.next_attempt)
+
+	def test_schedule_retry(self):
+		with failing_smtp:
+			queue_mail("Subject", "Body", ["to@quicksell.test"])
+			queue_mail("Subject", "Body", ["to@quicksell.test"])
+		# due one is being sent by another process
+		due, failed = models.OutgoingEmail.objects.order_by('id')
+		models.OutgoingEmail.objects.filter(pk=due.pk).update(
+			next_attempt=datetime.now() - timedelta(minutes=1))
+		with mock.patch('quicksell_app.mail.threading.Timer') as timer:
+			sender.schedule_retry()
+		delay = timer.call_args[0][0]
+		self.assertGreater(delay, 0)
+		self.assertAlmostEqual(
+			delay, (failed.next_attempt - datetime.now()).total_seconds(), delta=1)
@@ -0,0 +1,100 @@
+"""Media serving tests."""
+
+import tempfile
+from pathlib import Path
+
+from django.urls import reverse
+from django.utils.http import http_date
+from model_bakery import baker
+from rest_framework.status import (
+	HTTP_200_OK, HTTP_206_PARTIAL_CONTENT, HTTP_304_NOT_MODIFIED,
+	HTTP_404_NOT_FOUND, HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+)
+from rest_framework.test import override_settings
+
+from quicksell_app import models
+from .basetest import BaseTest
+
+
+class TestMedia(BaseTest):
+	"""GET api/media/<path>"""
+
+	content = bytes(range(256)) * 4
+
+	def setUp(self):
+		super().setUp()
+		self.make_user()
+		media_root = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+		self.addCleanup(media_root.cleanup)
+		self.media_root = Path(media_root.name)
+		settings_override = override_settings(
+			MEDIA_ROOT=self.media_root, MEDIA_SENDFILE_HEADER=None)
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+		self.listing = baker.make(
+			'Listing', seller=self.user.profile, status=models.Listing.Status.active)
+		self.photo = baker.make(
+			'quicksell_app.Photo', listing=self.listing, image='images/listings/a.jpg')
+		(self.media_root / 'images' / 'listings').mkdir(parents=True)
+		(self.media_root / self.photo.image.name).write_bytes(self.content)
+		self.url = reverse('media', args=(self.photo.image.name,))
+
+	def read(self, response):
+		return b''.join(response.streaming_content)
+
+	def test_serve(self):
+		response = self.client.get(self.url)
+		self.assertEqual(response.status_code, HTTP_200_OK)
+		self.assertEqual(response['Content-Type'], 'image/jpeg')
+		self.assertEqual(int(response['Content-Length']), len(self.content))
+		self.assertEqual(self.read(response), self.content)
+		last_modified = response['Last-Modified']
+		response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+		self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+		response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=http_date(0))
+		self.assertEqual(response.status_code, HTTP_200_OK)
+
+	def test_ranges(self):
+		size = len(self.content)
+		for header, start, end in (
+			('bytes=0-99', 0, 99),
+			('bytes=100-', 100, size - 1),
+			('bytes=-24', size - 24, size - 1),
+			('bytes=1000-5000', 1000, size - 1),
+		):
+			response = self.client.get(self.url, HTTP_RANGE=header)
+			self.assertEqual(response.status_code, HTTP_206_PARTIAL_CONTENT, header)
+			self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{size}')
+			self.assertEqual(int(response['Content-Length']), end - start + 1)
+			self.assertEqual(self.read(response), self.content[start:end + 1])
+		for header in ('bytes=5000-', 'bytes=-0', 'bytes=10-5'):
+			response = self.client.get(self.url, HTTP_RANGE=header)
+			self.assertEqual(
+				response.status_code, HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, header)
+
+	def test_sendfile_headers(self):
+		with override_settings(
+			MEDIA_SENDFILE_HEADER='X-Accel-Redirect', MEDIA_ACCEL_PREFIX='/internal/'
+		):
+			response = self.client.get(self.url)
+			self.assertEqual(response.status_code, HTTP_200_OK)
+			self.assertEqual(
+				response['X-Accel-Redirect'], '/internal/' + self.photo.image.name)
+			self.assertFalse(response.content)
+		with override_settings(MEDIA_SENDFILE_HEADER='X-Sendfile'):
+			response = self.client.get(self.url)
+			self.assertEqual(
+				response['X-Sendfile'],
+				str((self.media_root / self.photo.image.name).resolve())
+			)
+
+	def test_access(self):
+		self.GET(reverse('media', args=('../settings.py',)), HTTP_404_NOT_FOUND)
+		self.GET(reverse('media', args=('images/listings/b.jpg',)), HTTP_404_NOT_FOUND)
+		self.GET(reverse('media', args=('other/a.jpg',)), HTTP_404_NOT_FOUND)
+		# drafts are visible only to the seller
+		self.listing.status = models.Listing.Status.draft
+		self.listing.save()
+		self.GET(self.url, HTTP_404_NOT_FOUND)
+		self.authorize()
+		self.assertEqual(self.client.get(self.url).status_code, HTTP_200_OK)
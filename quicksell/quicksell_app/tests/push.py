@@ -0,0 +1,76 @@
+"""Push notifications tests."""
+
+from unittest import mock
+
+from django.conf import settings
+from model_bakery import baker
+from pyfcm.errors import FCMServerError
+
+from quicksell_app import models
+from quicksell_app.models.user import DeviceManager
+from quicksell_app.push import dispatcher
+from .basetest import BaseTest
+
+
+class TestPush(BaseTest):
+	"""Push notifications dispatch."""
+
+	def setUp(self):
+		super().setUp()
+		self.client_fcm = dispatcher.get_client()
+		self.client_fcm.sent.clear()
+		self.client_fcm.failing.clear()
+		self.devices = baker.make('Device', _quantity=3)
+
+	def test_notify(self):
+		user = baker.make(self.user_model, make_m2m=True, device=self.devices[0])
+		user.notify(title="Title", body="Body")
+		self.assertListEqual(
+			self.client_fcm.sent, [([self.devices[0].fcm_id], "Title", "Body")])
+		user.device.is_active = False
+		user.notify(title="Title", body="Body")
+		self.assertEqual(len(self.client_fcm.sent), 1)
+
+	def test_coalesce(self):
+		first, second, third = (
+			(device.id, device.fcm_id) for device in self.devices)
+		dispatcher.handle([
+			(*first, "A", "old"), (*second, "A", "new"),
+			(*first, "A", "new"), (*third, "B", "other"),
+		])
+		self.assertCountEqual(self.client_fcm.sent, [
+			([first[1], second[1]], "A", "new"), ([third[1]], "B", "other"),
+		])
+
+	def test_fails(self):
+		device = self.devices[0]
+		self.client_fcm.failing.add(device.fcm_id)
+		for _ in range(DeviceManager.MAX_FAILS - 1):
+			dispatcher.notify(device, "Title", "Body")
+		device.refresh_from_db()
+		self.assertEqual(device.fails_count, DeviceManager.MAX_FAILS - 1)
+		self.assertTrue(device.is_active)
+		self.client_fcm.failing.clear()
+		dispatcher.notify(device, "Title", "Body")
+		device.refresh_from_db()
+		self.assertEqual(device.fails_count, 0)
+		self.client_fcm.failing.add(device.fcm_id)
+		for _ in range(DeviceManager.MAX_FAILS):
+			dispatcher.notify(device, "Title", "Body")
+		self.assertFalse(models.Device.objects.get(id=device.id).is_active)
+
+	def test_retry(self):
+		device = self.devices[0]
+		device.fails_count = 1
+		device.save()
+		results = {'results': [{'message_id': '1'}]}
+		with mock.patch.object(
+			self.client_fcm, 'notify_multiple_devices',
+			side_effect=[FCMServerError(), FCMServerError(), results]
+		) as send, self.settings(
+			PUSH_NOTIFICATIONS=settings.PUSH_NOTIFICATIONS | {'BACKOFF': 0}
+		):
+			dispatcher.notify(device, "Title", "Body")
+		self.assertEqual(send.call_count, 3)
+		device.refresh_from_db()
+		self.assertEqual(device.fails_count, 0)
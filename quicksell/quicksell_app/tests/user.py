@@ -1,19 +1,30 @@
 """User testing."""
 
+import io
+import threading
+import time
 from datetime import datetime, timedelta
 from functools import partial
+from unittest import mock
 
+from django.conf import settings
+from django.contrib.gis.geos import Point
 from django.core import mail
-from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
 from model_bakery import baker
 from rest_framework.status import (
-	HTTP_200_OK, HTTP_201_CREATED, HTTP_202_ACCEPTED, HTTP_400_BAD_REQUEST,
-	HTTP_401_UNAUTHORIZED, HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND,
-	HTTP_429_TOO_MANY_REQUESTS
+	HTTP_200_OK, HTTP_201_CREATED, HTTP_202_ACCEPTED, HTTP_204_NO_CONTENT,
+	HTTP_400_BAD_REQUEST, HTTP_401_UNAUTHORIZED, HTTP_403_FORBIDDEN,
+	HTTP_404_NOT_FOUND, HTTP_429_TOO_MANY_REQUESTS, HTTP_503_SERVICE_UNAVAILABLE
 )
 
-from quicksell_app import models
+from quicksell_app import hashers, models
+from quicksell_app.authentication import tokens
+from quicksell_app.models.geography import default_location
+from quicksell_app.throttling import DatabaseStore
 from .basetest import BaseTest
 
 
@@ -65,8 +76,43 @@ class TestAuthentication(BaseUserTest):
 			data = {'username': username, 'password': self.user_pass}
 			response = self.POST(self.url_login, HTTP_200_OK, data)
 			self.assertIn('token', response.data)
-			self.user.refresh_from_db(fields=('auth_token',))
-			self.assertEqual(str(self.user.auth_token), response.data['token'])
+			# previous token is replaced
+			self.assertListEqual(
+				list(self.user.auth_tokens.values_list('key', flat=True)),
+				[response.data['token']]
+			)
+
+	def test_devices(self):
+		data = {'username': self.user.email, 'password': self.user_pass}
+		keys = {}
+		for fcm_id in ("a" * 100, "b" * 100, "a" * 100):
+			response = self.POST(self.url_login, HTTP_200_OK, data | {'fcm_id': fcm_id})
+			keys[fcm_id] = response.data['token']
+			self.user.refresh_from_db()
+			self.assertEqual(self.user.device.fcm_id, fcm_id)
+		# each device has its own token, the latest one of a device is valid
+		self.assertSetEqual(
+			set(self.user.auth_tokens.values_list('key', flat=True)), set(keys.values()))
+		self.assertEqual(models.Device.objects.count(), 2)
+		for key in keys.values():
+			self.client.credentials(HTTP_AUTHORIZATION='Token ' + key)
+			self.GET(self.url_user, HTTP_200_OK)
+
+	def test_import_tokens(self):
+		with connection.cursor() as cursor:
+			cursor.execute(
+				'CREATE TABLE authtoken_token (key varchar(40) PRIMARY KEY, '
+				'created timestamp NOT NULL, user_id integer NOT NULL)')
+			cursor.execute(
+				'INSERT INTO authtoken_token VALUES (%s, now(), %s)',
+				["k" * 40, self.user.pk]
+			)
+		call_command('import_tokens', stdout=io.StringIO())
+		self.assertNotIn('authtoken_token', connection.introspection.table_names())
+		self.client.credentials(HTTP_AUTHORIZATION='Token ' + "k" * 40)
+		self.GET(self.url_user, HTTP_200_OK)
+		call_command('import_tokens', stdout=io.StringIO())
+		self.assertEqual(self.user.auth_tokens.count(), 1)
 
 	def test_invalid_credentials(self):
 		for data in (
@@ -77,6 +123,136 @@ class TestAuthentication(BaseUserTest):
 			response = self.POST(self.url_login, HTTP_400_BAD_REQUEST, data)
 			self.assertNotIn('token', response.data)
 
+	def test_cached_token(self):
+		def get_user():
+			with CaptureQueriesContext(connection) as queries:
+				self.GET(self.url_user, HTTP_200_OK)
+			return len(queries)
+
+		tokens.clear()
+		self.authorize()
+		uncached = get_user()
+		self.assertLess(get_user(), uncached)
+		# saved changes are not hidden by cache
+		self.user.profile.full_name = "Changed Name"
+		self.user.profile.save()
+		response = self.GET(self.url_user, HTTP_200_OK)
+		self.assertEqual(response.data['profile']['full_name'], "Changed Name")
+		# process without local entries invalidates shared ones too
+		self.GET(self.url_user, HTTP_200_OK)
+		tokens.clear()
+		self.user.is_active = False
+		self.user.save()
+		self.GET(self.url_user, HTTP_401_UNAUTHORIZED)
+
+	@override_settings(
+		PASSWORD_HASHERS=('quicksell_app.hashers.PooledPBKDF2PasswordHasher',))
+	def test_pooled_hashing(self):
+		self.user.set_password(self.user_pass)
+		self.user.save()
+		self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+		data = {'username': self.user.email, 'password': self.user_pass}
+		self.POST(self.url_login, HTTP_200_OK, data)
+		rejected = hashers.pool.metrics()['rejected']
+		overloaded = settings.PASSWORD_HASHING | {'MAX_PENDING': 0, 'QUEUE_TIMEOUT': 0}
+		with self.settings(PASSWORD_HASHING=overloaded):
+			response = self.POST(self.url_login, HTTP_503_SERVICE_UNAVAILABLE, data)
+			self.assertEqual(response['Retry-After'], '1')
+			# outside of API too
+			response = self.client.post(
+				reverse('admin:login'), data, format='multipart')
+			self.assertEqual(response.status_code, HTTP_503_SERVICE_UNAVAILABLE)
+			self.assertEqual(response['Retry-After'], '1')
+		self.assertDictEqual(
+			hashers.pool.metrics(), {'depth': 0, 'pending': 0, 'rejected': rejected + 2})
+		# pools of app processes share host's workers
+		self.assertEqual(hashers.pool_size({'WORKERS': 8, 'APP_PROCESSES': 3}), 2)
+		self.assertEqual(hashers.pool_size({'WORKERS': 2, 'APP_PROCESSES': 5}), 1)
+
+	def test_hashing_metrics(self):
+		pool = hashers.HashingPool()
+		executor = mock.Mock()
+		executor.submit.side_effect = lambda function: mock.Mock(result=function)
+		with mock.patch.object(pool, 'get_executor', return_value=(
+			executor, threading.BoundedSemaphore(1), settings.PASSWORD_HASHING
+		)):
+			running = pool.run(pool.metrics)
+		self.assertDictEqual(running, {'depth': 1, 'pending': 1, 'rejected': 0})
+		self.assertDictEqual(pool.metrics(), {'depth': 0, 'pending': 0, 'rejected': 0})
+
+	def test_token_lifecycle(self):
+		data = {'username': self.user.email, 'password': self.user_pass}
+		token = self.POST(self.url_login, HTTP_200_OK, data).data['token']
+		self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+		self.GET(self.url_user, HTTP_200_OK)
+		self.assertIsNotNone(models.AuthToken.objects.get(key=token).last_seen)
+		# expired
+		models.AuthToken.objects.update(expires=datetime.now())
+		tokens.clear()
+		self.GET(self.url_user, HTTP_401_UNAUTHORIZED)
+		token = self.POST(self.url_login, HTTP_200_OK, data).data['token']
+		self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+		self.DELETE(reverse('logout'), HTTP_204_NO_CONTENT)
+		self.GET(self.url_user, HTTP_401_UNAUTHORIZED)
+		self.assertFalse(models.AuthToken.objects.exists())
+		# cleanup
+		baker.make(
+			models.AuthToken, expires=datetime.now() - timedelta(days=1), _quantity=3)
+		fresh = models.AuthToken.objects.issue(self.user)
+		call_command('clean_tokens', '--chunk-size=2', stdout=io.StringIO())
+		self.assertListEqual(
+			list(models.AuthToken.objects.values_list('key', flat=True)), [fresh.key])
+
+
+class TestThrottling(BaseUserTest):
+	"""Login and signup rate limits."""
+
+	def test_login(self):
+		self.make_user()
+		valid = {'username': self.user.email, 'password': self.user_pass}
+		data = {'username': self.user.email, 'password': "wrong pass"}
+		for _ in range(9):
+			self.POST(self.url_login, HTTP_400_BAD_REQUEST, data)
+		# successful logins are not counted
+		for _ in range(3):
+			self.POST(self.url_login, HTTP_200_OK, valid)
+		self.POST(self.url_login, HTTP_400_BAD_REQUEST, data)
+		data['username'] = f" {self.user.email.upper()}"
+		self.POST(self.url_login, HTTP_429_TOO_MANY_REQUESTS, data)
+		# other accounts are not affected
+		data['username'] = "other@quicksell.test"
+		self.POST(self.url_login, HTTP_400_BAD_REQUEST, data)
+
+	def test_login_ip(self):
+		with mock.patch(
+			'quicksell_app.throttling.LoginIPThrottle.rate', '2/min', create=True
+		):
+			for username in ("one@quicksell.test", "two@quicksell.test"):
+				self.POST(self.url_login, HTTP_400_BAD_REQUEST, {'username': username})
+			self.POST(
+				self.url_login, HTTP_429_TOO_MANY_REQUESTS,
+				{'username': "three@quicksell.test"}
+			)
+
+	@override_settings(THROTTLE_STORE='quicksell_app.throttling.DatabaseStore')
+	def test_long_username(self):
+		self.POST(self.url_login, HTTP_400_BAD_REQUEST, {'username': "a" * 1000})
+
+	def test_signup(self):
+		with mock.patch(
+			'quicksell_app.throttling.SignupThrottle.rate', '1/hour', create=True
+		):
+			self.POST(self.url_user, HTTP_201_CREATED, self.valid_reg_data)
+			self.POST(self.url_user, HTTP_429_TOO_MANY_REQUESTS, self.valid_reg_data)
+
+	def test_database_store(self):
+		store = DatabaseStore()
+		window = int(time.time()) // 60
+		self.assertTupleEqual(store.hit('key', window, 60), (1, 0))
+		self.assertTupleEqual(store.hit('key', window, 60), (2, 0))
+		self.assertTupleEqual(store.hit('other', window, 60), (1, 0))
+		self.assertTupleEqual(store.hit('key', window + 1, 60), (1, 2))
+
 
 class TestUserCreation(BaseUserTest):
 	"""POST, GET api/users/"""
@@ -160,7 +336,6 @@ class TestPasswordActions(BaseUserTest):
 	def setUp(self):
 		super().setUp()
 		self.make_user()
-		cache.clear()
 
 	def test_reset_password_wrong_email(self):
 		data = {'email': self.good_mail}
@@ -372,6 +547,22 @@ class TestProfileActions(BaseUserTest):
 		self.assertEqual(first_page.data['results'][0]['rating'], 20)
 		self.assertEqual(last_page.data['results'][-1]['rating'], 10)
 
+	def test_default_location(self):
+		self.addCleanup(default_location.forget)
+		with self.captureOnCommitCallbacks(execute=True):
+			pk = models.Location.default_pk()
+		# deleted by another process, without signals
+		with connection.cursor() as cursor:
+			cursor.execute(
+				f'DELETE FROM {models.Location._meta.db_table} WHERE id = %s', [pk])
+		self.assertEqual(models.Location.default_pk(), pk)
+		later = time.monotonic() + default_location.recheck_interval + 1
+		with mock.patch('time.monotonic', return_value=later):
+			with self.captureOnCommitCallbacks(execute=True):
+				new_pk = models.Location.default_pk()
+		self.assertNotEqual(new_pk, pk)
+		self.assertTrue(models.Location.objects.filter(pk=new_pk).exists())
+
 	def test_update_profile(self):
 		# edit name
 		data = {'full_name': "Test User"}
@@ -395,6 +586,47 @@ class TestProfileActions(BaseUserTest):
 		self.assertNotEqual(data['full_name'], self.profile.full_name)
 
 
+	def test_shared_location(self):
+		data = {'location': {'coordinates': "12.3, 45.6", 'address': "First"}}
+		self.PATCH(self.url_profile, HTTP_200_OK, data)
+		location_id = models.Profile.objects.get(pk=self.profile.pk).location_id
+		# address of the point can't be changed
+		self.PATCH(self.url_profile, HTTP_400_BAD_REQUEST, {'location': {'address': "New"}})
+		# another user at the same point shares it
+		another_user = baker.make(self.user_model, make_m2m=True)
+		self.authorize(another_user)
+		data['location']['address'] = "Second"
+		self.PATCH(self.url_profile, HTTP_400_BAD_REQUEST, data)
+		del data['location']['address']
+		response = self.PATCH(self.url_profile, HTTP_200_OK, data)
+		self.assertEqual(response.data['location']['address'], "First")
+		another_user.profile.refresh_from_db()
+		self.assertEqual(another_user.profile.location_id, location_id)
+		# nearby points are merged with lower precision
+		data['location']['coordinates'] = "12.30001, 45.60001"
+		with self.settings(LOCATION_PRECISION=3):
+			self.PATCH(self.url_profile, HTTP_200_OK, data)
+		another_user.profile.refresh_from_db()
+		self.assertEqual(another_user.profile.location_id, location_id)
+		self.PATCH(self.url_profile, HTTP_200_OK, data)
+		another_user.profile.refresh_from_db()
+		self.assertNotEqual(another_user.profile.location_id, location_id)
+		# empty address is set later
+		location = models.Location.objects.resolve(Point(3, 4))
+		self.assertEqual(models.Location.objects.resolve(Point(3, 4), "c").id, location.id)
+		self.assertEqual(models.Location.objects.get(pk=location.id).address, "c")
+		# batch resolution
+		points = [(Point(1, 2), "a"), (Point(3, 4), ""), (Point(1, 2), "b")]
+		with self.assertNumQueries(2):
+			locations = models.Location.objects.resolve_many(points)
+		self.assertEqual(locations[0].id, locations[2].id)
+		self.assertEqual(locations[0].address, "a")
+		self.assertEqual(locations[1].id, location.id)
+		self.assertEqual(locations[1].address, "c")
+		with self.assertNumQueries(0):
+			self.assertListEqual(models.Location.objects.resolve_many([]), [])
+
+
 class TestUserFull(BaseUserTest):
 	"""Test all User's actions together."""
 
@@ -0,0 +1,189 @@
+"""Sliding window throttling with counters shared between processes."""
+
+import hashlib
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+from rest_framework.throttling import SimpleRateThrottle
+
+from quicksell_app.models import ThrottleCounter
+
+
+class DatabaseStore:
+	"""Counters in database table, shared by all processes and nodes.
+
+	Expired counters are deleted on some hits with `prune_probability`.
+	"""
+
+	prune_probability = 0.01
+
+	def hit(self, key, window, duration):
+		"""Increments counter of `window`, returns it with the previous one."""
+		qn = connection.ops.quote_name
+		table = qn(ThrottleCounter._meta.db_table)
+		with connection.cursor() as cursor:
+			cursor.execute(
+				f'WITH hit AS ('
+				f'INSERT INTO {table} (key, "window", count, expires) '
+				f'VALUES (%s, %s, 1, %s) ON CONFLICT (key, "window") '
+				f'DO UPDATE SET count = {table}.count + 1 RETURNING count) '
+				f'SELECT (SELECT count FROM hit), COALESCE((SELECT count FROM {table} '
+				f'WHERE key = %s AND "window" = %s), 0)',
+				[key, window, (window + 2) * duration, key, window - 1]
+			)
+			current, previous = cursor.fetchone()
+			if random.random() < self.prune_probability:
+				cursor.execute(
+					f'DELETE FROM {table} WHERE expires < %s', [int(time.time())])
+		return current, previous
+
+	@staticmethod
+	def counts(key, window):
+		"""Counter of `window` and the previous one."""
+		counts = dict(ThrottleCounter.objects.filter(
+			key=key, window__in=(window, window - 1)).values_list('window', 'count'))
+		return counts.get(window, 0), counts.get(window - 1, 0)
+
+	def clear(self):
+		ThrottleCounter.objects.all().delete()
+
+
+class LocalStore:
+	"""Counters in memory of the process, for tests and development."""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.counters = defaultdict(int)
+
+	def hit(self, key, window, duration):
+		with self.lock:
+			self.counters[key, window] += 1
+			return self.counters[key, window], self.counters.get((key, window - 1), 0)
+
+	def counts(self, key, window):
+		with self.lock:
+			return (
+				self.counters.get((key, window), 0),
+				self.counters.get((key, window - 1), 0)
+			)
+
+	def clear(self):
+		with self.lock:
+			self.counters.clear()
+
+
+stores = {}
+
+
+def get_store():
+	path = settings.THROTTLE_STORE
+	if path not in stores:
+		stores[path] = import_string(path)()
+	return stores[path]
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+	"""Limits requests by estimate of their number in the last `duration` seconds.
+
+	Estimate is the count of current fixed window plus the count
+	of the previous one weighted by its part still in the sliding window.
+	Rejected requests are counted too.
+	"""
+
+	def get_cache_key(self, request, view):
+		raise NotImplementedError
+
+	def store_key(self, key):
+		# idents are user input of any length
+		return f'{self.scope}:{hashlib.sha1(str(key).encode()).hexdigest()}'
+
+	def count(self, key, window):
+		"""Counts request, returns counters of `window` and the previous one."""
+		return get_store().hit(key, window, self.duration)
+
+	def allow_request(self, request, view):
+		if self.rate is None:
+			return True
+		if (key := self.get_cache_key(request, view)) is None:
+			return True
+		now = time.time()
+		window, elapsed = divmod(now, self.duration)
+		current, previous = self.count(self.store_key(key), int(window))
+		estimate = current + previous * (1 - elapsed / self.duration)
+		self.remaining = self.duration - elapsed
+		return estimate <= self.num_requests
+
+	def wait(self):
+		return self.remaining
+
+
+class FailureThrottle(SlidingWindowThrottle):
+	"""Limits requests by number of failed ones, recorded by view with `failed`."""
+
+	def count(self, key, window):
+		current, previous = get_store().counts(key, window)
+		return current + 1, previous  # as if this request fails too
+
+	def failed(self, request, view):
+		if self.rate is None:
+			return
+		if (key := self.get_cache_key(request, view)) is not None:
+			window = int(time.time() // self.duration)
+			get_store().hit(self.store_key(key), window, self.duration)
+
+
+class UserThrottle(SlidingWindowThrottle):
+	"""Limits requests by User, or by IP for anonymous ones."""
+
+	def get_cache_key(self, request, view):
+		if request.user and request.user.is_authenticated:
+			return request.user.pk
+		return self.get_ident(request)
+
+
+class IPThrottle(SlidingWindowThrottle):
+	"""Limits requests by IP."""
+
+	def get_cache_key(self, request, view):
+		return self.get_ident(request)
+
+
+class UsernameThrottle(SlidingWindowThrottle):
+	"""Limits requests by `username` in request body."""
+
+	def get_cache_key(self, request, view):
+		if not isinstance(request.data, dict):
+			return None
+		if isinstance(username := request.data.get('username'), str):
+			return username.strip().lower()
+		return None
+
+
+class PasswordResetDaily(UserThrottle):
+	"""Rate limit on password reset endpoint per day."""
+	scope = 'password_reset.day'
+
+
+class PasswordResetHourly(UserThrottle):
+	"""Rate limit on password reset endpoint per hour."""
+	scope = 'password_reset.hour'
+
+
+class LoginThrottle(FailureThrottle, UsernameThrottle):
+	"""Rate limit on failed login attempts to an account."""
+	scope = 'login'
+
+
+class LoginIPThrottle(IPThrottle):
+	"""Rate limit on login attempts from an IP."""
+	scope = 'login.ip'
+
+
+class SignupThrottle(IPThrottle):
+	"""Rate limit on signups from an IP."""
+	scope = 'signup'
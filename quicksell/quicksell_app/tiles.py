@@ -0,0 +1,103 @@
+"""Mapbox Vector Tiles of active Listings."""
+
+import math
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from quicksell_app.cache import TwoTierCache
+from quicksell_app.models import Listing, Location
+
+MAX_ZOOM = 20
+EXTENT = 4096
+LAYER = 'listings'
+
+tiles = TwoTierCache(
+	'tiles', settings.MAP_TILE_CACHE['MAXSIZE'], settings.MAP_TILE_CACHE['LOCAL_TTL'])
+
+
+def tile_sql():
+	listing_table = connection.ops.quote_name(Listing._meta.db_table)
+	location_table = connection.ops.quote_name(Location._meta.db_table)
+	# coordinates are stored as (latitude, longitude)
+	return f"""
+		WITH bounds AS (SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS envelope)
+		SELECT ST_AsMVT(tile, '{LAYER}', {EXTENT}, 'geom') FROM (
+			SELECT
+				ST_AsMVTGeom(
+					ST_Transform(ST_FlipCoordinates(location.coordinates), 3857),
+					bounds.envelope, {EXTENT}
+				) AS geom,
+				rtrim(translate(
+					encode(uuid_send(listing.uuid), 'base64'), '+/', '-_'
+				), '=') AS uuid,
+				listing.price,
+				listing.category_id
+			FROM {listing_table} AS listing
+			JOIN {location_table} AS location ON location.id = listing.location_id
+			CROSS JOIN bounds
+			WHERE listing.status = %(status)s AND location.coordinates
+				&& ST_FlipCoordinates(ST_Transform(bounds.envelope, 4326))
+		) AS tile
+	"""
+
+
+def render_tile(z, x, y):
+	with connection.cursor() as cursor:
+		cursor.execute(tile_sql(), {
+			'z': z, 'x': x, 'y': y, 'status': Listing.Status.active.value
+		})
+		return bytes(cursor.fetchone()[0] or b'')
+
+
+def get_tile(z, x, y):
+	return tiles.get_or_set(
+		(z, x, y), lambda: render_tile(z, x, y), settings.MAP_TILE_CACHE['TTL'])
+
+
+def point_tiles(point):
+	"""Web Mercator tiles containing (latitude, longitude) point at every zoom."""
+	latitude = max(min(point.x, 85.0511), -85.0511)
+	x = (point.y + 180) / 360
+	y = (1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2
+	for z in range(MAX_ZOOM + 1):
+		n = 2 ** z
+		yield z, min(int(x * n), n - 1), min(int(y * n), n - 1)
+
+
+def invalidate_location(location_id, location=None):
+	if location is not None and location.id == location_id:
+		point = location.coordinates
+	elif location_id is not None:
+		point = Location.objects.filter(pk=location_id).values_list(
+			'coordinates', flat=True).first()
+	else:
+		point = None
+	if point is None:
+		return
+	keys = list(point_tiles(point))
+	tiles.delete_many(keys)
+	# other processes may render tiles from before the commit meanwhile
+	transaction.on_commit(lambda: tiles.delete_many(keys))
+
+
+@receiver(pre_save, sender=Listing)
+def invalidate_previous_tiles(instance, update_fields=None, **_kwargs):
+	"""Tiles of Listing's previous Location, if it's moved."""
+	if instance._state.adding or (
+		update_fields is not None
+		and not {'location', 'location_id'} & set(update_fields)
+	):
+		return
+	previous = Listing.objects.filter(pk=instance.pk).values_list(
+		'location_id', flat=True).first()
+	if previous != instance.location_id:
+		invalidate_location(previous)
+
+
+@receiver((post_save, post_delete), sender=Listing)
+def invalidate_tiles(instance, **_kwargs):
+	invalidate_location(
+		instance.location_id, instance._state.fields_cache.get('location'))
@@ -1,7 +1,6 @@
 """Endpoints."""
 
 from django.urls import include, path
-from rest_framework.authtoken.views import obtain_auth_token
 from rest_framework.routers import DefaultRouter
 
 from quicksell_app import views
@@ -16,10 +15,11 @@ urlpatterns = router.urls + [
 		path('silk/', include('silk.urls', namespace='silk')),
 	])),
 	path('info/', views.Info.as_view(), name='info'),
+	path('media/<path:path>', views.Media.as_view(), name='media'),
 	path('users/', include([
 		path('', views.User.as_view(), name='user'),
-		path('login/', obtain_auth_token, name='login'),
-		# path('logout/', name='logout'),  # DELETE
+		path('login/', views.Login.as_view(), name='login'),
+		path('logout/', views.Logout.as_view(), name='logout'),
 		path('password/', views.Password.as_view(), name='password'),
 		path('email/<str:base64email>/<str:token>/',
 			views.EmailConfirm.as_view(), name='email-confirm'),
@@ -31,11 +31,24 @@ urlpatterns = router.urls + [
 	])),
 	path('listings/', include([
 		path('', views.Listing.as_view(), name='listing'),
+		path('map/', views.MapClusters.as_view(), name='listing-map'),
+		path('map/<int:z>/<int:x>/<int:y>.mvt',
+			views.MapTile.as_view(), name='listing-map-tile'),
 		path('<str:base64uuid>/',
 			views.ListingDetail.as_view(), name='listing-detail'),
+		path('<str:base64uuid>/similar/',
+			views.ListingSimilar.as_view(), name='listing-similar'),
 	])),
 	path('chats/', include([
 		path('', views.Chat.as_view(), name='chat'),
+		path('unread/', views.ChatUnread.as_view(), name='chat-unread'),
+		path('updates/', views.ChatUpdates.as_view(), name='chat-updates'),
+		path('search/', views.ChatSearch.as_view(), name='chat-search'),
+		path('listings/', views.ChatListing.as_view(), name='chat-listing'),
+		path('listings/<str:base64uuid>/',
+			views.ChatListingDetail.as_view(), name='chat-listing-detail'),
 		path('<str:base64uuid>/', views.Message.as_view(), name='message'),
+		path('<str:base64uuid>/read/',
+			views.MessageRead.as_view(), name='message-read'),
 	]))
 ]
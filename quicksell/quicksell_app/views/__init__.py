@@ -1,8 +1,13 @@
 """Views."""
 
-from .chat import Chat, Message
+from .chat import (
+	Chat, ChatListing, ChatListingDetail, ChatSearch, ChatUnread, ChatUpdates,
+	Message, MessageRead
+)
 from .info import Info
-from .listing import Listing, ListingDetail
+from .listing import Listing, ListingDetail, ListingSimilar
+from .map import MapClusters, MapTile
+from .media import Media
 from .password import Password
 from .profile import Profile, ProfileDetail
-from .user import EmailConfirm, User
+from .user import EmailConfirm, Login, Logout, User
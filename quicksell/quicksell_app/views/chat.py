@@ -1,16 +1,112 @@
 """Chats and Messages views."""
 
+import threading
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db.models import Case, Count, F, FloatField, Max, Min, Q, Sum, When
+from django.db.models.functions import Cast
 from django.utils.decorators import method_decorator
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.generics import (
-	GenericAPIView, ListCreateAPIView, get_object_or_404
+	GenericAPIView, ListAPIView, ListCreateAPIView, get_object_or_404
 )
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.status import HTTP_201_CREATED, HTTP_204_NO_CONTENT
+from rest_framework.status import (
+	HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT
+)
 
 from quicksell_app import models, serializers
+from quicksell_app.cache import TwoTierCache
+from quicksell_app.models.chat import text_search
+from quicksell_app.realtime import wait_for
+
+
+waiting = threading.BoundedSemaphore(settings.LONG_POLLING['MAX_WAITING'])
+
+
+class MessageSyncMixin:
+	"""Messages after cursor, optionally waiting for them."""
+
+	sync_limit = 100
+
+	def sync_messages(self, request, queryset):
+		"""Returns Messages from `queryset` after `after` cursor and next cursor.
+
+		If there are none, waits up to `wait` seconds for new ones,
+		unless too many requests of the process are waiting already.
+		"""
+		query = serializers.MessageSyncQuery(data=request.query_params)
+		query.is_valid(raise_exception=True)
+		timestamp, pk = query.validated_data['after']
+		# plain lower bound lets the planner prune partitions, OR doesn't
+		queryset = queryset.filter(
+			Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk),
+			timestamp__gte=timestamp
+		).order_by('timestamp', 'id')[:self.sync_limit]
+		if (wait := query.validated_data['wait']) and waiting.acquire(blocking=False):
+			try:
+				messages = async_to_sync(wait_for)(
+					request.user.id, wait, lambda: list(queryset.all()))
+			finally:
+				waiting.release()
+		else:
+			messages = list(queryset)
+		cursor = request.query_params['after']
+		if messages:
+			cursor = serializers.CursorField().to_representation(messages[-1])
+		return messages, cursor
+
+
+class UserChats:
+	"""User's Chats ordered by `-updated_at`, fetched by slices.
+
+	Slice is taken from Chats created by User and Chats with User
+	as interlocutor separately, each read in order from its index
+	up to the end of the slice, and merged with UNION ALL.
+	Unlike OR of the two, it does not sort all User's Chats for every page.
+	Their number is read from User's counter.
+	"""
+
+	ordered = True
+	ordering = ('-updated_at', '-id')
+
+	def __init__(self, user, queryset):
+		self.user = user
+		self.queryset = queryset
+
+	def count(self):
+		# authenticated User may be cached, the counter is read fresh
+		return models.User.objects.filter(pk=self.user.pk).values_list(
+			'chats_count', flat=True).first() or 0
+
+	def __len__(self):
+		return self.count()
+
+	def __getitem__(self, index):
+		if not isinstance(index, slice) or index.stop is None:
+			raise TypeError("Only slices with stop are supported.")
+		start, stop = index.start or 0, index.stop
+		chats = models.Chat.objects.order_by(*self.ordering).values('id', 'updated_at')
+		ids = [row['id'] for row in chats.filter(creator=self.user)[:stop].union(
+			chats.filter(interlocutor=self.user).exclude(creator=self.user)[:stop],
+			all=True
+		).order_by(*self.ordering)[start:stop]]
+		chats = self.queryset.in_bulk(ids)
+		return [chats[pk] for pk in ids]
+
+
+class UserChatsMixin:
+	"""User's Chats with everything needed for serialization."""
+
+	def get_chats(self):
+		return models.Chat.objects.select_related(
+			'creator___profile__location', 'interlocutor___profile__location',
+			'listing__category', 'listing__location', 'listing__seller__location'
+		).prefetch_related('listing__photos')
 
 
 @method_decorator(
@@ -21,6 +117,7 @@ from quicksell_app import models, serializers
 		operation_description=(
 			"Get paginated list of authenticated User's Chats "
 			"ordered by `timestamp` of `latest_message`. "
+			"`unread` is a number of Messages not read by the User yet. "
 			"`interlocutor` is a Profile of another User in the Chat."
 		)
 	)
@@ -36,32 +133,242 @@ from quicksell_app import models, serializers
 		)
 	)
 )
-class Chat(ListCreateAPIView):
+class Chat(UserChatsMixin, ListCreateAPIView):
 	"""List User's Chats or create new."""
 
 	serializer_class = serializers.Chat
 	permission_classes = (IsAuthenticated,)
 
 	def get_queryset(self):
-		return (
-			models.Chat.objects.filter(creator=self.request.user)
-			| models.Chat.objects.filter(interlocutor=self.request.user)
+		return UserChats(self.request.user, self.get_chats())
+
+
+class ChatListing(GenericAPIView):
+	"""Seller's Listings with Chats about them."""
+
+	serializer_class = serializers.ListingChats
+	permission_classes = (IsAuthenticated,)
+
+	@swagger_auto_schema(
+		operation_id='chat-listing-list',
+		operation_summary="Seller's inbox",
+		operation_description=(
+			"Returns paginated list of authenticated User's Listings "
+			"having Chats, with number of the Chats, number of Messages "
+			"in them unread by the User and time of the latest activity "
+			"`updated_at`, ordered by it."
+		)
+	)
+	def get(self, request):
+		user = request.user
+		inbox = models.Chat.objects.filter(
+			Q(creator=user) | Q(interlocutor=user), listing__seller=user.id
+		).values('listing').annotate(
+			chats=Count('id'),
+			unread=Sum(Case(
+				When(creator=user, then=F('creator_unread')),
+				default=F('interlocutor_unread')
+			)),
+			updated_at=Max('updated_at'),
+		).order_by('-updated_at', '-listing')
+		page = self.paginate_queryset(inbox)
+		listings = models.Listing.objects.select_related(
+			'category', 'location', 'seller__location'
+		).prefetch_related('photos').in_bulk([row['listing'] for row in page])
+		for row in page:
+			row['listing'] = listings[row['listing']]
+		serializer = self.get_serializer(page, many=True)
+		return self.get_paginated_response(serializer.data)
+
+
+@method_decorator(
+	name='get',
+	decorator=swagger_auto_schema(
+		operation_id='chat-listing-detail',
+		operation_summary="Chats about seller's Listing",
+		operation_description=(
+			"Get paginated list of Chats about authenticated User's Listing "
+			"ordered by `timestamp` of `latest_message`."
+		)
+	)
+)
+class ChatListingDetail(UserChatsMixin, ListAPIView):
+	"""Chats about seller's Listing."""
+
+	serializer_class = serializers.Chat
+	permission_classes = (IsAuthenticated,)
+
+	def get_queryset(self):
+		uuid = serializers.Base64UUIDField().to_internal_value(self.kwargs['base64uuid'])
+		listing = get_object_or_404(
+			models.Listing.objects.filter(uuid=uuid, seller=self.request.user.id))
+		user = self.request.user
+		return self.get_chats().filter(
+			Q(creator=user) | Q(interlocutor=user), listing=listing
 		).order_by('-updated_at')
 
 
-class Message(GenericAPIView):
-	"""List Messages from a Chat or post to one, or delete Chat."""
+class ChatUnread(GenericAPIView):
+	"""Total number of unread Messages."""
 
-	serializer_class = serializers.Message
 	permission_classes = (IsAuthenticated,)
 
+	@swagger_auto_schema(
+		operation_id='chat-unread',
+		operation_summary="Unread Messages count",
+		operation_description=(
+			"Returns number of unread Messages in all Chats of authenticated User."
+		),
+		responses={HTTP_200_OK: '{"unread": 0}'}
+	)
+	def get(self, request):
+		unread = models.UnreadCounter.objects.get_count(request.user.pk)
+		return Response({'unread': unread}, status=HTTP_200_OK)
+
+
+search_results = TwoTierCache(
+	'chat-search', settings.CHAT_SEARCH_CACHE['MAXSIZE'],
+	settings.CHAT_SEARCH_CACHE['LOCAL_TTL'])
+
+
+class ChatSearch(GenericAPIView):
+	"""Full-text search in User's Messages.
+
+	Results are cached until Chats of User or their unread counters change.
+	"""
+
+	serializer_class = serializers.MessageSearchResult
+	permission_classes = (IsAuthenticated,)
+	page_size = 20
+
+	@swagger_auto_schema(
+		operation_id='chat-search',
+		operation_summary="Search Messages",
+		operation_description=(
+			f"Returns up to {page_size} Messages from all Chats of authenticated "
+			"User matching `q` (web search syntax: words, \"quoted phrases\", "
+			"`or`, `-excluded`), most relevant first, with matches in `snippet` "
+			"highlighted by `<b>` tags. `cursor` is passed as `after` "
+			"to get the next page, it's null on the last one. "
+			"Messages are not marked as read."
+		),
+		query_serializer=serializers.MessageSearchQuery,
+	)
+	def get(self, request):
+		query = serializers.MessageSearchQuery(data=request.query_params)
+		query.is_valid(raise_exception=True)
+		chats = models.Chat.objects.filter(
+			Q(creator=request.user) | Q(interlocutor=request.user))
+		# new Messages update Chats, deleted Chats change their count,
+		# read ones decrease unread counters
+		*version, created, since = chats.aggregate(
+			Max('updated_at'), Count('id'),
+			Sum(F('creator_unread') + F('interlocutor_unread')),
+			Count('created_at'), Min('created_at')
+		).values()
+		# Messages older than the first Chat are skipped with their partitions,
+		# unless some Chats are older than their `created_at`
+		if created != version[1]:
+			since = None
+		key = (
+			request.user.id, tuple(version), self.page_size,
+			query.validated_data['q'], query.validated_data.get('after')
+		)
+		return Response(search_results.get_or_set(
+			key, lambda: self.search(query.validated_data, chats, since),
+			settings.CHAT_SEARCH_CACHE['TTL']
+		), status=HTTP_200_OK)
+
+	def search(self, query, chats, since=None):
+		search = SearchQuery(query['q'], config='simple', search_type='websearch')
+		# same expression as indexed one, so the index is used;
+		# real rank would not be equal to its value read back from cursor
+		queryset = models.Message.objects.annotate(
+			search=text_search,
+			rank=Cast(SearchRank(text_search, search), FloatField())
+		).filter(search=search, chat__in=chats.values('id'))
+		if since is not None:
+			queryset = queryset.filter(timestamp__gte=since)
+		if after := query.get('after'):
+			rank, pk = after
+			queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=pk))
+		messages = list(
+			queryset.select_related('chat').order_by('-rank', '-id')[:self.page_size + 1])
+		cursor = None
+		if len(messages) > self.page_size:
+			messages = messages[:self.page_size]
+			cursor = serializers.SearchCursorField().to_representation(messages[-1])
+		# headlines are costly, so they are made for the page only
+		snippets = dict(models.Message.objects.filter(
+			id__in=[message.id for message in messages]
+		).annotate(
+			snippet=SearchHeadline('text', search, config='simple')
+		).values_list('id', 'snippet'))
+		for message in messages:
+			message.snippet = snippets[message.id]
+		return {
+			'results': self.get_serializer(messages, many=True).data,
+			'cursor': cursor,
+		}
+
+
+class ChatMixin:
+	"""Chat from url available to its participants only."""
+
 	def get_chat(self, request, base64uuid):
 		uuid = serializers.Base64UUIDField().to_internal_value(base64uuid)
 		chat_object = get_object_or_404(models.Chat.objects.filter(uuid=uuid))
-		if request.user not in (chat_object.creator, chat_object.interlocutor):
+		if request.user.id not in (chat_object.creator_id, chat_object.interlocutor_id):
 			raise PermissionDenied()
 		return chat_object
 
+
+class ChatUpdates(MessageSyncMixin, GenericAPIView):
+	"""New Messages from all User's Chats."""
+
+	serializer_class = serializers.ChatMessage
+	permission_classes = (IsAuthenticated,)
+
+	@swagger_auto_schema(
+		operation_id='chat-updates',
+		operation_summary="New Messages in all Chats",
+		operation_description=(
+			f"Returns up to {MessageSyncMixin.sync_limit} Messages newer than "
+			"`after` cursor from all Chats of authenticated User (old first) "
+			"and `cursor` of the last one. If there are none, waits for them "
+			"up to `wait` seconds, unless the server is busy (WebSocket "
+			"`api/chats/ws/` has no such limit). Without `after` returns "
+			"`cursor` of the latest Message only. Messages are not marked as read."
+		),
+		query_serializer=serializers.MessageSyncQuery,
+	)
+	def get(self, request):
+		chats = models.Chat.objects.filter(
+			Q(creator=request.user) | Q(interlocutor=request.user))
+		queryset = models.Message.objects.filter(
+			chat__in=chats.values('id')).select_related('chat')
+		if 'after' in request.query_params:
+			messages, cursor = self.sync_messages(request, queryset)
+		else:
+			messages, cursor = (), None
+			# the latest Message is in the partition of the latest Chat's one
+			since = chats.aggregate(Max('last_message_timestamp'))[
+				'last_message_timestamp__max']
+			if since and (latest := queryset.filter(
+				timestamp__gte=since).order_by('timestamp', 'id').last()):
+				cursor = serializers.CursorField().to_representation(latest)
+		return Response({
+			'results': self.get_serializer(messages, many=True).data,
+			'cursor': cursor,
+		}, status=HTTP_200_OK)
+
+
+class Message(ChatMixin, MessageSyncMixin, GenericAPIView):
+	"""List Messages from a Chat or post to one, or delete Chat."""
+
+	serializer_class = serializers.Message
+	permission_classes = (IsAuthenticated,)
+
 	@swagger_auto_schema(
 		operation_id='message-list',
 		operation_summary="List Messages in Chat",
@@ -70,15 +377,37 @@ class Message(GenericAPIView):
 			"`is_yours` flag indicates author of the Message. "
 			"`read` flag indicates whether the Message were read by interlocutor.\n"
 			"If `read` == False and `is_yours` == False, "
-			"the message is updated with `read` = True as it was read."
-		)
+			"the message is updated with `read` = True as it was read "
+			"(only Messages returned in the page).\n"
+			"With `after` cursor of a Message returns up to "
+			f"{MessageSyncMixin.sync_limit} newer Messages (old first) "
+			"and `cursor` of the last one, not paginated. "
+			"If there are none, waits for them up to `wait` seconds."
+		),
+		query_serializer=serializers.MessageSyncQuery,
 	)
 	def get(self, request, base64uuid):
-		queryset = self.get_chat(request, base64uuid).messages.order_by('-timestamp')
-		pages = self.paginate_queryset(queryset)
-		serializer = self.get_serializer(pages, many=True)
-		response = self.get_paginated_response(serializer.data)
-		queryset.exclude(author=request.user).update(read=True)
+		chat = self.get_chat(request, base64uuid)
+		if 'after' in request.query_params:
+			messages, cursor = self.sync_messages(request, chat.messages)
+			response = Response({
+				'results': self.get_serializer(messages, many=True).data,
+				'cursor': cursor,
+			}, status=HTTP_200_OK)
+		else:
+			messages = self.paginate_queryset(
+				chat.dated_messages.order_by('-timestamp'))
+			serializer = self.get_serializer(messages, many=True)
+			response = self.get_paginated_response(serializer.data)
+		if unread := [
+			message for message in messages
+			if not message.read and message.author_id != request.user.id
+		]:
+			chat.mark_read(
+				request.user, max(message.timestamp for message in unread),
+				[message.id for message in unread],
+				min(message.timestamp for message in unread)
+			)
 		return response
 
 	@swagger_auto_schema(
@@ -92,7 +421,11 @@ class Message(GenericAPIView):
 		chat = self.get_chat(request, base64uuid)
 		message_author = request.user
 		serializer.save(chat=chat, author=message_author)
-		chat.interlocutor.notify(
+		recipient = (
+			chat.interlocutor if message_author.id == chat.creator_id
+			else chat.creator
+		)
+		recipient.notify(
 			title=message_author.profile.full_name,
 			body=serializer.data['text']
 		)
@@ -105,3 +438,26 @@ class Message(GenericAPIView):
 	def delete(self, request, base64uuid):
 		self.get_chat(request, base64uuid).delete()
 		return Response(status=HTTP_204_NO_CONTENT)
+
+
+class MessageRead(ChatMixin, GenericAPIView):
+	"""Mark Messages in Chat as read."""
+
+	serializer_class = serializers.MessageRead
+	permission_classes = (IsAuthenticated,)
+
+	@swagger_auto_schema(
+		operation_id='message-read',
+		operation_summary="Mark Messages in Chat read",
+		operation_description=(
+			"Marks interlocutor's Messages in Chat with `timestamp` "
+			"up to given one as read. Returns number of newly read Messages."
+		),
+		responses={HTTP_200_OK: '{"read": 0}'}
+	)
+	def post(self, request, base64uuid):
+		serializer = self.get_serializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		chat = self.get_chat(request, base64uuid)
+		count = chat.mark_read(request.user, serializer.validated_data['timestamp'])
+		return Response({'read': count}, status=HTTP_200_OK)
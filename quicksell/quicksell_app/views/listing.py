@@ -10,9 +10,11 @@ from rest_framework.status import (
 	HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT
 )
 
+from quicksell_app.categories import categories
 from quicksell_app.models import Listing as listing_model
 from quicksell_app.serializers import Base64UUIDField
 from quicksell_app.serializers import Listing as listing_serializer
+from quicksell_app.similar import NEIGHBORS
 
 
 class ListingQuerySerializer(Serializer):
@@ -47,8 +49,9 @@ class ListingQuerySerializer(Serializer):
 			filters['price__lte'] = max_price
 		if (condition_new := validated_data.get('condition_new')) is not None:
 			filters['condition_new'] = condition_new
-		if category := validated_data.get('category'):
-			filters['category__name'] = category
+		if category_name := validated_data.get('category'):
+			category = categories.get(category_name)
+			filters['category_id__in'] = category.subtree if category else ()
 		if seller := validated_data.get('seller'):
 			filters['seller__uuid'] = seller
 		return filters
@@ -68,7 +71,8 @@ class Listing(GenericAPIView):
 			"Ten listings per page. Can be ordered by any of "
 			f"{ListingQuerySerializer.orderable_fields} fields. "
 			"If field name prefixed with '-' ordering will be descending. "
-			f"Default ordering is '{ListingQuerySerializer.default_ordering}'."
+			f"Default ordering is '{ListingQuerySerializer.default_ordering}'. "
+			"Filtering by `category` includes its subcategories."
 		),
 		query_serializer=ListingQuerySerializer,
 		security=[],
@@ -157,3 +161,32 @@ class ListingDetail(GenericAPIView):
 		self.check_object_permissions(request, listing)
 		listing.delete()
 		return Response(status=HTTP_204_NO_CONTENT)
+
+
+class ListingSimilar(GenericAPIView):
+	"""Get precomputed similar Listings."""
+
+	queryset = listing_model.objects.filter(
+		status=listing_model.Status.active
+	).select_related('category', 'location', 'seller__location')
+	serializer_class = listing_serializer
+	pagination_class = None
+
+	@swagger_auto_schema(
+		operation_id='listing-similar',
+		operation_summary="Get similar Listings",
+		operation_description=(
+			f"Returns up to {NEIGHBORS} active Listings similar to Listing "
+			"by uuid from query, most similar first. Similarity is based on "
+			"category, title, price and distance, and is updated periodically, "
+			"so new Listings may have no similar Listings yet."
+		),
+		security=[],
+	)
+	def get(self, _request, base64uuid):
+		uuid = Base64UUIDField().to_internal_value(base64uuid)
+		similar = self.get_queryset().filter(
+			similar_to__listing__uuid=uuid
+		).order_by('-similar_to__score').prefetch_related('photos')
+		serializer = self.get_serializer(similar, many=True)
+		return Response(serializer.data, status=HTTP_200_OK)
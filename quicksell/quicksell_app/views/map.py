@@ -0,0 +1,134 @@
+"""Listings on a map."""
+
+from django.conf import settings
+from django.contrib.gis.db.models import Collect
+from django.contrib.gis.db.models.functions import Centroid, SnapToGrid
+from django.contrib.gis.geos import Polygon
+from django.db.models import Count
+from django.http import HttpResponse
+from drf_yasg.utils import swagger_auto_schema
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.fields import CharField, IntegerField
+from rest_framework.generics import GenericAPIView
+from rest_framework.response import Response
+from rest_framework.status import HTTP_200_OK
+
+from quicksell_app.models import Listing as listing_model
+from quicksell_app.serializers import Base64UUIDField, PointField
+from quicksell_app.tiles import LAYER, MAX_ZOOM, get_tile
+
+from .listing import ListingQuerySerializer
+
+TILE_SIZE = 256  # pixels
+
+
+class MapQuerySerializer(ListingQuerySerializer):
+	"""GET Listings on map query serializer."""
+
+	cell_pixels = 60
+	max_cells = 64  # per side of bbox
+
+	bbox = CharField()
+	zoom = IntegerField(min_value=0, max_value=22)
+
+	def validate_bbox(self, bbox):
+		try:
+			x1, y1, x2, y2 = (float(coord) for coord in bbox.split(','))
+		except (ValueError, TypeError) as e:
+			raise ValidationError(
+				"Required format: 'latitude, longitude, latitude, longitude' "
+				"of two opposite corners."
+			) from e
+		return Polygon.from_bbox((min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)))
+
+	def validate(self, attrs):
+		attrs['cell_size'] = 360 * self.cell_pixels / TILE_SIZE / 2 ** attrs['zoom']
+		xmin, ymin, xmax, ymax = attrs['bbox'].extent
+		if max(xmax - xmin, ymax - ymin) > attrs['cell_size'] * self.max_cells:
+			raise ValidationError("Bounding box is too large for this zoom.")
+		return attrs
+
+	def to_representation(self, validated_data):
+		filters = super().to_representation(validated_data)
+		filters['location__coordinates__contained'] = validated_data['bbox']
+		return filters
+
+
+class MapClusters(GenericAPIView):
+	"""Listings in bounding box grouped on a grid."""
+
+	queryset = listing_model.objects.filter(status=listing_model.Status.active)
+	pagination_class = None
+
+	pins_threshold = 200
+
+	@swagger_auto_schema(
+		operation_id='listing-map',
+		operation_summary="Get Listings on map",
+		operation_description=(
+			"Returns active Listings inside `bbox` filtered by query params. "
+			f"If there are no more than {pins_threshold} of them, they are "
+			"returned as `pins`, otherwise as `clusters` on a grid of "
+			f"{MapQuerySerializer.cell_pixels}px cells at `zoom` with `count` "
+			"of Listings and their centroid `coordinates`."
+		),
+		query_serializer=MapQuerySerializer,
+		security=[],
+		responses={HTTP_200_OK: "Pins or clusters."}
+	)
+	def get(self, request):
+		query_serializer = MapQuerySerializer(data=request.query_params)
+		query_serializer.is_valid(raise_exception=True)
+		queryset = self.filter_queryset(self.get_queryset()).filter(
+			**query_serializer.data).order_by()
+		uuid_field, point_field = Base64UUIDField(), PointField()
+		pins = queryset.values_list(
+			'uuid', 'price', 'category_id', 'location__coordinates'
+		)[:self.pins_threshold + 1]
+		if len(pins) <= self.pins_threshold:
+			return Response({'clusters': [], 'pins': [
+				{
+					'uuid': uuid_field.to_representation(uuid),
+					'price': price,
+					'category_id': category_id,
+					'coordinates': point_field.to_representation(point),
+				}
+				for uuid, price, category_id, point in pins
+			]}, status=HTTP_200_OK)
+		clusters = queryset.annotate(cell=SnapToGrid(
+			'location__coordinates', query_serializer.validated_data['cell_size']
+		)).values('cell').annotate(
+			count=Count('id'), center=Centroid(Collect('location__coordinates'))
+		)
+		return Response({'pins': [], 'clusters': [
+			{
+				'count': cluster['count'],
+				'coordinates': point_field.to_representation(cluster['center']),
+			}
+			for cluster in clusters
+		]}, status=HTTP_200_OK)
+
+
+class MapTile(GenericAPIView):
+	"""Active Listings as Mapbox Vector Tile."""
+
+	pagination_class = None
+
+	@swagger_auto_schema(
+		operation_id='listing-map-tile',
+		operation_summary="Get Listings map tile",
+		operation_description=(
+			f"Returns Mapbox Vector Tile `z/x/y` (zoom up to {MAX_ZOOM}) "
+			f"with layer `{LAYER}` of active Listings' points "
+			"with `uuid`, `price` and `category_id` attributes."
+		),
+		security=[],
+		responses={HTTP_200_OK: "application/vnd.mapbox-vector-tile"}
+	)
+	def get(self, _request, z, x, y):
+		if z > MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+			raise NotFound()
+		response = HttpResponse(
+			get_tile(z, x, y), content_type='application/vnd.mapbox-vector-tile')
+		response['Cache-Control'] = f"public, max-age={settings.MAP_TILE_CACHE['TTL']}"
+		return response
@@ -0,0 +1,150 @@
+"""Media files (listings' photos, avatars) serving."""
+
+import io
+import mimetypes
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+from rest_framework.exceptions import NotFound
+from rest_framework.generics import GenericAPIView
+from rest_framework.permissions import AllowAny
+
+from quicksell_app.models import Listing, Profile
+from quicksell_app.models.listing import Photo
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FileRange:
+	"""Part of an opened file, which can be passed to `os.sendfile`.
+
+	Gunicorn sends file-like objects with `fileno()` through `os.sendfile`
+	limited by `Content-Length`, but always from the start of the file,
+	so ranges with offset are read instead.
+	"""
+
+	def __init__(self, file, start, length):
+		self.file = file
+		self.start = start
+		self.remaining = length
+		file.seek(start)
+
+	def fileno(self):
+		if self.start:
+			raise io.UnsupportedOperation("fileno")
+		return self.file.fileno()
+
+	def tell(self):
+		return self.file.tell()
+
+	def seek(self, *args):
+		return self.file.seek(*args)
+
+	def read(self, size=-1):
+		if size < 0 or size > self.remaining:
+			size = self.remaining
+		data = self.file.read(size)
+		self.remaining -= len(data)
+		return data
+
+	def close(self):
+		self.file.close()
+
+
+def parse_range(header, size):
+	"""Returns (start, end) of a single satisfiable byte range or None."""
+	if not (match := RANGE_PATTERN.match(header.replace(' ', ''))):
+		return None
+	start, end = match.groups()
+	if not start:
+		if not end or not int(end):
+			return None
+		return max(size - int(end), 0), size - 1
+	start = int(start)
+	end = min(int(end), size - 1) if end else size - 1
+	if start > end:
+		return None
+	return start, end
+
+
+class Media(GenericAPIView):
+	"""Checks access to a media file, then hands it off to the proxy."""
+
+	permission_classes = (AllowAny,)
+	schema = None
+
+	visible_statuses = (Listing.Status.active, Listing.Status.sold)
+
+	def check_access(self, request, path):
+		if path.startswith(Photo.image.field.upload_to):
+			photo = Photo.objects.select_related('listing__seller').get_or_none(
+				image=path)
+			if not photo:
+				raise NotFound()
+			listing = photo.listing
+			if listing.status not in self.visible_statuses and (
+				not request.user.is_authenticated
+				or request.user.pk != listing.seller.user_id
+			):
+				raise NotFound()
+		elif path.startswith(Profile.avatar.field.upload_to):
+			if not Profile.objects.filter(avatar=path).exists():
+				raise NotFound()
+		else:
+			raise NotFound()
+
+	def get_file_path(self, path):
+		media_root = Path(settings.MEDIA_ROOT).resolve()
+		file_path = (media_root / path).resolve()
+		if media_root not in file_path.parents:
+			raise NotFound()
+		return file_path
+
+	def get(self, request, path):
+		file_path = self.get_file_path(path)
+		self.check_access(request, path)
+		content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+		header = settings.MEDIA_SENDFILE_HEADER
+		if header == 'X-Accel-Redirect':
+			response = HttpResponse(content_type=content_type)
+			response[header] = settings.MEDIA_ACCEL_PREFIX + path
+		elif header == 'X-Sendfile':
+			response = HttpResponse(content_type=content_type)
+			response[header] = str(file_path)
+		else:
+			response = self.serve(request, file_path, content_type)
+		return response
+
+	@staticmethod
+	def serve(request, file_path, content_type):
+		try:
+			stat = file_path.stat()
+		except OSError as err:
+			raise NotFound() from err
+		if not was_modified_since(
+			request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime, stat.st_size
+		):
+			return HttpResponseNotModified()
+		size = stat.st_size
+		start, end = 0, size - 1
+		status = 200
+		if (range_header := request.META.get('HTTP_RANGE')) and size:
+			if not (byte_range := parse_range(range_header, size)):
+				response = HttpResponse(status=416)
+				response['Content-Range'] = f'bytes */{size}'
+				return response
+			start, end = byte_range
+			status = 206
+		length = end - start + 1
+		file = FileRange(open(file_path, 'rb'), start, length)  # pylint: disable=consider-using-with
+		response = FileResponse(file, status=status, content_type=content_type)
+		response['Content-Length'] = length
+		response['Last-Modified'] = http_date(stat.st_mtime)
+		response['Accept-Ranges'] = 'bytes'
+		if status == 206:
+			response['Content-Range'] = f'bytes {start}-{end}/{size}'
+		return response
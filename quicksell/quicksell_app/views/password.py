@@ -4,7 +4,7 @@ from random import randint
 from datetime import datetime
 
 from django.contrib.auth import password_validation
-from django.core.mail import send_mail as django_send_mail
+from django.db import transaction
 
 from rest_framework.serializers import Serializer
 from rest_framework.fields import (
@@ -15,12 +15,12 @@ from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
 from rest_framework.response import Response
 from rest_framework.status import (
 	HTTP_200_OK, HTTP_202_ACCEPTED, HTTP_401_UNAUTHORIZED, HTTP_403_FORBIDDEN)
-from rest_framework.authtoken.models import Token
 
 from drf_yasg.utils import swagger_auto_schema
 
-from quicksell_app.models import User
-from quicksell_app.misc import PasswordResetDaily, PasswordResetHourly
+from quicksell_app.mail import queue_mail
+from quicksell_app.models import AuthToken, User
+from quicksell_app.throttling import PasswordResetDaily, PasswordResetHourly
 
 
 CODE_EXPIRY = 3600  # password reset code lifetime in seconds
@@ -62,10 +62,7 @@ class PasswordChangeSerializer(Serializer):
 
 	def update(self, user, validated_data):
 		user.set_password(validated_data['new_password'])
-		try:
-			user.auth_token.delete()
-		except Token.DoesNotExist:
-			pass
+		user.auth_tokens.all().delete()
 		user.save()
 		return user
 
@@ -80,16 +77,12 @@ class ResetPerformSerializer(Serializer):
 		user.password_reset_code = None
 		user.password_reset_request_time = None
 		user.set_unusable_password()
-		try:
-			user.auth_token.delete()
-		except Token.DoesNotExist:
-			pass
+		user.auth_tokens.all().delete()
 		user.save()
 		return user
 
 	def get_token(self, user):
-		Token.objects.create(user=user)
-		return str(user.auth_token)
+		return AuthToken.objects.issue(user).key
 
 
 class Password(GenericAPIView):
@@ -136,12 +129,13 @@ class Password(GenericAPIView):
 	)
 	def post(self, request, *args, **kwargs):
 		serializer = self.validate_request(request.data)
-		if serializer.instance:
-			serializer.save()
-			msg = MESSAGES['code_sent'].format(serializer.instance.password_reset_code)
-		else:
-			msg = MESSAGES['wrong_email']
-		self.send_mail(msg, serializer.validated_data['email'])
+		with transaction.atomic():
+			if serializer.instance:
+				serializer.save()
+				msg = MESSAGES['code_sent'].format(serializer.instance.password_reset_code)
+			else:
+				msg = MESSAGES['wrong_email']
+			self.send_mail(msg, serializer.validated_data['email'])
 		return Response(status=HTTP_202_ACCEPTED)
 
 	@swagger_auto_schema(
@@ -162,8 +156,9 @@ class Password(GenericAPIView):
 			old_pass = serializer.validated_data.get('old_password')
 			if not old_pass or not serializer.instance.check_password(old_pass):
 				raise AuthenticationFailed("Wrong password.")
-		serializer.save()
-		self.send_mail(MESSAGES['changed'], serializer.instance.email)
+		with transaction.atomic():
+			serializer.save()
+			self.send_mail(MESSAGES['changed'], serializer.instance.email)
 		return Response(status=HTTP_200_OK)
 
 	@swagger_auto_schema(
@@ -189,11 +184,11 @@ class Password(GenericAPIView):
 		reset_time = user.password_reset_request_time
 		if not reset_time or (datetime.now() - reset_time).seconds > CODE_EXPIRY:
 			raise PermissionDenied("Code expired.")
-		serializer.save()
-		self.send_mail(MESSAGES['reset'], user.email)
+		with transaction.atomic():
+			serializer.save()
+			self.send_mail(MESSAGES['reset'], user.email)
 		return Response(serializer.data, status=HTTP_200_OK)
 
 	@staticmethod
 	def send_mail(message, address):
-		django_send_mail("Quicksell Account Notification",
-			message, None, recipient_list=[address])
+		queue_mail("Quicksell Account Notification", message, [address])
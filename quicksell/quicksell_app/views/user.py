@@ -1,7 +1,7 @@
 """User endpoint."""
 
+from django.db import transaction
 from django.urls import reverse
-from django.core.mail import send_mail
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 
@@ -10,12 +10,18 @@ from rest_framework.response import Response
 from rest_framework.generics import GenericAPIView
 from rest_framework.renderers import TemplateHTMLRenderer, JSONRenderer
 from rest_framework.exceptions import ValidationError
-from rest_framework.status import HTTP_200_OK, HTTP_201_CREATED
+from rest_framework.status import (
+	HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT
+)
 
-from drf_yasg.utils import swagger_auto_schema
+from drf_yasg.utils import no_body, swagger_auto_schema
 
+from quicksell_app.mail import queue_mail
+from quicksell_app.models import AuthToken, Device
 from quicksell_app.models import User as user_model
+from quicksell_app.serializers import Login as login_serializer
 from quicksell_app.serializers import User as user_serializer
+from quicksell_app.throttling import LoginIPThrottle, LoginThrottle, SignupThrottle
 
 
 class EmailVerificationTokenGenerator(PasswordResetTokenGenerator):
@@ -39,6 +45,7 @@ class User(GenericAPIView):
 		super().setup(request, *args, **kwargs)
 		if request.method == 'POST':
 			self.permission_classes = (AllowAny,)
+			self.throttle_classes = (SignupThrottle,)
 
 	@swagger_auto_schema(
 		operation_id='user-details',
@@ -63,18 +70,19 @@ class User(GenericAPIView):
 	def post(self, request, *args, **kwargs):
 		serializer = self.get_serializer(data=request.data)
 		serializer.is_valid(raise_exception=True)
-		serializer.save()
-		email = serializer.validated_data['email']
-		url_path = reverse('email-confirm', args=(
-			urlsafe_base64_encode(email.encode()),
-			token_generator.make_token(serializer.instance)
-		))
-		verification_link = request.build_absolute_uri(url_path)
-		send_mail(
-			"Activate Your Quicksell Account",
-			"Click the link to confirm your email:\n" + verification_link,
-			None, recipient_list=[email]
-		)
+		with transaction.atomic():
+			serializer.save()
+			email = serializer.validated_data['email']
+			url_path = reverse('email-confirm', args=(
+				urlsafe_base64_encode(email.encode()),
+				token_generator.make_token(serializer.instance)
+			))
+			verification_link = request.build_absolute_uri(url_path)
+			queue_mail(
+				"Activate Your Quicksell Account",
+				"Click the link to confirm your email:\n" + verification_link,
+				[email]
+			)
 		return Response(serializer.data, status=HTTP_201_CREATED)
 
 	@swagger_auto_schema(
@@ -112,3 +120,57 @@ class EmailConfirm(GenericAPIView):
 		user.is_email_verified = True
 		user.save()
 		return Response(status=HTTP_200_OK)
+
+
+class Login(GenericAPIView):
+	"""Get API token."""
+
+	serializer_class = login_serializer
+	permission_classes = (AllowAny,)
+	throttle_classes = (LoginIPThrottle, LoginThrottle)
+
+	@swagger_auto_schema(
+		operation_id='login',
+		operation_summary="Log in",
+		operation_description=(
+			"Returns new API token for User's device by email as `username` "
+			"and password. The device is identified by `fcm_id`, it becomes "
+			"the one to get User's push notifications, previous token "
+			"of the device is revoked, tokens of other devices stay valid. "
+			"Token expires if it's not used until `expires`, "
+			"every use postpones it."
+		),
+		responses={HTTP_200_OK: '{"token": "string", "expires": "date-time"}'},
+		security=[],
+	)
+	def post(self, request):
+		serializer = self.get_serializer(data=request.data)
+		if not serializer.is_valid():
+			LoginThrottle().failed(request, self)
+			raise ValidationError(serializer.errors)
+		user = serializer.validated_data['user']
+		device = None
+		if fcm_id := serializer.validated_data.get('fcm_id'):
+			device = Device.objects.register(fcm_id)
+			if user.device_id != device.id:
+				user.device = device
+				user.save(update_fields=['device'])
+		token = AuthToken.objects.issue(user, device)
+		return Response(
+			{'token': token.key, 'expires': token.expires}, status=HTTP_200_OK)
+
+
+class Logout(GenericAPIView):
+	"""Revoke API token."""
+
+	permission_classes = (IsAuthenticated,)
+
+	@swagger_auto_schema(
+		operation_id='logout',
+		operation_summary="Log out",
+		operation_description="Revokes API token used in the request.",
+		request_body=no_body,
+	)
+	def delete(self, request):
+		AuthToken.objects.filter(key=request.auth.key).delete()
+		return Response(status=HTTP_204_NO_CONTENT)